@@ -1,17 +1,96 @@
 """
 The API provided by the connector
 """
-from brewpi.stateful.cbox import OneWireBus, PinSwitchesCollection, SwitchesCollection
+import logging
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+
+from brewpi.connector.discovery import Connection, ParallelHandshake, config_endpoints, serial_endpoint
+from brewpi.connector.board import BoardFullError, ValueBoard
+from brewpi.connector.delivery import ListenerQueue, latest
+from brewpi.connector.hotplug import DeviceWatcher
+from brewpi.connector.ioloop import IOLoop
+from brewpi.protocol.identity import ProtocolCache
+from brewpi.protocol.stats import LatencyHistogram
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.v02x import ControllerProtocolV023
+from brewpi.stateful.cbox import OneWireBus, PinSwitchesCollection, ReferenceIndex, SwitchesCollection
 from brewpi.stateful.cbox import TempSensorsCollection
 from controlbox.stateful.api import Profile, RootContainer, ControlboxObject
 
+logger = logging.getLogger(__name__)
+
 
 class EventSource:
-    def add_listener(self, listener):
-        """adds a listener to this event source"""
+    """ Notifies listeners of events. The listeners are held in an immutable tuple that is replaced when a listener
+    is added or removed, so firing an event never waits for a lock.
+    A listener is called on the thread firing the event, unless it is added with an overflow policy, in which case
+    it has its own queue and delivery thread. See brewpi.connector.delivery. """
+
+    def __init__(self):
+        self._listeners = ()    # (listener, ListenerQueue or None)
+        self._listeners_lock = threading.Lock()
+        self._dispatch_latency = LatencyHistogram()
+        self._dispatch_times = deque()      # seconds spent firing each event, not yet recorded
+        self._latency_lock = threading.Lock()
+
+    @property
+    def dispatch_latency(self) -> LatencyHistogram:
+        """ microseconds spent firing each event """
+        with self._latency_lock:
+            self._record_dispatch_times()
+            return self._dispatch_latency
+
+    def _record_dispatch_times(self):
+        times = self._dispatch_times
+        while times:
+            self._dispatch_latency.record(times.popleft() * 1000000)
+
+    def add_listener(self, listener, overflow=None, max_queued=256, key=None, merge=latest):
+        """adds a listener to this event source
+        :param overflow: when given, events are queued for the listener and delivered on its own thread, and
+            this is the policy applied when more than max_queued events are waiting: drop_oldest, merge_latest
+            or block.
+        :param key: gives a hashable key for the object an event is about. Required for the merge_latest policy.
+        :param merge: combines a queued event with a later one for the same object, for the merge_latest policy
+        """
+        queue = ListenerQueue(listener, max_queued, overflow, key, merge) if overflow is not None else None
+        with self._listeners_lock:
+            self._listeners = self._listeners + ((listener, queue),)
 
     def remove_listener(self, listener):
         """removes a listener from this event source"""
+        with self._listeners_lock:
+            removed = [q for x, q in self._listeners if x == listener and q is not None]
+            self._listeners = tuple((x, q) for x, q in self._listeners if x != listener)
+        for queue in removed:
+            queue.stop()
+
+    def fire(self, event):
+        """ calls each listener with the event. An exception from one listener does not prevent the others
+        being notified. """
+        start = time.monotonic()
+        for listener, queue in self._listeners:
+            try:
+                if queue is not None:
+                    queue.put(event)
+                else:
+                    listener(event)
+            except Exception as e:
+                logger.exception(e)
+        self._dispatch_times.append(time.monotonic() - start)
+        # the times are recorded by whichever thread finds the histogram free, so firing never waits for another
+        if self._latency_lock.acquire(blocking=False):
+            try:
+                self._record_dispatch_times()
+            finally:
+                self._latency_lock.release()
+
+    def listener_stats(self):
+        """ the queue depth and delivery counts and latency for each queued listener """
+        return [(x, q.snapshot()) for x, q in self._listeners if q is not None]
 
 
 class ControlboxController(EventSource):
@@ -32,12 +111,146 @@ class ControlboxController(EventSource):
         """provides an observable set of Profiles that is updated as profiles are created and remoed."""
 
 
+SetChanged = namedtuple('SetChanged', ['source', 'added', 'removed'])
+SetChanged.__doc__ = """ The items added to and removed from an ObservableSet in one update cycle """
+
+
 class ObservableSet(EventSource):
-    """ provides a iterable of items and the ability to listen to them """
+    """ provides a iterable of items and the ability to listen to them
+
+    The items are held in an immutable snapshot that is replaced on each update, so iterating never blocks, nor
+    is blocked by, changes to the set. Changes made within a batch() are applied as a single update and reported
+    to listeners as one SetChanged event. An item that is added and removed again within the batch is not reported.
+    Events are delivered in the order the updates were made, even when the set is updated from several threads.
+    """
+
+    def __init__(self, key=None):
+        """
+        :param key: a function giving the key that identifies an item. Defaults to the item itself.
+        """
+        super().__init__()
+        self._key = key or (lambda item: item)
+        self._items = dict()        # key -> item. Never modified once published.
+        self._values = ()
+        self._lock = threading.RLock()
+        self._publish_lock = threading.RLock()  # held from publishing an update until its event is delivered
+        self._depth = 0
+        self._added = dict()
+        self._removed = dict()
+
+    def add_listener(self, listener, overflow=None, max_queued=256):
+        """adds a listener to this set. With the merge_latest policy, the changes in queued events are combined.
+        See EventSource.add_listener """
+        super().add_listener(listener, overflow, max_queued, lambda event: event.source, self._combine)
+
+    def _combine(self, queued: SetChanged, event: SetChanged) -> SetChanged:
+        """ the changes of two consecutive events, as one event """
+        key = self._key
+        added = OrderedDict((key(item), item) for item in queued.added)
+        removed = OrderedDict((key(item), item) for item in queued.removed)
+        for item in event.removed:
+            k = key(item)
+            if added.get(k) is item:
+                del added[k]
+            else:
+                removed[k] = item
+        for item in event.added:
+            k = key(item)
+            if removed.get(k) is item:
+                del removed[k]
+            else:
+                added[k] = item
+        return SetChanged(self, tuple(added.values()), tuple(removed.values()))
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, item):
+        return self._key(item) in self._items
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def snapshot(self):
+        """ the items currently in the set, as a tuple """
+        return self._values
+
+    def get(self, key, default=None):
+        """ retrieves the item with the given key """
+        return self._items.get(key, default)
+
+    def add(self, item):
+        with self.batch():
+            key = self._key(item)
+            if self._removed.pop(key, None) is None and key not in self._items:
+                self._added[key] = item
+            elif key in self._items and self._items[key] is not item:
+                # a replacement is reported as the old item removed and the new one added
+                self._removed[key] = self._items[key]
+                self._added[key] = item
+
+    def remove(self, item):
+        self.discard(self._key(item))
+
+    def discard(self, key):
+        """ removes the item with the given key, if present """
+        with self.batch():
+            if self._added.pop(key, None) is None and key in self._items:
+                self._removed[key] = self._items[key]
+
+    def update(self, added=(), removed=()):
+        """ adds and removes items in a single update """
+        with self.batch():
+            for item in removed:
+                self.remove(item)
+            for item in added:
+                self.add(item)
+
+    @contextmanager
+    def batch(self):
+        """ defers publishing changes until the outermost batch completes """
+        event = None
+        try:
+            with self._lock:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                    if not self._depth:
+                        event = self._publish()
+                        if event is not None:
+                            # taken before the set is unlocked, so the next update is delivered after this one
+                            self._publish_lock.acquire()
+        finally:
+            if event is not None:
+                try:
+                    self.fire(event)
+                finally:
+                    self._publish_lock.release()
+
+    def _publish(self):
+        if not self._added and not self._removed:
+            return None
+        items = dict(self._items)
+        for key in self._removed:
+            del items[key]
+        items.update(self._added)
+        event = SetChanged(self, tuple(self._added.values()), tuple(self._removed.values()))
+        self._added, self._removed = dict(), dict()
+        self._items, self._values = items, tuple(items.values())
+        return event
 
 
 class ControllersSet(ObservableSet):
-    """Contains possibly a mixed set of types for the different controllers available. """
+    """Contains possibly a mixed set of types for the different controllers available.
+    The controllers are keyed by the identity of their endpoint. """
+
+    def __init__(self):
+        super().__init__(lambda controller: controller.identity)
 
 
 class BrewpiConnector:
@@ -48,23 +261,229 @@ class BrewpiConnector:
             discovery: a list of {type: t, propery:value} values describing the different types of
             ways controllers can be discovered.
                 { type: serial }
+                { type: tcp, host: <host>, port: <port> }
                 { type: executable, path: <path> }
                 { type: mdns }
+            max_parallel_handshakes: the number of endpoints probed at once. Defaults to 16.
+            handshake_timeout: the seconds an endpoint has to identify its protocol. Defaults to 10.
+            request_timeout: the seconds a request to a controller waits for its response. Defaults to 5.
+            protocol_cache: a file used to remember the protocol of each endpoint between runs. Optional.
+            hotplug: when true (the default) serial devices are detected as they are plugged in and removed,
+                where the platform supports it.
+            hotplug_settle: the seconds to wait after a device appears before opening it. Defaults to 1.
+            poll_interval: the seconds between scans for endpoints that cannot notify when they appear.
+                Defaults to 30.
+            io_loop: when true, the controllers that support it are read by a single IOLoop thread, rather
+                than each having its own reader thread. Defaults to false.
+            value_board: a file where the latest values reported by the controllers are published for other
+                processes to read. See brewpi.connector.board. Optional.
         """
+        self.config = config
+        self.timer_wheel = TimerWheel()
+        cache_path = config.get('protocol_cache')
+        self._handshake = ParallelHandshake(config.get('max_parallel_handshakes', 16),
+                                            config.get('handshake_timeout', 10), self.timer_wheel,
+                                            ProtocolCache(cache_path, timer_wheel=self.timer_wheel)
+                                            if cache_path else None, self._configure, self._stale)
+        self._controllers = ControllersSet()
+        self._probing = set()
+        self._lock = threading.RLock()
+        self._probed = threading.Condition(self._lock)
+        self._watcher = None
+        self._poller = None
+        self._stop = threading.Event()
+        self._loop = IOLoop(self.timer_wheel) if config.get('io_loop') else None
+        self._looped = set()
+        board_path = config.get('value_board')
+        self.board = ValueBoard(board_path) if board_path else None
+
+    @property
+    def _discovery(self):
+        return self.config.get('discovery', ())
+
+    def endpoints(self):
+        """ the endpoints described by the discovery configuration """
+        return config_endpoints(self._discovery)
+
+    def serial_endpoints(self):
+        """ the serial endpoints described by the discovery configuration """
+        return config_endpoints([d for d in self._discovery if d.get('type') == 'serial'])
+
+    def polled_endpoints(self):
+        """ the endpoints that are found by periodically scanning, rather than by notification """
+        if self._watcher is None:
+            return self.endpoints()
+        return config_endpoints([d for d in self._discovery if d.get('type') != 'serial'])
 
     def controllers(self) -> ControllersSet:
-        """ Retrieves an observable set of controllers. As controllers are detected or disconnected
-         the set changes. """
+        """ Retrieves the connections to the controllers that have been detected. The set is updated as
+        controllers are connected and removed. """
+        return self._controllers
 
     def shutdown(self):
         """Disconnects all controllers and stops controller discovery.
         :return:
         """
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+        with self._lock:
+            connections = self._controllers.snapshot()
+            self._controllers.update(removed=connections)
+        for c in connections:
+            self._disconnect(c)
+        if self._loop is not None:
+            self._loop.stop()
+        self.timer_wheel.stop()
+        if self.board is not None:
+            self.board.close()
 
     def startup(self):
         """starts controller discovery to begin detecting controllers and maintaining their state.
-        :return:
+        All the candidate endpoints are probed concurrently. Serial devices are detected as they are plugged in,
+        from before the initial probe so none are missed, and other endpoints are scanned every poll_interval.
+        :return: a dict of the exceptions for the endpoints where no controller was found, keyed by identity
+        """
+        self._stop.clear()
+        if self._loop is not None:
+            self._loop.start()
+        else:
+            self.timer_wheel.start()
+        self._start_watcher()
+        failures = self.probe(self.endpoints())
+        self._start_poller()
+        return failures
+
+    def probe(self, endpoints):
+        """ handshakes with the endpoints that are not already connected or being probed, and adds the
+        controllers found.
+        :return: a dict of the exceptions for the endpoints where no controller was found, keyed by identity
         """
+        with self._lock:
+            controllers, probing = self._controllers, self._probing
+            endpoints = [e for e in endpoints if controllers.get(e.identity) is None and e.identity not in probing]
+            self._probing.update(e.identity for e in endpoints)
+        try:
+            connections, failures = self._handshake.run(endpoints)
+            with self._controllers.batch():
+                for c in connections:
+                    self._connected(c)
+        finally:
+            with self._lock:
+                self._probing.difference_update(e.identity for e in endpoints)
+                self._probed.notify_all()
+        return failures
+
+    def _start_watcher(self):
+        serial = [d for d in self._discovery if d.get('type') == 'serial']
+        if serial and self._watcher is None and self.config.get('hotplug', True) and DeviceWatcher.available():
+            baudrate = serial[0].get('baudrate', 57600)
+            watcher = DeviceWatcher(lambda device: self._device_added(device, baudrate), self._device_removed,
+                                    on_overflow=self._rescan_serial)
+            try:
+                watcher.start()
+                self._watcher = watcher
+            except OSError as e:
+                logger.warning("serial hotplug unavailable, polling instead: %s", e)
+
+    def _start_poller(self):
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name="endpoint poller", daemon=True)
+            self._poller.start()
+
+    def _poll(self):
+        interval = self.config.get('poll_interval', 30)
+        while not self._stop.wait(interval):
+            try:
+                self.probe(self.polled_endpoints())
+            except Exception as e:
+                logger.exception(e)
+
+    def _device_added(self, device, baudrate):
+        def probe():
+            # give udev time to set the permissions on the new device node
+            if not self._stop.wait(self.config.get('hotplug_settle', 1)):
+                self.probe([serial_endpoint(device, baudrate)])
+        threading.Thread(target=probe, name="probe %s" % device, daemon=True).start()
+
+    def _rescan_serial(self):
+        """ device events were lost, so the serial controllers whose device has gone are removed, and the
+        serial ports probed again """
+        def rescan():
+            try:
+                endpoints = self.serial_endpoints()
+                devices = set(e.device for e in endpoints)
+                for c in self._controllers.snapshot():
+                    device = getattr(c.endpoint, 'device', None)
+                    if device is not None and device not in devices:
+                        self._device_removed(device)
+                self.probe(endpoints)
+            except Exception as e:
+                logger.exception(e)
+        threading.Thread(target=rescan, name="serial rescan", daemon=True).start()
+
+    def _device_removed(self, device):
+        with self._lock:
+            removed = [c for c in self._controllers if getattr(c.endpoint, 'device', None) == device]
+            self._controllers.update(removed=removed)
+        for c in removed:
+            self._disconnect(c)
+
+    def _configure(self, protocol):
+        """ gives a newly constructed protocol handler its request deadlines """
+        if isinstance(protocol, ControllerProtocolV023):
+            protocol.timer_wheel = self.timer_wheel
+            protocol.timeout = self.config.get('request_timeout', 5)
+
+    def _stale(self, identity):
+        """ the cached protocol for the endpoint was wrong, so the connection is dropped and the endpoint
+        probed again, once its handshake has completed """
+        def reconnect():
+            with self._lock:
+                self._probed.wait_for(lambda: identity not in self._probing)
+                connection = self._controllers.get(identity)
+                if connection is None:
+                    return
+                self._controllers.remove(connection)
+            self._disconnect(connection)
+            if not self._stop.is_set():
+                self.probe([connection.endpoint])
+        threading.Thread(target=reconnect, name="reconnect %s" % identity, daemon=True).start()
+
+    def _connected(self, connection: Connection):
+        protocol = connection.protocol
+        if self.board is not None and hasattr(protocol, 'changes'):
+            protocol.changes.add_listener(lambda changes: self._publish(connection.identity, changes))
+        if self._loop is not None and hasattr(protocol, 'data_received'):
+            self._looped.add(connection.identity)
+            self._loop.register(connection.conduit.input, protocol, lambda p: self._lost(connection))
+        else:
+            protocol.start_background_thread()
+        self._controllers.add(connection)
+
+    def _publish(self, identity, changes):
+        try:
+            self.board.publish_changes(identity, changes)
+        except (ValueError, BoardFullError) as e:
+            logger.warning("unable to publish values of %s: %s", identity, e)
+
+    def _lost(self, connection: Connection):
+        """ the controller closed the connection """
+        logger.info("lost connection to %s", connection.identity)
+        self._controllers.remove(connection)
+        self._disconnect(connection)
+
+    def _disconnect(self, connection: Connection):
+        if connection.identity in self._looped:
+            self._looped.discard(connection.identity)
+            self._loop.unregister(connection.conduit.input)
+        else:
+            connection.protocol.stop_background_thread()
+        connection.close()
 
 
 class OneWireTemperatureSensor(ControlboxObject):
@@ -93,7 +512,7 @@ class Device:
 class TempSensorDevice(Device):
     def __init__(self, app, installed_type, initial_value=None):
         super().__init__(app, installed_type)
-        self._value = None
+        self._value = initial_value
 
     @property
     def value(self):
@@ -104,8 +523,9 @@ class AvailableOneWireTemperatureSensor(TempSensorDevice):
     """
     A temperature sensor that is available on the bus, but is not part of the installed temperature sensors.
     """
-    def __init__(self, app):
-        super().__init__(app, OneWireTemperatureSensor)
+    def __init__(self, app, address, initial_value=None):
+        super().__init__(app, OneWireTemperatureSensor, initial_value)
+        self.address = address
 
 
 class AnalogInputTemperatureSensor(TempSensorDevice):
@@ -134,6 +554,30 @@ class AvailablePinActuator(Device):
 class BrewpiApplication:
     """Knows about the specifics of the brewpi application, such as the location of well known objects"""
 
+    def __init__(self, temp_sensors: TempSensorsCollection = None, switches: SwitchesCollection = None,
+                 onewire_buses=None, references: ReferenceIndex = None):
+        """
+        :param temp_sensors: the installed temperature sensors
+        :param switches: the installed switches
+        :param onewire_buses: a dict of the OneWireBus objects, keyed by ID. The bus with ID None is the default.
+        :param references: the index of the objects referring to each object in the profile
+        """
+        self._temp_sensors = temp_sensors
+        self._switches = switches
+        self._onewire_buses = onewire_buses or dict()
+        self.references = references if references is not None else ReferenceIndex()
+
+    def object_created(self, obj):
+        """ updates the installed devices and references from an object lifetime event """
+        for index in (self._temp_sensors, self._switches, self.references):
+            if index is not None:
+                index.object_created(obj)
+
+    def object_deleted(self, id):
+        for index in (self._temp_sensors, self._switches, self.references):
+            if index is not None:
+                index.object_deleted(id)
+
     @classmethod
     def as_brewpi_profile(self, Profile) -> "BrewpiApplication":
         """determines if the given profile is a brewpi profile.
@@ -144,6 +588,7 @@ class BrewpiApplication:
         """ retrieves the collection of temperature sensor objects installed in the system.
         Temp sensors are stored in a dedicated container.
         todo - what's the use case for this? """
+        return self._temp_sensors
 
     def installed_switches(self) -> SwitchesCollection:
         """
@@ -151,16 +596,27 @@ class BrewpiApplication:
         Actuators are stored in a dedicated container.
         :return:
         """
+        return self._switches
 
     def unassigned_temp_sensors(self):
         """finds the installed temperature sensors that are not assigned to a PID. """
+        return self._unreferenced(self._temp_sensors)
 
     def unassigned_actuators(self):
         """finds the installed actuators that are not assigned to a PID. """
+        return self._unreferenced(self._switches)
+
+    def _unreferenced(self, collection):
+        return [obj for id, obj in collection.all().items() if not self.references.is_referenced(id)]
+
+    def users_of(self, obj):
+        """ finds the ids of the objects, such as PIDs, that refer to the given object """
+        return self.references.referrers(obj.id_chain)
 
     # hardware
     def onewire_bus(self, id=None) -> OneWireBus:
         """ retrieves the onewire bus for the given ID. The default ID returns the default OneWire bus"""
+        return self._onewire_buses.get(id)
 
     def pin_actuators_container(self) -> PinSwitchesCollection:
         """ retrieves the fixed collection of build-in GPIO switches. May be empty """
@@ -170,7 +626,14 @@ class BrewpiApplication:
         """ determines all temp sensors that are available for installation.
         Returns TempSensor objects that are transient. The value can be read, but the sensor is
         not installed in the system until
+        The bus is searched once for DS18B20 sensors, and those already installed are left out. The controller
+        only measures installed sensors, so the values of the available sensors are not known.
+        Use installed_temp_sensors().all_values() to read the installed sensors together.
         """
+        installed = set(bytes(a.address) for a in self._temp_sensors.all_onewire_addresses())
+        return [AvailableOneWireTemperatureSensor(self, address)
+                for address in self.onewire_bus().search_family(TempSensorsCollection.family_ds18b20)
+                if bytes(address.address) not in installed]
 
     def available_switches(self):
         """ determines all temp sensors on the bus that are available for installation """
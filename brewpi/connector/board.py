@@ -0,0 +1,249 @@
+"""
+Publishes the latest value of each controller object to a memory-mapped file, so other processes on the host,
+such as a web UI, an alerting daemon and a logger, can read current values without a connection to the
+connector and without a system call per read.
+
+The file has a fixed layout: a header, followed by a fixed number of equal sized slots. A slot is assigned to
+each key the first time it is written, and keeps that key until the board is recreated.
+
+    header      magic 'BPVB', layout version, slot count, key size, value size, replaced, slots used  (7 x uint32)
+    slot        sequence (uint32), key length (uint16), value length (uint16), time (double),
+                key (key size bytes), value (value size bytes, JSON)
+
+Each slot is guarded by a seqlock. The writer makes the sequence odd before changing the slot and even again
+afterwards. A reader copies the slot, and accepts the copy only if the sequence was even and did not change
+while it was copying, otherwise it tries again. Readers never block the writer. There must be a single writer.
+
+A board is never truncated or reused. A new writer, such as after the connector restarts, builds a new file and
+renames it over the old one, then sets the replaced flag in the old board. Readers check the flag on each read,
+and reopen the path when it is set.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+header = struct.Struct('<4sIIIIII')
+slot_header = struct.Struct('<IHHd')
+magic = b'BPVB'
+layout_version = 2
+replaced_offset = header.size - 8
+used_offset = header.size - 4
+
+
+class BoardFullError(Exception):
+    """ There is no free slot for a new key. """
+
+
+class ValueBoard:
+    """ The writer of a value board """
+
+    def __init__(self, path, slots=4096, key_size=96, value_size=152, clock=time.time):
+        """
+        Creates the board file, replacing any existing file. The readers of an existing board move to the new one.
+        :param path: the file to create. A file in /dev/shm avoids any disk writes.
+        :param slots: the number of keys the board can hold
+        :param key_size: the longest key, in bytes once UTF-8 encoded
+        :param value_size: the longest value, in bytes once JSON encoded
+        :param clock: gives the time recorded with each value
+        """
+        self.path = path
+        self.slots = slots
+        self.key_size = key_size
+        self.value_size = value_size
+        self.clock = clock
+        self.slot_size = slot_header.size + key_size + value_size
+        size = header.size + slots * self.slot_size
+        # the board is built in a new file, since truncating a file that readers have mapped would crash them
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, temp = tempfile.mkstemp(prefix='.' + name, dir=directory)
+        try:
+            os.fchmod(fd, 0o644)
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        except Exception:
+            os.unlink(temp)
+            raise
+        finally:
+            os.close(fd)
+        header.pack_into(self._map, 0, magic, layout_version, slots, key_size, value_size, 0, 0)
+        try:
+            previous = os.open(path, os.O_RDWR)
+        except OSError:
+            previous = None
+        try:
+            os.replace(temp, path)
+        except Exception:
+            os.unlink(temp)
+            self._map.close()
+            if previous is not None:
+                os.close(previous)
+            raise
+        if previous is not None:
+            _mark_replaced(previous)
+        self._index = dict()    # key -> slot number
+        self._lock = threading.Lock()
+
+    def _offset(self, slot):
+        return header.size + slot * self.slot_size
+
+    def put(self, key, value):
+        """ publishes the latest value for the key """
+        encoded = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if len(encoded) > self.value_size:
+            raise ValueError("value for %s is %d bytes, more than %d" % (key, len(encoded), self.value_size))
+        with self._lock:
+            slot = self._index.get(key)
+            new = slot is None
+            if new:
+                slot = self._allocate(key)
+            offset = self._offset(slot)
+            sequence = struct.unpack_from('<I', self._map, offset)[0]
+            struct.pack_into('<I', self._map, offset, sequence + 1)
+            if new:
+                key_bytes = key.encode('utf-8')
+                struct.pack_into('<H', self._map, offset + 4, len(key_bytes))
+                start = offset + slot_header.size
+                self._map[start:start + len(key_bytes)] = key_bytes
+            struct.pack_into('<Hd', self._map, offset + 6, len(encoded), self.clock())
+            start = offset + slot_header.size + self.key_size
+            self._map[start:start + len(encoded)] = encoded
+            struct.pack_into('<I', self._map, offset, sequence + 2)
+            if new:
+                # the slot is complete before readers are told it is in use
+                struct.pack_into('<I', self._map, used_offset, len(self._index))
+
+    def _allocate(self, key):
+        if len(key.encode('utf-8')) > self.key_size:
+            raise ValueError("key %s is longer than %d bytes" % (key, self.key_size))
+        if len(self._index) >= self.slots:
+            raise BoardFullError("no slot for %s" % key)
+        slot = self._index[key] = len(self._index)
+        return slot
+
+    def publish_changes(self, prefix, changes):
+        """ publishes the values in a ValueChanges. Removed values are published as None.
+        :param prefix: prepended to the field names to form the keys, such as the controller identity
+        """
+        key = "%s/%s/" % (prefix, changes.response_key.decode('ascii'))
+        for values in (changes.added, changes.changed):
+            for name, value in values.items():
+                self.put(key + name, value)
+        for name in changes.removed:
+            self.put(key + name, None)
+
+    def close(self):
+        self._map.close()
+
+
+def _mark_replaced(fd):
+    """ tells the readers of the board in the file, if it is one, that it has been replaced, and closes the file """
+    try:
+        if os.fstat(fd).st_size < header.size:
+            return
+        with mmap.mmap(fd, header.size) as m:
+            found, version = header.unpack_from(m, 0)[:2]
+            if found == magic and version == layout_version:
+                struct.pack_into('<I', m, replaced_offset, 1)
+    finally:
+        os.close(fd)
+
+
+class BoardReader:
+    """ Reads consistent values from a value board written by another process """
+
+    def __init__(self, path, retries=1000):
+        """
+        :param path: the board file
+        :param retries: the number of times a slot that is being written is read again before giving up
+        """
+        self.path = path
+        self.retries = retries
+        self._map = None
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            board = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        found, version, slots, key_size, value_size = header.unpack_from(board, 0)[:5]
+        if found != magic or version != layout_version:
+            board.close()
+            raise ValueError("%s is not a value board" % self.path)
+        if self._map is not None:
+            self._map.close()
+        self._map = board
+        self.slots, self.key_size, self.value_size = slots, key_size, value_size
+        self.slot_size = slot_header.size + key_size + value_size
+        self._index = dict()
+        self._scanned = 0
+
+    def _check_replaced(self):
+        """ moves to the new board when the writer has replaced this one """
+        if struct.unpack_from('<I', self._map, replaced_offset)[0]:
+            self._open()
+
+    def _offset(self, slot):
+        return header.size + slot * self.slot_size
+
+    def _read_slot(self, slot):
+        """ :return: a consistent copy of the slot's bytes """
+        offset = self._offset(slot)
+        end = offset + self.slot_size
+        for _ in range(self.retries):
+            before = struct.unpack_from('<I', self._map, offset)[0]
+            if before & 1:
+                # let a writer in this process finish
+                time.sleep(0)
+                continue
+            data = self._map[offset:end]
+            if struct.unpack_from('<I', self._map, offset)[0] == before:
+                return data
+        raise TimeoutError("slot %d is being written continuously" % slot)
+
+    def _slot_key(self, data):
+        key_length = slot_header.unpack_from(data)[1]
+        return bytes(data[slot_header.size:slot_header.size + key_length]).decode('utf-8')
+
+    def _refresh(self):
+        self._check_replaced()
+        used = struct.unpack_from('<I', self._map, used_offset)[0]
+        for slot in range(self._scanned, used):
+            self._index[self._slot_key(self._read_slot(slot))] = slot
+        self._scanned = used
+
+    def keys(self):
+        self._refresh()
+        return list(self._index)
+
+    def get(self, key, default=None):
+        """ :return: a tuple of the latest value for the key and the time it was written, or default """
+        self._check_replaced()
+        slot = self._index.get(key)
+        if slot is None:
+            self._refresh()
+            slot = self._index.get(key)
+            if slot is None:
+                return default
+        data = self._read_slot(slot)
+        if self._slot_key(data) != key:
+            # the index does not describe this board, so it is built again
+            self._index, self._scanned = dict(), 0
+            self._refresh()
+            slot = self._index.get(key)
+            if slot is None:
+                return default
+            data = self._read_slot(slot)
+        _, _, value_length, written = slot_header.unpack_from(data)
+        start = slot_header.size + self.key_size
+        return json.loads(data[start:start + value_length].decode('utf-8')), written
+
+    def snapshot(self, prefix=''):
+        """ the latest values of all the keys starting with the prefix, as a dict of key to (value, time) """
+        self._refresh()
+        return dict((key, self.get(key)) for key in list(self._index) if key.startswith(prefix))
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,145 @@
+"""
+Delivers events to a listener on its own thread, so a slow listener, such as one writing to a database, does not
+hold up the thread firing the events, typically the reader thread of a controller.
+
+Each listener has a bounded queue. What happens when the queue is full is decided by the overflow policy:
+
+    drop_oldest     the oldest queued event is discarded to make room
+    merge_latest    an event is merged into the latest queued event for the same object, keeping its place in the
+                    queue. By default the event replaces the queued one. When there is no queued event for the
+                    object, the oldest is discarded. The listener must give a key identifying the object each event
+                    is about.
+    block           the firing thread waits until the listener has caught up
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+from brewpi.protocol.stats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+drop_oldest = 'drop_oldest'
+merge_latest = 'merge_latest'
+block = 'block'
+
+overflow_policies = (drop_oldest, merge_latest, block)
+
+
+def latest(queued, event):
+    """ the default merge, where an event supersedes the queued event for the same object """
+    return event
+
+
+class ListenerQueue:
+    """
+    A bounded queue of events, and a worker thread that delivers them to the listener in order.
+    """
+
+    def __init__(self, listener, max_queued=256, overflow=drop_oldest, key=None, merge=latest,
+                 clock=time.monotonic):
+        """
+        :param listener: called with each event
+        :param max_queued: the number of events held before the overflow policy applies
+        :param overflow: one of drop_oldest, merge_latest or block
+        :param key: gives a hashable key for the object an event is about. Required for the merge_latest policy.
+        :param merge: called with the queued event and a new event for the same object, and returns the event
+            that replaces the queued one
+        :param clock: returns the current time in seconds, used to time delivery
+        """
+        if overflow not in overflow_policies:
+            raise ValueError("unknown overflow policy %s" % overflow)
+        if overflow == merge_latest and key is None:
+            raise ValueError("the merge_latest policy needs a key for the object each event is about")
+        self.listener = listener
+        self.max_queued = max_queued
+        self.overflow = overflow
+        self.key = key
+        self.merge = merge
+        self.clock = clock
+        self._queue = OrderedDict()     # sequence -> (object key, event)
+        self._latest = dict()           # object key -> sequence of its latest queued event
+        self._sequence = count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self.delivered = 0
+        self.dropped = 0
+        self.merged = 0
+        self.max_depth = 0
+        self.latency = LatencyHistogram()   # microseconds spent in the listener
+        self._thread = threading.Thread(target=self._run, name="listener %r" % listener, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, event):
+        """ queues the event for delivery, applying the overflow policy if the queue is full """
+        key = self.key(event) if self.overflow == merge_latest else None
+        with self._condition:
+            if self._stopped:
+                return
+            if len(self._queue) >= self.max_queued:
+                if self.overflow == block:
+                    self._condition.wait_for(lambda: len(self._queue) < self.max_queued or self._stopped)
+                    if self._stopped:
+                        return
+                elif key in self._latest:
+                    sequence = self._latest[key]
+                    self._queue[sequence] = (key, self.merge(self._queue[sequence][1], event))
+                    self.merged += 1
+                    return
+                else:
+                    self._dequeue()
+                    self.dropped += 1
+            sequence = next(self._sequence)
+            self._queue[sequence] = (key, event)
+            if key is not None:
+                self._latest[key] = sequence
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._condition.notify_all()
+
+    def _dequeue(self):
+        sequence, (key, event) = self._queue.popitem(last=False)
+        if key is not None and self._latest.get(key) == sequence:
+            del self._latest[key]
+        return event
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._stopped)
+                if not self._queue:
+                    return
+                event = self._dequeue()
+                self._condition.notify_all()
+            start = self.clock()
+            try:
+                self.listener(event)
+            except Exception as e:
+                logger.exception(e)
+            elapsed = self.clock() - start
+            with self._condition:
+                self.delivered += 1
+                self.latency.record(elapsed * 1000000)
+
+    def stop(self, timeout=None):
+        """ stops the worker once the queued events have been delivered """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'merged': self.merged,
+                'latency_us': self.latency.snapshot(),
+            }
@@ -1,3 +1,229 @@
 """
 provides a discovery facade to detect controllers that are running brewpi
 """
+import logging
+import socket
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from brewpi.protocol.identity import process_identity, serial_identity, tcp_identity
+from brewpi.protocol.sniffer import all_sniffers
+from brewpi.protocol.timer import TimerWheel
+from controlbox.conduit.base import DefaultConduit
+from controlbox.connector.base import UnknownProtocolError
+from controlbox.protocol.io import determine_line_protocol
+
+logger = logging.getLogger(__name__)
+
+
+class HandshakeTimeoutError(Exception):
+    """ The endpoint did not identify its protocol before the handshake deadline. """
+
+
+class Endpoint:
+    """ Describes a place a controller may be connected, and how to open a conduit to it. """
+    identity = None
+
+    def open(self):
+        """ opens the endpoint and returns a conduit to it """
+        raise NotImplementedError
+
+    def close(self):
+        """ closes the endpoint. Any read blocked on the conduit is interrupted. """
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.identity
+
+
+class SerialEndpoint(Endpoint):
+
+    def __init__(self, device, serial_number=None, baudrate=57600):
+        self.device = device
+        self.baudrate = baudrate
+        self.identity = serial_identity(device, serial_number)
+        self._serial = None
+
+    def open(self):
+        from serial import Serial
+        s = self._serial = Serial()
+        s.port = self.device
+        s.baudrate = self.baudrate
+        s.open()
+        return DefaultConduit(s, s)
+
+    def close(self):
+        if self._serial is not None:
+            self._serial.close()
+
+
+class TCPEndpoint(Endpoint):
+
+    def __init__(self, host, port, connect_timeout=5):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.identity = tcp_identity(host, port)
+        self._socket = None
+
+    def open(self):
+        s = self._socket = socket.create_connection((self.host, self.port), self.connect_timeout)
+        s.settimeout(None)
+        return DefaultConduit(s.makefile('rb'), s.makefile('wb'))
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+
+
+class ProcessEndpoint(Endpoint):
+    """ a controller running as a local executable, such as the cross-compiled firmware """
+
+    def __init__(self, path, args=(), cwd=None):
+        self.path = path
+        self.args = list(args)
+        self.cwd = cwd
+        self.identity = process_identity(path)
+        self._process = None
+
+    def open(self):
+        p = self._process = subprocess.Popen([self.path] + self.args, cwd=self.cwd,
+                                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return DefaultConduit(p.stdout, p.stdin)
+
+    def close(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+
+
+def serial_endpoints(baudrate=57600):
+    """ enumerates the serial ports on this host """
+    from serial.tools.list_ports import comports
+    return [SerialEndpoint(port.device, getattr(port, 'serial_number', None), baudrate)
+            for port in comports()]
+
+
+def serial_endpoint(device, baudrate=57600):
+    """ the endpoint for a serial device, identified by its USB serial number where available """
+    from serial.tools.list_ports import comports
+    for port in comports():
+        if port.device == device:
+            return SerialEndpoint(device, getattr(port, 'serial_number', None), baudrate)
+    return SerialEndpoint(device, None, baudrate)
+
+
+def config_endpoints(discovery):
+    """
+    Builds the endpoints described by the discovery part of the connector configuration.
+    :param discovery: a list of dicts, each with a type key and the properties for that type
+    """
+    endpoints = []
+    for d in discovery:
+        kind = d.get('type')
+        if kind == 'serial':
+            endpoints.extend(serial_endpoints(d.get('baudrate', 57600)))
+        elif kind == 'tcp':
+            endpoints.append(TCPEndpoint(d['host'], d['port']))
+        elif kind == 'executable':
+            endpoints.append(ProcessEndpoint(d['path'], d.get('args', ()), d.get('cwd')))
+        else:
+            logger.warning("unsupported discovery type %s", kind)
+    return endpoints
+
+
+class Connection:
+    """ An endpoint that has completed the handshake, with the protocol handler determined from its banner """
+
+    def __init__(self, endpoint: Endpoint, conduit, protocol):
+        self.endpoint = endpoint
+        self.conduit = conduit
+        self.protocol = protocol
+
+    @property
+    def identity(self):
+        return self.endpoint.identity
+
+    def close(self):
+        self.endpoint.close()
+
+
+class ParallelHandshake:
+    """
+    Opens endpoints and determines their protocol concurrently, so a host with many controllers comes online
+    in about the time of a single handshake. At most max_workers handshakes run at once, and each has its own
+    deadline, after which the endpoint is closed to abort the handshake.
+    """
+
+    def __init__(self, max_workers=16, timeout=10, timer_wheel: TimerWheel = None, cache=None, configure=None,
+                 mismatch=None):
+        """
+        :param max_workers: the number of handshakes run concurrently
+        :param timeout: the time in seconds each endpoint has to open and send its banner
+        :param timer_wheel: manages the handshake deadlines. It must be running.
+        :param cache: an optional ProtocolCache used to skip sniffing endpoints seen before
+        :param configure: called with each protocol handler when it is constructed, before any request is sent
+        :param mismatch: called with the identity of an endpoint whose cached protocol was found to be stale,
+            which may be after its handshake has completed. The endpoint should be reconnected.
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timer_wheel = timer_wheel
+        self.cache = cache
+        self.configure = configure
+        self.mismatch = mismatch
+
+    def handshake(self, endpoint: Endpoint) -> Connection:
+        """ opens the endpoint and determines its protocol, within the handshake timeout """
+        expired = []
+
+        def expire():
+            expired.append(True)
+            endpoint.close()
+
+        timer = self.timer_wheel.schedule(self.timeout, expire)
+        try:
+            conduit = endpoint.open()
+            if self.cache is not None:
+                protocol = self.cache.connect(conduit, endpoint.identity, mismatch=self.mismatch,
+                                              configure=self.configure)
+                if protocol is None:
+                    raise UnknownProtocolError("unknown protocol at %s" % endpoint)
+            else:
+                protocol = determine_line_protocol(conduit, all_sniffers)
+                if self.configure is not None:
+                    self.configure(protocol)
+        except Exception as e:
+            if expired:
+                raise HandshakeTimeoutError("no handshake from %s within %ss" % (endpoint, self.timeout)) from e
+            endpoint.close()
+            raise
+        finally:
+            timer.cancel()
+        if expired:
+            raise HandshakeTimeoutError("no handshake from %s within %ss" % (endpoint, self.timeout))
+        return Connection(endpoint, conduit, protocol)
+
+    def run(self, endpoints):
+        """
+        Handshakes with all the endpoints.
+        :return: a tuple of the list of Connections made, and a dict of the exceptions for the endpoints that
+            failed, keyed by identity
+        """
+        connections = []
+        failures = dict()
+        if not endpoints:
+            return connections, failures
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(endpoints))) as pool:
+            futures = [(e, pool.submit(self.handshake, e)) for e in endpoints]
+            for endpoint, future in futures:
+                try:
+                    connections.append(future.result())
+                except Exception as e:
+                    logger.info("no controller at %s: %s", endpoint, e)
+                    failures[endpoint.identity] = e
+        return connections, failures
@@ -0,0 +1,157 @@
+"""
+Detects serial devices being plugged in and removed as it happens, using Linux inotify, so that controllers
+are discovered without polling the serial ports.
+"""
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+added_mask = IN_CREATE | IN_MOVED_TO
+removed_mask = IN_DELETE | IN_MOVED_FROM
+
+event_header = struct.Struct('iIII')
+
+default_directories = ('/dev', '/dev/serial/by-id')
+default_patterns = ('ttyACM*', 'ttyUSB*', 'ttyAMA*', 'usb-*')
+
+
+def _libc():
+    name = ctypes.util.find_library('c')
+    return ctypes.CDLL(name, use_errno=True) if name else None
+
+
+class DeviceWatcher:
+    """
+    Watches directories for device nodes matching the given patterns, and invokes callbacks with the path of the
+    device as they are added and removed. Symlinks, such as those in /dev/serial/by-id, are reported as the device
+    they link to.
+    """
+
+    def __init__(self, on_added, on_removed, directories=default_directories, patterns=default_patterns,
+                 on_overflow=None):
+        """
+        :param on_added: called with the device path when a device appears
+        :param on_removed: called with the device path when a device is removed
+        :param directories: the directories to watch. Directories that do not exist are ignored.
+        :param patterns: glob patterns for the names of the device nodes of interest
+        :param on_overflow: called when the kernel's event queue overflowed and events were lost, so the devices
+            present should be scanned again
+        """
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.on_overflow = on_overflow
+        self.directories = directories
+        self.patterns = patterns
+        self._fd = None
+        self._watches = dict()
+        self._links = dict()        # symlink path -> device path, since a removed link cannot be resolved
+        self._thread = None
+        self._stop_pipe = None
+
+    @staticmethod
+    def available():
+        """ determines if inotify can be used on this platform """
+        return sys.platform.startswith('linux') and _libc() is not None
+
+    def _matches(self, name):
+        return any(fnmatch.fnmatch(name, p) for p in self.patterns)
+
+    def start(self):
+        """ starts watching for devices on a background thread """
+        if self._thread is not None:
+            return
+        libc = _libc()
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), added_mask | removed_mask)
+            if wd < 0:
+                logger.warning("unable to watch %s: %s", directory, os.strerror(ctypes.get_errno()))
+                continue
+            self._watches[wd] = directory
+        self._scan_links()
+        self._stop_pipe = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="device watcher", daemon=True)
+        self._thread.start()
+
+    def _scan_links(self):
+        self._links.clear()
+        for directory in self._watches.values():
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if self._matches(name) and os.path.islink(path):
+                    self._links[path] = os.path.realpath(path)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        os.write(self._stop_pipe[1], b'x')
+        self._thread.join()
+        self._thread = None
+        for fd in self._stop_pipe + (self._fd,):
+            os.close(fd)
+        self._watches.clear()
+
+    def _run(self):
+        while True:
+            readable = select.select([self._fd, self._stop_pipe[0]], [], [])[0]
+            if self._stop_pipe[0] in readable:
+                return
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                continue
+            for mask, path in self._events(data):
+                try:
+                    self._dispatch(mask, path)
+                except Exception as e:
+                    logger.exception(e)
+
+    def _events(self, data):
+        offset = 0
+        while offset + event_header.size <= len(data):
+            wd, mask, cookie, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                yield mask, None
+                continue
+            directory = self._watches.get(wd)
+            if directory is not None and name:
+                name = os.fsdecode(name)
+                if self._matches(name):
+                    yield mask, os.path.join(directory, name)
+
+    def _dispatch(self, mask, path):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("device events were lost")
+            self._scan_links()
+            if self.on_overflow is not None:
+                self.on_overflow()
+        elif mask & added_mask:
+            if os.path.islink(path):
+                device = self._links[path] = os.path.realpath(path)
+            else:
+                device = path
+            self.on_added(device)
+        elif mask & removed_mask:
+            self.on_removed(self._links.pop(path, path))
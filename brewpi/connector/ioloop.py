@@ -0,0 +1,218 @@
+"""
+Services the conduits of many controllers from a single thread.
+
+Each registered conduit is watched with a selector (epoll on Linux). When data is available it is read without
+blocking and passed to the protocol handler's data_received(), which decodes the complete responses and
+buffers any partial one. The number of threads stays the same however many controllers are connected.
+Requests are still written by the thread making them.
+"""
+import logging
+import os
+import selectors
+import socket
+import stat
+import threading
+
+from brewpi.protocol.timer import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+
+class Registration:
+    """ a conduit input being watched by the loop """
+
+    def __init__(self, input, protocol, on_closed=None):
+        self.input = input
+        self.protocol = protocol
+        self.on_closed = on_closed
+        self.bytes_read = 0
+
+    def fileno(self):
+        return self.input.fileno()
+
+
+class IOLoop:
+    """
+    A selector loop that reads from the registered conduits as they become readable, and drives the protocol
+    decoders. The loop can also advance a TimerWheel, so request deadlines need no thread of their own.
+    """
+
+    def __init__(self, timer_wheel: TimerWheel = None, read_size=4096, selector=None):
+        """
+        :param timer_wheel: a wheel advanced by the loop. It should not also be started.
+        :param read_size: the most bytes read from a conduit at a time
+        :param selector: the selector to use. Defaults to the best available on the platform.
+        """
+        self.timer_wheel = timer_wheel
+        self.read_size = read_size
+        self._selector = selector or selectors.DefaultSelector()
+        self._registrations = dict()    # input -> Registration
+        self._pending = []              # functions to run on the loop thread
+        self._lock = threading.Lock()
+        self._wakeup, self._waker = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ, None)
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._registrations)
+
+    def _call_in_loop(self, fn):
+        if self._thread is None or threading.current_thread() is self._thread:
+            fn()
+            return
+        with self._lock:
+            self._pending.append(fn)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._waker.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def register(self, input, protocol, on_closed=None):
+        """
+        Reads from the conduit input when it is readable, and passes the data to protocol.data_received().
+        The input is made non-blocking, except for a socket. The reader and writer of a socket conduit share one
+        file descriptor, so making it non-blocking would also make writes to the conduit fail under back-pressure.
+        A socket is only read once the selector reports it is readable, when a single read does not block.
+        :param input: the input stream of the conduit. It must have a fileno().
+        :param protocol: the protocol handler
+        :param on_closed: called with the protocol when the input reaches end of file or fails
+        """
+        registration = Registration(input, protocol, on_closed)
+        fd = input.fileno()
+        blocking = os.get_blocking(fd)
+        os.set_blocking(fd, False)
+        try:
+            # data read ahead into the stream's buffer, such as during the handshake, does not make the file
+            # readable. The conduit is not yet in use, so nothing else is writing while the socket is non-blocking.
+            buffered = self._buffered(input)
+        finally:
+            if stat.S_ISSOCK(os.fstat(fd).st_mode):
+                os.set_blocking(fd, blocking)
+        if hasattr(input, 'in_waiting'):
+            # a pyserial port returns just the bytes available when it has no timeout
+            input.timeout = 0
+        self._call_in_loop(lambda: self._register(registration, buffered))
+
+    @staticmethod
+    def _buffered(input):
+        peek = getattr(input, 'peek', None)
+        if peek is None:
+            return False
+        try:
+            return bool(peek(1))
+        except (BlockingIOError, ValueError, OSError):
+            return False
+
+    def _register(self, registration, buffered):
+        self._registrations[registration.input] = registration
+        self._selector.register(registration, selectors.EVENT_READ, registration)
+        if buffered:
+            self._read(registration)
+
+    def unregister(self, input):
+        """ stops reading from the conduit input """
+        self._call_in_loop(lambda: self._unregister(input))
+
+    def _unregister(self, input):
+        registration = self._registrations.pop(input, None)
+        if registration is not None:
+            try:
+                self._selector.unregister(registration)
+            except (KeyError, ValueError):
+                pass
+        return registration
+
+    def _read(self, registration):
+        input = registration.input
+        try:
+            read = getattr(input, 'read1', None) or input.read
+            data = read(self.read_size)
+        except BlockingIOError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("error reading from %s: %s", registration.protocol, e)
+            data = b''
+        if data is None:
+            return
+        if not data:
+            # a readable file with no data is at end of file
+            self._closed(registration)
+            return
+        registration.bytes_read += len(data)
+        try:
+            registration.protocol.data_received(data)
+        except Exception as e:
+            logger.exception(e)
+
+    def _closed(self, registration):
+        self._unregister(registration.input)
+        if registration.on_closed is not None:
+            try:
+                registration.on_closed(registration.protocol)
+            except Exception as e:
+                logger.exception(e)
+
+    def run_once(self, timeout=None):
+        """ waits for at least one conduit to be readable, or the timeout, and services the ready conduits
+        :return: the number of conduits read from
+        """
+        if self.timer_wheel is not None:
+            timeout = self.timer_wheel.tick if timeout is None else min(timeout, self.timer_wheel.tick)
+        count = 0
+        for key, events in self._selector.select(timeout):
+            registration = key.data
+            if registration is None:
+                self._drain_wakeup()
+            elif registration.input in self._registrations:
+                self._read(registration)
+                count += 1
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for fn in pending:
+            fn()
+        if self.timer_wheel is not None:
+            self.timer_wheel.advance()
+        return count
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def start(self):
+        """ runs the loop on a background thread """
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="io loop", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(e)
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped = True
+            self._wake()
+            self._thread.join()
+            self._thread = None
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for fn in pending:
+                fn()
+
+    def close(self):
+        self.stop()
+        self._selector.close()
+        self._wakeup.close()
+        self._waker.close()
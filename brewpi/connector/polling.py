@@ -0,0 +1,208 @@
+"""
+Polls controllers on behalf of subscribers, so the load on each controller is the union of what the subscribers
+need rather than the sum.
+
+A subscription asks for the response to a request, such as b't' for the temperatures, from one controller at
+most every so many milliseconds. The subscriptions for a controller are merged into one schedule: each request
+is polled at the shortest interval any subscriber asked for, and the schedule ticks at the greatest common
+divisor of those intervals. Every request starts at tick 0, so requests whose intervals are multiples of each
+other are due on the same ticks and are sent together. Each subscriber receives the results at its own rate.
+"""
+import logging
+import threading
+import time
+from math import gcd
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """ A request to receive the response to a request from a controller at most every interval milliseconds """
+
+    def __init__(self, planner, target, request_type, interval, callback):
+        self.planner = planner
+        self.target = target
+        self.request_type = request_type
+        self.interval = interval
+        self.callback = callback
+        self.last_delivered = None
+        self.delivered = 0
+
+    def cancel(self):
+        self.planner.unsubscribe(self)
+
+
+class ControllerPlan:
+    """ The merged poll schedule for one controller """
+
+    def __init__(self, target):
+        self.target = target
+        self.subscriptions = dict()     # request type -> list of Subscriptions
+        self.tick = None                # milliseconds between ticks
+        self.periods = dict()           # request type -> ticks between polls
+        self.count = 0                  # ticks since the schedule was planned
+        self.next_time = None
+        self.in_flight = set()
+        self.requests = 0
+
+    def replan(self):
+        intervals = dict((request_type, min(s.interval for s in subs))
+                         for request_type, subs in self.subscriptions.items())
+        tick = 0
+        for interval in intervals.values():
+            tick = gcd(tick, interval)
+        self.tick = tick
+        self.periods = dict((request_type, interval // tick) for request_type, interval in intervals.items())
+        self.count = 0
+
+    def due(self):
+        """ the request types due on the current tick """
+        return [request_type for request_type, period in self.periods.items() if self.count % period == 0]
+
+    def requests_per_second(self):
+        return sum(1000 / (period * self.tick) for period in self.periods.values())
+
+
+class PollPlanner:
+    """
+    Runs the merged poll schedules of the subscribed controllers. A controller is any object with a
+    send_request(request_type) method returning a future, such as a protocol handler or RequestScheduler.
+    """
+
+    def __init__(self, resolution=10, clock=time.monotonic):
+        """
+        :param resolution: intervals are rounded up to a multiple of this many milliseconds, which keeps the
+            schedule tick from becoming needlessly small
+        :param clock: returns the current time in seconds
+        """
+        self.resolution = resolution
+        self.clock = clock
+        self._plans = dict()    # target -> ControllerPlan
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def subscribe(self, target, request_type, interval, callback) -> Subscription:
+        """
+        Subscribes to the response to a request from a controller.
+        :param target: the controller
+        :param request_type: the request to poll
+        :param interval: the subscriber wants the response at most every interval milliseconds
+        :param callback: called with the result of each request delivered to this subscriber
+        """
+        interval = max(self.resolution, -(-int(interval) // self.resolution) * self.resolution)
+        subscription = Subscription(self, target, request_type, interval, callback)
+        with self._condition:
+            plan = self._plans.get(target)
+            if plan is None:
+                plan = self._plans[target] = ControllerPlan(target)
+            plan.subscriptions.setdefault(request_type, []).append(subscription)
+            plan.replan()
+            plan.next_time = self.clock()
+            self._condition.notify_all()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._condition:
+            plan = self._plans.get(subscription.target)
+            if plan is None:
+                return
+            subs = plan.subscriptions.get(subscription.request_type, [])
+            if subscription in subs:
+                subs.remove(subscription)
+            if not subs:
+                plan.subscriptions.pop(subscription.request_type, None)
+            if plan.subscriptions:
+                plan.replan()
+            else:
+                del self._plans[subscription.target]
+
+    def plan(self, target) -> ControllerPlan:
+        """ the merged schedule for the controller, or None if there are no subscriptions to it """
+        return self._plans.get(target)
+
+    def poll(self, now=None):
+        """
+        Sends the requests that are due. A request is not sent again while the previous poll of it is
+        outstanding.
+        :return: the time the next requests are due, or None if there are no subscriptions
+        """
+        now = self.clock() if now is None else now
+        batches = []
+        with self._condition:
+            for plan in self._plans.values():
+                if plan.next_time > now:
+                    continue
+                batch = [r for r in plan.due() if r not in plan.in_flight]
+                plan.in_flight.update(batch)
+                batches.append((plan, batch))
+                plan.count += 1
+                plan.next_time += plan.tick / 1000
+                if plan.next_time <= now:
+                    # fallen behind, so skip the missed ticks rather than sending them all at once
+                    missed = int((now - plan.next_time) * 1000 // plan.tick) + 1
+                    plan.count += missed
+                    plan.next_time += missed * plan.tick / 1000
+            next_time = min((p.next_time for p in self._plans.values()), default=None)
+        for plan, batch in batches:
+            for request_type in batch:
+                self._send(plan, request_type)
+        return next_time
+
+    def _send(self, plan, request_type):
+        plan.requests += 1
+        try:
+            future = plan.target.send_request(request_type)
+        except Exception as e:
+            logger.warning("unable to poll %s from %s: %s", request_type, plan.target, e)
+            with self._condition:
+                plan.in_flight.discard(request_type)
+            return
+        future.add_done_callback(lambda f: self._completed(plan, request_type, f))
+
+    def _completed(self, plan, request_type, future):
+        now = self.clock()
+        with self._condition:
+            plan.in_flight.discard(request_type)
+            subscriptions = list(plan.subscriptions.get(request_type, ()))
+            tolerance = (plan.tick or 0) / 2000
+        if future.exception() is not None:
+            logger.warning("poll of %s from %s failed: %s", request_type, plan.target, future.exception())
+            return
+        result = future.result()
+        for s in subscriptions:
+            if s.last_delivered is not None and now - s.last_delivered < s.interval / 1000 - tolerance:
+                continue
+            s.last_delivered = now
+            s.delivered += 1
+            try:
+                s.callback(result)
+            except Exception as e:
+                logger.exception(e)
+
+    def start(self):
+        """ polls on a background thread """
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="poll planner", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self.poll()
+            with self._condition:
+                if self._stopped:
+                    break
+                # subscriptions may have changed while polling
+                next_time = min((p.next_time for p in self._plans.values()), default=None)
+                timeout = None if next_time is None else max(0, next_time - self.clock())
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+
+    def stop(self):
+        if self._thread is not None:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,276 @@
+"""
+Spreads the controllers of a large installation across worker processes, so that decoding their responses can
+use every core rather than contending for the GIL of one process.
+
+Each worker runs a BrewpiConnector with its own IOLoop, for the endpoints whose identity hashes to that worker.
+The parent process presents the controllers of all the workers as one ControllersSet, and forwards the value
+changes they report as one event stream. Requests to a controller are sent to the worker that owns it.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from collections import namedtuple
+from concurrent.futures import Future
+from itertools import count
+from multiprocessing.connection import wait
+
+from brewpi.connector.api import BrewpiConnector, ControllersSet, EventSource
+from brewpi.connector.board import BoardFullError, ValueBoard
+
+logger = logging.getLogger(__name__)
+
+ControllerEvent = namedtuple('ControllerEvent', ['identity', 'event'])
+ControllerEvent.__doc__ = """ An event reported by the controller with the given identity """
+
+
+class RemoteRequestError(Exception):
+    """ A request made to a controller in a worker process failed. """
+
+
+def shard_of(identity, shards):
+    """ the index of the worker responsible for the endpoint. The hash is stable across processes. """
+    return zlib.crc32(identity.encode('utf-8')) % shards
+
+
+class ShardConnector(BrewpiConnector):
+    """ a connector that only connects the endpoints belonging to one shard """
+
+    def __init__(self, config, shard, shards):
+        super().__init__(config)
+        self.shard = shard
+        self.shards = shards
+
+    def probe(self, endpoints):
+        return super().probe([e for e in endpoints if shard_of(e.identity, self.shards) == self.shard])
+
+
+def worker_config(config, shard):
+    """ the connector configuration of a worker. A protocol cache rewrites its whole file when it is saved, so each
+    worker is given a file of its own, otherwise the workers would discard each other's entries. The value board
+    must have a single writer, so it is written by the parent process rather than the workers. """
+    config = dict(config, io_loop=True)
+    config.pop('value_board', None)
+    cache_path = config.get('protocol_cache')
+    if cache_path:
+        root, ext = os.path.splitext(cache_path)
+        config['protocol_cache'] = "%s.%d%s" % (root, shard, ext)
+    return config
+
+
+def run_worker(config, shard, shards, pipe):
+    """ the main function of a worker process. Commands are received from the parent on the pipe, and
+    controller changes, events and responses are sent back. """
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            pipe.send(message)
+
+    connector = ShardConnector(worker_config(config, shard), shard, shards)
+
+    def controllers_changed(event):
+        send('controllers', [c.identity for c in event.added], [c.identity for c in event.removed])
+        for c in event.added:
+            changes = getattr(c.protocol, 'changes', None)
+            if changes is not None:
+                changes.add_listener(lambda e, identity=c.identity: send('event', identity, e))
+
+    connector.controllers().add_listener(controllers_changed)
+    failures = connector.startup()
+    send('started', dict((identity, str(e)) for identity, e in failures.items()))
+    try:
+        while True:
+            message = pipe.recv()
+            if message[0] == 'stop':
+                break
+            request_id, identity, request_type, value = message[1:]
+            _request(connector, send, request_id, identity, request_type, value)
+    except EOFError:
+        pass
+    finally:
+        connector.shutdown()
+
+
+def _request(connector, send, request_id, identity, request_type, value):
+    connection = connector.controllers().get(identity)
+    if connection is None:
+        send('response', request_id, None, "no controller %s" % identity)
+        return
+
+    def done(future):
+        e = future.exception()
+        if e is not None:
+            send('response', request_id, None, str(e))
+        else:
+            # requests such as 'j' have no response, and are resolved with None
+            response = future.result()
+            send('response', request_id, response.value if response is not None else None, None)
+    try:
+        connection.protocol.send_request(request_type, value).add_done_callback(done)
+    except Exception as e:
+        send('response', request_id, None, str(e))
+
+
+class RemoteController:
+    """ A controller connected in a worker process """
+
+    def __init__(self, connector, identity, shard):
+        self.connector = connector
+        self.identity = identity
+        self.shard = shard
+
+    def send_request(self, request_type, value=None) -> Future:
+        """ sends a request to the controller. The future is completed with the value of the response. """
+        return self.connector._send_request(self, request_type, value)
+
+    def __repr__(self):
+        return "RemoteController(%s)" % self.identity
+
+
+class ShardedConnector:
+    """
+    A connector that runs the controllers in worker processes. It provides the same controllers() set as
+    BrewpiConnector, and an event source reporting ControllerEvents for the value changes of all controllers.
+    """
+
+    def __init__(self, config, workers=None, context=None):
+        """
+        :param config: the connector configuration, as for BrewpiConnector. The worker_processes key gives the
+            number of workers when workers is not given, and defaults to the number of CPUs.
+        :param context: the multiprocessing context used to start the workers
+        The value_board is written by this process, from the value changes reported by the workers.
+        """
+        self.config = config
+        self.workers = workers or config.get('worker_processes') or multiprocessing.cpu_count()
+        self._context = context or multiprocessing.get_context()
+        self._controllers = ControllersSet()
+        self.events = EventSource()
+        self._processes = []
+        self._pipes = []
+        self._send_locks = []
+        self._requests = dict()     # request id -> (Future, shard)
+        self._request_ids = count()
+        self._reader = None
+        self._started = None
+        board_path = config.get('value_board')
+        self.board = ValueBoard(board_path) if board_path else None
+
+    def controllers(self) -> ControllersSet:
+        return self._controllers
+
+    def startup(self):
+        """ starts the workers, and waits for each to probe its endpoints
+        :return: a dict of the reasons no controller was found, keyed by endpoint identity
+        """
+        self._started = dict()
+        self._started_event = threading.Event()
+        for shard in range(self.workers):
+            parent, child = self._context.Pipe()
+            process = self._context.Process(target=run_worker, args=(self.config, shard, self.workers, child),
+                                            name="brewpi connector %d" % shard, daemon=True)
+            process.start()
+            child.close()
+            self._processes.append(process)
+            self._pipes.append(parent)
+            self._send_locks.append(threading.Lock())
+        self._reader = threading.Thread(target=self._read, name="shard reader", daemon=True)
+        self._reader.start()
+        self._started_event.wait()
+        failures = dict()
+        for f in self._started.values():
+            failures.update(f)
+        return failures
+
+    def shutdown(self):
+        for shard in range(len(self._pipes)):
+            try:
+                self._send(shard, ('stop',))
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        if self._reader is not None:
+            self._reader.join(5)
+        for pipe in self._pipes:
+            pipe.close()
+        self._processes, self._pipes, self._send_locks = [], [], []
+        self._controllers.update(removed=self._controllers.snapshot())
+        if self.board is not None:
+            self.board.close()
+
+    def _send(self, shard, message):
+        with self._send_locks[shard]:
+            self._pipes[shard].send(message)
+
+    def _send_request(self, controller, request_type, value):
+        future = Future()
+        request_id = next(self._request_ids)
+        self._requests[request_id] = (future, controller.shard)
+        try:
+            self._send(controller.shard, ('request', request_id, controller.identity, request_type, value))
+        except (OSError, ValueError) as e:
+            self._requests.pop(request_id, None)
+            future.set_exception(RemoteRequestError(str(e)))
+        return future
+
+    def _read(self):
+        shards = dict((pipe, shard) for shard, pipe in enumerate(self._pipes))
+        while shards:
+            for pipe in wait(list(shards)):
+                try:
+                    message = pipe.recv()
+                except (EOFError, OSError):
+                    self._worker_exited(shards.pop(pipe))
+                    continue
+                try:
+                    self._received(shards[pipe], message)
+                except Exception as e:
+                    logger.exception(e)
+
+    def _received(self, shard, message):
+        kind = message[0]
+        if kind == 'event':
+            identity, changes = message[1:]
+            if self.board is not None:
+                self._publish(identity, changes)
+            self.events.fire(ControllerEvent(identity, changes))
+        elif kind == 'response':
+            request_id, value, error = message[1:]
+            future, _ = self._requests.pop(request_id, (None, None))
+            if future is not None:
+                if error is not None:
+                    future.set_exception(RemoteRequestError(error))
+                else:
+                    future.set_result(value)
+        elif kind == 'controllers':
+            added, removed = message[1:]
+            self._controllers.update([RemoteController(self, identity, shard) for identity in added],
+                                     [self._controllers.get(identity) for identity in removed
+                                      if self._controllers.get(identity) is not None])
+        elif kind == 'started':
+            self._started[shard] = message[1]
+            if len(self._started) == self.workers:
+                self._started_event.set()
+
+    def _publish(self, identity, changes):
+        try:
+            self.board.publish_changes(identity, changes)
+        except (ValueError, BoardFullError) as e:
+            logger.warning("unable to publish values of %s: %s", identity, e)
+
+    def _worker_exited(self, shard):
+        lost = [c for c in self._controllers if c.shard == shard]
+        self._controllers.update(removed=lost)
+        for request_id, (future, owner) in list(self._requests.items()):
+            if owner == shard:
+                self._requests.pop(request_id, None)
+                future.set_exception(RemoteRequestError("connector worker %d exited" % shard))
+        if shard not in self._started:
+            logger.error("connector worker %d exited before starting", shard)
+            self._started[shard] = dict()
+            if len(self._started) == self.workers:
+                self._started_event.set()
@@ -0,0 +1,173 @@
+import threading
+import unittest
+
+from hamcrest import assert_that, is_
+
+from brewpi.connector.api import BrewpiApplication, ControllersSet, EventSource, ObservableSet, SetChanged
+from brewpi.stateful.cbox import OneWireBus, SwitchesCollection, TempSensorsCollection
+from brewpi.stateful.test.cbox_test import FakeController, FakeObject, PidConfig, address
+
+
+class Controller:
+
+    def __init__(self, identity):
+        self.identity = identity
+
+
+class EventSourceTest(unittest.TestCase):
+
+    def test_listeners_notified(self):
+        events = []
+        source = EventSource()
+        source.add_listener(events.append)
+        source.fire(1)
+        source.remove_listener(events.append)
+        source.fire(2)
+        assert_that(events, is_([1]))
+
+    def test_failing_listener_does_not_stop_others(self):
+        events = []
+        source = EventSource()
+        source.add_listener(lambda e: 1 / 0)
+        source.add_listener(events.append)
+        source.fire(1)
+        assert_that(events, is_([1]))
+
+
+class ObservableSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.set = ObservableSet()
+        self.set.add_listener(self.events.append)
+
+    def test_each_change_outside_a_batch_is_published(self):
+        self.set.add(1)
+        self.set.add(2)
+        self.set.remove(1)
+        assert_that(self.events, is_([SetChanged(self.set, (1,), ()), SetChanged(self.set, (2,), ()),
+                                      SetChanged(self.set, (), (1,))]))
+        assert_that(list(self.set), is_([2]))
+        assert_that(1 in self.set, is_(False))
+
+    def test_batch_publishes_one_event(self):
+        with self.set.batch():
+            self.set.update(added=[1, 2, 3])
+            self.set.remove(2)
+            assert_that(len(self.set), is_(0))
+        assert_that(self.events, is_([SetChanged(self.set, (1, 3), ())]))
+        assert_that(self.set.snapshot(), is_((1, 3)))
+
+    def test_flapping_items_are_not_reported(self):
+        self.set.add(1)
+        del self.events[:]
+        with self.set.batch():
+            self.set.remove(1)
+            self.set.add(1)
+            self.set.add(2)
+            self.set.remove(2)
+        assert_that(self.events, is_([]))
+        assert_that(self.set.snapshot(), is_((1,)))
+
+    def test_removing_missing_item_is_ignored(self):
+        self.set.remove(1)
+        assert_that(self.events, is_([]))
+
+    def test_iteration_uses_a_snapshot(self):
+        self.set.update(added=[1, 2])
+        items = iter(self.set)
+        self.set.update(added=[3], removed=[1])
+        assert_that(list(items), is_([1, 2]))
+        assert_that(list(self.set), is_([2, 3]))
+
+    def test_concurrent_changes(self):
+        def add(start):
+            for x in range(start, start + 100):
+                self.set.add(x)
+        threads = [threading.Thread(target=add, args=(x * 100,)) for x in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_that(sorted(self.set), is_(list(range(400))))
+        assert_that(sum(len(e.added) for e in self.events), is_(400))
+
+    def test_events_delivered_in_update_order(self):
+        added = threading.Event()
+        release = threading.Event()
+
+        def slow(event):
+            if event.added:
+                added.set()
+                release.wait(1)
+        items, events = ObservableSet(), []
+        items.add_listener(slow)
+        items.add_listener(events.append)
+        adder = threading.Thread(target=items.add, args=(1,))
+        adder.start()
+        added.wait(1)
+        remover = threading.Thread(target=items.remove, args=(1,))
+        remover.start()
+        remover.join(0.1)
+        release.set()
+        adder.join()
+        remover.join()
+        assert_that(events, is_([SetChanged(items, (1,), ()), SetChanged(items, (), (1,))]))
+
+
+class ControllersSetTest(unittest.TestCase):
+
+    def test_keyed_by_identity(self):
+        controllers = ControllersSet()
+        events = []
+        controllers.add_listener(events.append)
+        a, replacement = Controller("a"), Controller("a")
+        controllers.add(a)
+        assert_that(controllers.get("a"), is_(a))
+        assert_that(Controller("a") in controllers, is_(True))
+        controllers.add(replacement)
+        assert_that(controllers.snapshot(), is_((replacement,)))
+        assert_that(events[-1], is_(SetChanged(controllers, (replacement,), (a,))))
+        controllers.discard("a")
+        assert_that(len(controllers), is_(0))
+
+
+class BrewpiApplicationTest(unittest.TestCase):
+
+    def test_available_temp_sensors_exclude_installed(self):
+        controller = FakeController([address(0x28, x) for x in range(4)] + [address(0x3A, 9)])
+        sensors = TempSensorsCollection(controller, 1, FakeObject)
+        sensors.create(address(0x28, 2))
+        app = BrewpiApplication(sensors, onewire_buses={None: OneWireBus(controller, None)})
+        del controller.exchanges[:]
+        available = app.available_temp_sensors()
+        assert_that([a.address for a in available], is_([address(0x28, x) for x in (0, 1, 3)]))
+        assert_that(available[0].value, is_(None))
+        assert_that(controller.exchanges, is_(['family_search']))
+
+    def test_unassigned_devices(self):
+        controller = FakeController()
+
+        class Sensor(FakeObject):
+            pass
+
+        class Switch(FakeObject):
+            pass
+
+        sensors = TempSensorsCollection(controller, 1, Sensor)
+        switches = SwitchesCollection(controller, 2, Switch)
+        app = BrewpiApplication(sensors, switches)
+        s1, s2 = [sensors.find(sensors.create(address(0x28, x))) for x in (1, 2)]
+        a1 = switches.find(switches.create(address(0x3A, 1), 0))
+        pid = FakeObject((3, 1), PidConfig(s1, a1))
+        app.object_created(pid)
+        assert_that(app.unassigned_temp_sensors(), is_([s2]))
+        assert_that(app.unassigned_actuators(), is_([]))
+        assert_that(app.users_of(s1), is_(frozenset([(3, 1)])))
+        app.object_deleted((3, 1))
+        assert_that(len(app.unassigned_temp_sensors()), is_(2))
+        assert_that(app.unassigned_actuators(), is_([a1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+
+from hamcrest import assert_that, calling, is_, raises
+
+from brewpi.connector.board import BoardFullError, BoardReader, ValueBoard, header
+from brewpi.protocol.changes import ValueChanges
+
+
+class ValueBoardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'values')
+        self.board = ValueBoard(self.path, slots=4, clock=lambda: 100.0)
+        self.reader = BoardReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.board.close()
+        shutil.rmtree(self.dir)
+
+    def test_put_and_get(self):
+        self.board.put("a/T/beer", 20.5)
+        self.board.put("a/T/fridge", 4)
+        self.board.put("a/T/beer", 21)
+        assert_that(self.reader.get("a/T/beer"), is_((21, 100.0)))
+        assert_that(self.reader.keys(), is_(["a/T/beer", "a/T/fridge"]))
+        assert_that(self.reader.get("b/T/beer"), is_(None))
+
+    def test_publish_changes(self):
+        self.board.publish_changes("tcp:host:1", ValueChanges(b'T', {'beer': 20}, {}, {}))
+        self.board.publish_changes("tcp:host:1", ValueChanges(b'T', {}, {'beer': 20}, {'fridge': 3}))
+        expected = {"tcp:host:1/T/beer": (None, 100.0), "tcp:host:1/T/fridge": (3, 100.0)}
+        assert_that(self.reader.snapshot("tcp:host:1/"), is_(expected))
+
+    def test_limits(self):
+        assert_that(calling(self.board.put).with_args("k", "x" * 200), raises(ValueError))
+        assert_that(calling(self.board.put).with_args("k" * 100, 1), raises(ValueError))
+        for x in range(4):
+            self.board.put("k%d" % x, x)
+        assert_that(calling(self.board.put).with_args("k4", 4), raises(BoardFullError))
+
+    def test_reader_retries_while_slot_written(self):
+        self.board.put("k", 1)
+        offset = header.size
+        # make the sequence odd, as though the writer was part way through an update
+        struct.pack_into('<I', self.board._map, offset, 3)
+        reader = BoardReader(self.path, retries=10)
+        assert_that(calling(reader.get).with_args("k"), raises(TimeoutError))
+        reader.close()
+
+    def test_consistent_reads_during_writes(self):
+        done = threading.Event()
+
+        def write():
+            for x in range(2000):
+                self.board.put("k", [x, x])
+            done.set()
+        self.board.put("k", [0, 0])
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not done.is_set():
+            value, _ = self.reader.get("k")
+            assert_that(value[0], is_(value[1]))
+        writer.join()
+
+    def test_restarted_writer_replaces_board(self):
+        self.board.put("a", 1)
+        self.board.put("b", 2)
+        assert_that(self.reader.get("a"), is_((1, 100.0)))
+        self.board.close()
+        self.board = ValueBoard(self.path, slots=4, clock=lambda: 200.0)
+        self.board.put("b", 3)
+        self.board.put("a", 4)
+        assert_that(self.reader.get("a"), is_((4, 200.0)))
+        assert_that(self.reader.get("b"), is_((3, 200.0)))
+        assert_that(os.listdir(self.dir), is_(['values']))
+
+    def test_slot_key_verified(self):
+        self.board.put("a", 1)
+        self.board.put("b", 2)
+        self.reader.keys()
+        self.reader._index["a"] = 1
+        assert_that(self.reader.get("a"), is_((1, 100.0)))
+        self.reader._index["c"] = 0
+        assert_that(self.reader.get("c"), is_(None))
+
+    def test_not_a_board(self):
+        with open(self.path + '2', 'wb') as f:
+            f.write(bytes(64))
+        assert_that(calling(BoardReader).with_args(self.path + '2'), raises(ValueError))
+
+
+if __name__ == '__main__':
+    unittest.main()
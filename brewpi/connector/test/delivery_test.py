@@ -0,0 +1,152 @@
+import threading
+import unittest
+from collections import namedtuple
+
+from hamcrest import assert_that, calling, is_, raises
+
+from brewpi.connector.api import EventSource, ObservableSet
+from brewpi.connector.delivery import ListenerQueue, block, drop_oldest, merge_latest
+
+Event = namedtuple('Event', ['object', 'value'])
+
+
+class GatedListener:
+    """ a listener that blocks until released, recording the events it receives """
+
+    def __init__(self):
+        self.events = []
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.done = threading.Event()
+        self.expected = None
+
+    def __call__(self, event):
+        self.entered.set()
+        self.gate.wait(2)
+        self.events.append(event)
+        if self.expected is not None and len(self.events) >= self.expected:
+            self.done.set()
+
+    def wait_for(self, count):
+        self.expected = count
+        if len(self.events) >= count:
+            return
+        self.done.wait(2)
+
+
+class ListenerQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = GatedListener()
+
+    def start(self, overflow, max_queued=2):
+        self.queue = ListenerQueue(self.listener, max_queued, overflow, key=lambda e: e.object)
+        self.addCleanup(self.queue.stop, 2)
+        self.addCleanup(self.listener.gate.set)
+        # the first event is taken by the worker, which then waits at the gate
+        self.queue.put(Event('x', 0))
+        self.listener.entered.wait(2)
+
+    def test_drop_oldest(self):
+        self.start(drop_oldest)
+        for x in range(1, 4):
+            self.queue.put(Event('a', x))
+        self.listener.gate.set()
+        self.listener.wait_for(3)
+        assert_that([e.value for e in self.listener.events], is_([0, 2, 3]))
+        stats = self.queue.snapshot()
+        assert_that((stats['dropped'], stats['max_depth']), is_((1, 2)))
+
+    def test_merge_latest(self):
+        self.start(merge_latest)
+        self.queue.put(Event('a', 1))
+        self.queue.put(Event('b', 2))
+        self.queue.put(Event('a', 3))
+        self.queue.put(Event('c', 4))
+        self.listener.gate.set()
+        self.listener.wait_for(3)
+        assert_that(self.listener.events, is_([Event('x', 0), Event('b', 2), Event('c', 4)]))
+        assert_that((self.queue.merged, self.queue.dropped), is_((1, 1)))
+
+    def test_merge_latest_only_when_full(self):
+        self.start(merge_latest, max_queued=3)
+        self.queue.put(Event('a', 1))
+        self.queue.put(Event('a', 2))
+        self.listener.gate.set()
+        self.listener.wait_for(3)
+        assert_that([e.value for e in self.listener.events], is_([0, 1, 2]))
+        assert_that(self.queue.merged, is_(0))
+
+    def test_merge_latest_needs_a_key(self):
+        assert_that(calling(ListenerQueue).with_args(print, 1, merge_latest), raises(ValueError))
+
+    def test_block(self):
+        self.start(block, max_queued=1)
+        self.queue.put(Event('a', 1))
+        putter = threading.Thread(target=self.queue.put, args=(Event('a', 2),))
+        putter.start()
+        putter.join(0.1)
+        assert_that(putter.is_alive(), is_(True))
+        self.listener.gate.set()
+        putter.join(2)
+        self.listener.wait_for(3)
+        assert_that([e.value for e in self.listener.events], is_([0, 1, 2]))
+        assert_that(self.queue.dropped, is_(0))
+
+    def test_stop_delivers_queued_events(self):
+        self.start(drop_oldest)
+        self.queue.put(Event('a', 1))
+        self.listener.gate.set()
+        self.queue.stop(2)
+        assert_that(len(self.listener.events), is_(2))
+        assert_that(self.queue.snapshot()['delivered'], is_(2))
+
+    def test_unknown_policy(self):
+        assert_that(calling(ListenerQueue).with_args(print, 1, 'newest'), raises(ValueError))
+
+
+class QueuedEventSourceTest(unittest.TestCase):
+
+    def test_slow_listener_does_not_block_others(self):
+        source = EventSource()
+        slow = GatedListener()
+        fast = []
+        source.add_listener(slow, overflow=drop_oldest)
+        source.add_listener(fast.append)
+        for x in range(5):
+            source.fire(Event('a', x))
+        assert_that(len(fast), is_(5))
+        slow.gate.set()
+        slow.wait_for(5)
+        assert_that(len(slow.events), is_(5))
+        stats = source.listener_stats()
+        assert_that(stats[0][0], is_(slow))
+        assert_that(source.dispatch_latency.count, is_(5))
+        source.remove_listener(slow)
+        assert_that(source.listener_stats(), is_([]))
+
+    def test_failing_queue_does_not_stop_others(self):
+        source = EventSource()
+        events = []
+        source.add_listener(print, overflow=merge_latest, key=lambda e: e.value)
+        source.add_listener(events.append)
+        source.fire(Event('a', {}))
+        assert_that(events, is_([Event('a', {})]))
+
+    def test_merged_set_changes_are_combined(self):
+        items = ObservableSet()
+        slow = GatedListener()
+        items.add_listener(slow, overflow=merge_latest, max_queued=1)
+        self.addCleanup(items.remove_listener, slow)
+        items.add('a')
+        slow.entered.wait(2)
+        items.add('b')
+        items.add('c')
+        items.update(added=['d'], removed=['b'])
+        slow.gate.set()
+        slow.wait_for(2)
+        assert_that([(e.added, e.removed) for e in slow.events], is_([(('a',), ()), (('c', 'd'), ())]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from hamcrest import assert_that, instance_of, is_, less_than
+
+from brewpi.connector.api import BrewpiConnector
+from brewpi.connector.discovery import Endpoint, HandshakeTimeoutError, ParallelHandshake, ProcessEndpoint, \
+    TCPEndpoint, config_endpoints
+from brewpi.protocol.identity import ProtocolCache
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.v02x import ControllerProtocolV023
+from brewpi.protocol.version import VersionParser
+from controlbox.conduit.base import DefaultConduit
+from controlbox.connector.base import UnknownProtocolError
+
+
+class FakeEndpoint(Endpoint):
+    """ an endpoint that sends the banner after a delay, unless closed first """
+
+    def __init__(self, name, banner=b'N:0.2.3\n', delay=0):
+        self.identity = name
+        self.banner = banner
+        self.delay = delay
+        self.closed = threading.Event()
+
+    def open(self):
+        if self.closed.wait(self.delay):
+            raise OSError("closed")
+        return DefaultConduit(io.BytesIO(self.banner), io.BytesIO())
+
+    def close(self):
+        self.closed.set()
+
+
+class ReopenedEndpoint(FakeEndpoint):
+    """ an endpoint that can be opened again after it is closed """
+
+    def open(self):
+        self.closed.clear()
+        return super().open()
+
+
+class ParallelHandshakeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick=0.01)
+        self.wheel.start()
+
+    def tearDown(self):
+        self.wheel.stop()
+
+    def test_handshakes_run_concurrently(self):
+        endpoints = [FakeEndpoint("e%d" % x, delay=0.2) for x in range(10)]
+        start = time.monotonic()
+        connections, failures = ParallelHandshake(max_workers=10, timer_wheel=self.wheel).run(endpoints)
+        assert_that(time.monotonic() - start, is_(less_than(1.0)))
+        assert_that(len(connections), is_(10))
+        assert_that(connections[0].protocol, is_(instance_of(ControllerProtocolV023)))
+        assert_that(connections[0].identity, is_("e0"))
+
+    def test_slow_endpoint_times_out(self):
+        slow = FakeEndpoint("slow", delay=5)
+        fast = FakeEndpoint("fast")
+        connections, failures = ParallelHandshake(timeout=0.1, timer_wheel=self.wheel).run([slow, fast])
+        assert_that([c.identity for c in connections], is_(["fast"]))
+        assert_that(failures["slow"], is_(instance_of(HandshakeTimeoutError)))
+        assert_that(slow.closed.is_set(), is_(True))
+
+    def test_unknown_protocol_fails_and_closes(self):
+        e = FakeEndpoint("e", banner=b'hello\n')
+        connections, failures = ParallelHandshake(timer_wheel=self.wheel).run([e])
+        assert_that(failures["e"], is_(instance_of(UnknownProtocolError)))
+        assert_that(e.closed.is_set(), is_(True))
+
+    def test_no_endpoints(self):
+        assert_that(ParallelHandshake(timer_wheel=self.wheel).run([]), is_(([], {})))
+
+
+class ConfigEndpointsTest(unittest.TestCase):
+
+    def test_tcp_and_executable(self):
+        endpoints = config_endpoints([{'type': 'tcp', 'host': 'localhost', 'port': 8332},
+                                      {'type': 'executable', 'path': '/opt/cbox', 'args': ['-i', '1']},
+                                      {'type': 'mdns'}])
+        assert_that(endpoints[0], is_(instance_of(TCPEndpoint)))
+        assert_that(endpoints[0].identity, is_('tcp:localhost:8332'))
+        assert_that(endpoints[1], is_(instance_of(ProcessEndpoint)))
+        assert_that(endpoints[1].args, is_(['-i', '1']))
+        assert_that(len(endpoints), is_(2))
+
+
+class FakeEndpointsConnector(BrewpiConnector):
+
+    def __init__(self, config, endpoints):
+        super().__init__(config)
+        self.fake_endpoints = endpoints
+
+    def endpoints(self):
+        return self.fake_endpoints
+
+
+class BrewpiConnectorTest(unittest.TestCase):
+
+    def test_startup_connects_all_endpoints(self):
+        endpoints = [FakeEndpoint("a"), FakeEndpoint("b"), FakeEndpoint("c", banner=b'\n')]
+        connector = FakeEndpointsConnector({'handshake_timeout': 1}, endpoints)
+        failures = connector.startup()
+        try:
+            assert_that(sorted(c.identity for c in connector.controllers()), is_(["a", "b"]))
+            assert_that(list(failures), is_(["c"]))
+            protocol = connector.controllers()[0].protocol
+            assert_that(protocol.timer_wheel, is_(connector.timer_wheel))
+            # a second startup only probes the endpoints that are not connected
+            assert_that(list(connector.startup()), is_(["c"]))
+            assert_that(len(connector.controllers()), is_(2))
+        finally:
+            connector.shutdown()
+        assert_that(connector.controllers().snapshot(), is_(()))
+
+    def test_stale_cached_protocol_reconnected(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        path = os.path.join(dir, 'protocols.json')
+        ProtocolCache(path).store("a", ControllerProtocolV023(None), VersionParser('0.2.2'))
+        connector = FakeEndpointsConnector({'protocol_cache': path}, [ReopenedEndpoint("a")])
+        connector.startup()
+        try:
+            first = connector.controllers().get("a")
+            first.protocol.data_received(b'N:{"v":"0.2.4"}\n')
+            deadline = time.monotonic() + 5
+            while connector.controllers().get("a") in (first, None) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            second = connector.controllers().get("a")
+            assert_that(second is not first and second is not None, is_(True), "reconnected")
+            assert_that(ProtocolCache(path).get("a")[1].version, is_('0.2.3'))
+        finally:
+            connector.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
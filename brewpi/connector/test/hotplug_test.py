@@ -0,0 +1,138 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+
+from hamcrest import assert_that, is_
+
+from brewpi.connector.discovery import Connection
+from brewpi.connector.hotplug import IN_Q_OVERFLOW, DeviceWatcher, event_header
+from brewpi.connector.test.discovery_test import FakeEndpoint, FakeEndpointsConnector
+
+
+@unittest.skipUnless(DeviceWatcher.available(), "inotify not available")
+class DeviceWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.links = os.path.join(self.dir, 'by-id')
+        os.mkdir(self.links)
+        self.events = queue.Queue()
+        self.watcher = DeviceWatcher(lambda d: self.events.put(('added', d)), lambda d: self.events.put(('removed', d)),
+                                     (self.dir, self.links, os.path.join(self.dir, 'missing')), ('ttyACM*', 'usb-*'),
+                                     lambda: self.events.put(('overflow', None)))
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.dir)
+
+    def next_event(self):
+        return self.events.get(timeout=2)
+
+    def test_device_added_and_removed(self):
+        device = os.path.join(self.dir, 'ttyACM0')
+        open(device, 'w').close()
+        assert_that(self.next_event(), is_(('added', device)))
+        os.remove(device)
+        assert_that(self.next_event(), is_(('removed', device)))
+
+    def test_other_devices_ignored(self):
+        open(os.path.join(self.dir, 'tty1'), 'w').close()
+        device = os.path.join(self.dir, 'ttyACM1')
+        open(device, 'w').close()
+        assert_that(self.next_event(), is_(('added', device)))
+        assert_that(self.events.empty(), is_(True))
+
+    def test_symlink_reported_as_device(self):
+        device = os.path.join(self.dir, 'ttyACM2')
+        open(device, 'w').close()
+        assert_that(self.next_event(), is_(('added', device)))
+        link = os.path.join(self.links, 'usb-Particle_Photon_1234-if00')
+        os.symlink(device, link)
+        assert_that(self.next_event(), is_(('added', device)))
+        os.remove(link)
+        assert_that(self.next_event(), is_(('removed', device)))
+
+    def test_overflow_reported(self):
+        for mask, path in self.watcher._events(event_header.pack(-1, IN_Q_OVERFLOW, 0, 0)):
+            self.watcher._dispatch(mask, path)
+        assert_that(self.next_event(), is_(('overflow', None)))
+
+
+class FakeDeviceEndpoint(FakeEndpoint):
+
+    def __init__(self, name, device):
+        super().__init__(name)
+        self.device = device
+
+
+class HotplugConnectorTest(unittest.TestCase):
+
+    def test_removed_device_is_disconnected(self):
+        endpoints = [FakeDeviceEndpoint("a", "/dev/ttyACM0"), FakeDeviceEndpoint("b", "/dev/ttyACM1")]
+        connector = FakeEndpointsConnector({'hotplug': False}, endpoints)
+        connector.startup()
+        try:
+            removed = [c for c in connector.controllers() if c.identity == "a"][0]
+            connector._device_removed("/dev/ttyACM0")
+            assert_that([c.identity for c in connector.controllers()], is_(["b"]))
+            assert_that(removed.endpoint.closed.is_set(), is_(True))
+            connector._device_removed("/dev/ttyACM0")
+        finally:
+            connector.shutdown()
+
+    def test_probe_skips_connected_endpoints(self):
+        endpoint = FakeDeviceEndpoint("a", "/dev/ttyACM0")
+        connector = FakeEndpointsConnector({'hotplug': False}, [])
+        connector.startup()
+        try:
+            assert_that(connector.probe([endpoint]), is_({}))
+            connection = connector.controllers()[0]
+            assert_that(connection, is_(Connection))
+            assert_that(connector.probe([FakeDeviceEndpoint("a", "/dev/ttyACM0")]), is_({}))
+            assert_that(connector.controllers().snapshot(), is_((connection,)))
+        finally:
+            connector.shutdown()
+
+    @unittest.skipUnless(DeviceWatcher.available(), "inotify not available")
+    def test_watching_starts_before_initial_probe(self):
+        watching = []
+
+        class Connector(FakeEndpointsConnector):
+            def endpoints(self):
+                watching.append(self._watcher is not None)
+                return []
+        connector = Connector({'discovery': [{'type': 'serial'}], 'poll_interval': 60}, [])
+        connector.startup()
+        connector.shutdown()
+        assert_that(watching, is_([True]))
+
+    def test_lost_device_events_rescan_serial_ports(self):
+        present = [FakeDeviceEndpoint("b", "/dev/ttyACM1")]
+        rescanned = threading.Event()
+
+        class Connector(FakeEndpointsConnector):
+            def serial_endpoints(self):
+                return present
+
+            def probe(self, endpoints):
+                try:
+                    return super().probe(endpoints)
+                finally:
+                    rescanned.set()
+        connector = Connector({'hotplug': False}, [FakeDeviceEndpoint("a", "/dev/ttyACM0")])
+        connector.startup()
+        try:
+            rescanned.clear()
+            connector._rescan_serial()
+            assert_that(rescanned.wait(2), is_(True))
+            assert_that([c.identity for c in connector.controllers()], is_(["b"]))
+        finally:
+            connector.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
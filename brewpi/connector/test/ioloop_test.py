@@ -0,0 +1,189 @@
+import io
+import os
+import socket
+import threading
+import unittest
+
+from hamcrest import assert_that, instance_of, is_
+
+from brewpi.connector.discovery import Endpoint
+from brewpi.connector.ioloop import IOLoop
+from brewpi.connector.test.discovery_test import FakeEndpointsConnector
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.v02x import ControllerProtocolV023, RequestTimeoutError
+from controlbox.conduit.base import DefaultConduit
+
+
+class RecordingProtocol:
+
+    def __init__(self):
+        self.data = b''
+        self.received = threading.Event()
+
+    def data_received(self, data):
+        self.data += data
+        self.received.set()
+
+
+class IOLoopTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = IOLoop()
+        self.addCleanup(self.loop.close)
+        self.pipes = []
+
+    def pipe(self):
+        r, w = os.pipe()
+        input = os.fdopen(r, 'rb')
+        self.addCleanup(input.close)
+        self.pipes.append(w)
+        return input, w
+
+    def tearDown(self):
+        for w in self.pipes:
+            try:
+                os.close(w)
+            except OSError:
+                pass
+
+    def test_many_conduits_one_thread(self):
+        self.loop.start()
+        protocols = []
+        for x in range(20):
+            input, w = self.pipe()
+            protocol = RecordingProtocol()
+            self.loop.register(input, protocol)
+            protocols.append((protocol, w))
+        threads = threading.active_count()
+        for x, (protocol, w) in enumerate(protocols):
+            os.write(w, b'%d' % x)
+        for x, (protocol, w) in enumerate(protocols):
+            assert_that(protocol.received.wait(1), is_(True))
+            assert_that(protocol.data, is_(b'%d' % x))
+        assert_that(threading.active_count(), is_(threads))
+        assert_that(len(self.loop), is_(20))
+
+    def test_end_of_file_closes(self):
+        input, w = self.pipe()
+        closed = []
+        protocol = RecordingProtocol()
+        self.loop.register(input, protocol, closed.append)
+        os.write(w, b'abc')
+        os.close(w)
+        self.loop.run_once(1)
+        self.loop.run_once(1)
+        assert_that(protocol.data, is_(b'abc'))
+        assert_that(closed, is_([protocol]))
+        assert_that(len(self.loop), is_(0))
+
+    def test_buffered_data_is_read_on_register(self):
+        input, w = self.pipe()
+        os.write(w, b'N:0.2.3\nT\n')
+        assert_that(input.readline(), is_(b'N:0.2.3\n'))
+        protocol = RecordingProtocol()
+        self.loop.register(input, protocol)
+        assert_that(protocol.data, is_(b'T\n'))
+
+    def test_socket_writes_still_block(self):
+        a, b = socket.socketpair()
+        self.addCleanup(a.close)
+        self.addCleanup(b.close)
+        input, output = a.makefile('rb'), a.makefile('wb')
+        self.addCleanup(input.close)
+        self.addCleanup(output.close)
+        b.sendall(b'N:0.2.3\nT\n')
+        assert_that(input.readline(), is_(b'N:0.2.3\n'))
+        protocol = RecordingProtocol()
+        self.loop.register(input, protocol)
+        assert_that(protocol.data, is_(b'T\n'))
+        assert_that(os.get_blocking(a.fileno()), is_(True))
+        b.sendall(b'V\n')
+        self.loop.run_once(1)
+        assert_that(protocol.data, is_(b'T\nV\n'))
+
+    def test_drives_protocol_decoder(self):
+        input, w = self.pipe()
+        protocol = ControllerProtocolV023(DefaultConduit(input, io.BytesIO()))
+        self.loop.register(input, protocol)
+        future = protocol.send_request('n')
+        os.write(w, b'N:{"v":"0.2.4"')
+        self.loop.run_once(1)
+        assert_that(future.done(), is_(False))
+        os.write(w, b'}\n')
+        self.loop.run_once(1)
+        assert_that(future.result(0).value.version, is_("0.2.4"))
+
+    def test_unregister(self):
+        input, w = self.pipe()
+        protocol = RecordingProtocol()
+        self.loop.register(input, protocol)
+        self.loop.unregister(input)
+        os.write(w, b'x')
+        self.loop.run_once(0.05)
+        assert_that(protocol.data, is_(b''))
+
+    def test_advances_timer_wheel(self):
+        fired = []
+        wheel = TimerWheel(tick=0.01)
+        loop = IOLoop(wheel)
+        wheel.schedule(0.01, lambda: fired.append(True))
+        for _ in range(10):
+            loop.run_once()
+        loop.close()
+        assert_that(fired, is_([True]))
+
+
+class PipeEndpoint(Endpoint):
+    """ a controller that has sent its banner, and is connected through a pipe """
+
+    def __init__(self, name):
+        self.identity = name
+        r, self.writer = os.pipe()
+        self.input = os.fdopen(r, 'rb')
+        os.write(self.writer, b'N:0.2.3\n')
+
+    def open(self):
+        return DefaultConduit(self.input, io.BytesIO())
+
+    def close(self):
+        self.input.close()
+
+    def disconnect(self):
+        os.close(self.writer)
+
+
+class IOLoopConnectorTest(unittest.TestCase):
+
+    def test_controllers_read_by_loop(self):
+        endpoints = [PipeEndpoint("e%d" % x) for x in range(5)]
+        connector = FakeEndpointsConnector({'io_loop': True, 'hotplug': False}, endpoints)
+        threads = threading.active_count()
+        removed = threading.Event()
+        connector.controllers().add_listener(lambda e: removed.set() if e.removed else None)
+        connector.startup()
+        try:
+            assert_that(len(connector.controllers()), is_(5))
+            # the loop and the endpoint poller
+            assert_that(threading.active_count(), is_(threads + 2))
+            endpoints[0].disconnect()
+            assert_that(removed.wait(1), is_(True))
+            assert_that(connector.controllers().get("e0"), is_(None))
+        finally:
+            connector.shutdown()
+        for e in endpoints[1:]:
+            e.disconnect()
+
+    def test_requests_have_deadline(self):
+        endpoint = PipeEndpoint("e")
+        connector = FakeEndpointsConnector({'io_loop': True, 'hotplug': False, 'request_timeout': 0.2}, [endpoint])
+        connector.startup()
+        try:
+            future = connector.controllers().get("e").protocol.send_request('t')
+            assert_that(future.exception(2), is_(instance_of(RequestTimeoutError)))
+        finally:
+            connector.shutdown()
+            endpoint.disconnect()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import threading
+import unittest
+from concurrent.futures import Future
+
+from hamcrest import assert_that, is_
+
+from brewpi.connector.polling import PollPlanner
+from brewpi.protocol.test.clock import FakeClock
+
+
+class FakeController:
+    """ completes each request immediately with the request type and a count """
+
+    def __init__(self, complete=True):
+        self.sent = []
+        self.complete = complete
+        self.futures = []
+
+    def send_request(self, request_type):
+        self.sent.append(request_type)
+        future = Future()
+        self.futures.append(future)
+        if self.complete:
+            future.set_result((request_type, len(self.sent)))
+        return future
+
+
+class PollPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.planner = PollPlanner(clock=self.clock)
+        self.controller = FakeController()
+
+    def run_for(self, seconds, step=0.01):
+        ticks = int(round(seconds / step))
+        for _ in range(ticks):
+            self.planner.poll()
+            self.clock.now = round(self.clock.now + step, 6)
+
+    def test_merged_schedule(self):
+        self.planner.subscribe(self.controller, b't', 1000, lambda r: None)
+        self.planner.subscribe(self.controller, b't', 500, lambda r: None)
+        self.planner.subscribe(self.controller, b'v', 1500, lambda r: None)
+        plan = self.planner.plan(self.controller)
+        assert_that(plan.tick, is_(500))
+        assert_that(plan.periods, is_({b't': 1, b'v': 3}))
+        assert_that(plan.requests_per_second(), is_(2 + 2 / 3))
+        self.run_for(3)
+        # t every 500ms, and v every 1500ms, aligned with t
+        assert_that(self.controller.sent, is_([b't', b'v', b't', b't', b't', b'v', b't', b't']))
+
+    def test_union_of_needs(self):
+        for _ in range(5):
+            self.planner.subscribe(self.controller, b't', 1000, lambda r: None)
+        self.run_for(5)
+        assert_that(len(self.controller.sent), is_(5))
+
+    def test_each_subscriber_receives_at_its_rate(self):
+        fast, slow = [], []
+        self.planner.subscribe(self.controller, b't', 200, fast.append)
+        self.planner.subscribe(self.controller, b't', 1000, slow.append)
+        self.run_for(2)
+        assert_that(len(fast), is_(10))
+        assert_that([r[1] for r in slow], is_([1, 6]))
+
+    def test_intervals_rounded_to_resolution(self):
+        self.planner.subscribe(self.controller, b't', 333, lambda r: None)
+        self.planner.subscribe(self.controller, b'v', 1, lambda r: None)
+        plan = self.planner.plan(self.controller)
+        assert_that(plan.periods, is_({b't': 34, b'v': 1}))
+
+    def test_outstanding_poll_not_repeated(self):
+        controller = FakeController(complete=False)
+        self.planner.subscribe(controller, b't', 100, lambda r: None)
+        self.run_for(0.5)
+        assert_that(controller.sent, is_([b't']))
+        controller.futures[0].set_result(None)
+        self.run_for(0.1)
+        assert_that(controller.sent, is_([b't', b't']))
+
+    def test_unsubscribe_replans(self):
+        fast = self.planner.subscribe(self.controller, b't', 100, lambda r: None)
+        self.planner.subscribe(self.controller, b't', 1000, lambda r: None)
+        fast.cancel()
+        assert_that(self.planner.plan(self.controller).tick, is_(1000))
+        self.planner.unsubscribe(self.planner.plan(self.controller).subscriptions[b't'][0])
+        assert_that(self.planner.plan(self.controller), is_(None))
+        assert_that(self.planner.poll(), is_(None))
+
+    def test_failed_poll_not_delivered(self):
+        received = []
+        controller = FakeController(complete=False)
+        self.planner.subscribe(controller, b't', 100, received.append)
+        self.planner.poll()
+        controller.futures[0].set_exception(IOError("disconnected"))
+        assert_that(received, is_([]))
+
+    def test_background_thread(self):
+        planner = PollPlanner()
+        received = threading.Event()
+        planner.start()
+        try:
+            planner.subscribe(self.controller, b't', 10, lambda r: received.set())
+            assert_that(received.wait(1), is_(True))
+        finally:
+            planner.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
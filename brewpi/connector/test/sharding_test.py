@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from hamcrest import assert_that, is_
+
+from brewpi.connector.board import BoardReader
+from brewpi.connector.sharding import ShardedConnector, shard_of, worker_config
+from brewpi.protocol.identity import tcp_identity
+
+
+class FakeTcpController:
+    """ a v0.2 controller that answers temperature requests, listening on a local port """
+
+    def __init__(self, temperature):
+        self.temperature = temperature
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        try:
+            s, _ = self.server.accept()
+        except OSError:
+            return
+        with s:
+            s.sendall(b'N:0.2.3\n')
+            for line in s.makefile('rb'):
+                if line.startswith(b't'):
+                    s.sendall(b'T{"beer":%.1f}\n' % self.temperature)
+
+    def close(self):
+        self.server.close()
+
+
+class ShardOfTest(unittest.TestCase):
+
+    def test_stable_and_in_range(self):
+        shards = [shard_of("tcp:host:%d" % x, 4) for x in range(100)]
+        assert_that(set(shards), is_({0, 1, 2, 3}))
+        assert_that(shard_of("tcp:host:1", 4), is_(shards[1]))
+
+
+class WorkerConfigTest(unittest.TestCase):
+
+    def test_each_worker_has_its_own_protocol_cache_and_no_board(self):
+        config = worker_config({'protocol_cache': '/var/cache/brewpi/protocols.json', 'io_loop': False,
+                                'value_board': '/dev/shm/brewpi'}, 2)
+        assert_that(config, is_({'protocol_cache': '/var/cache/brewpi/protocols.2.json', 'io_loop': True}))
+        assert_that(worker_config({}, 0), is_({'io_loop': True}))
+
+
+@unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(), "requires fork")
+class ShardedConnectorTest(unittest.TestCase):
+
+    def test_controllers_in_workers(self):
+        controllers = [FakeTcpController(20 + x) for x in range(3)]
+        board_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, board_dir)
+        board = os.path.join(board_dir, 'board')
+        config = {'discovery': [{'type': 'tcp', 'host': '127.0.0.1', 'port': c.port} for c in controllers],
+                  'handshake_timeout': 2, 'value_board': board}
+        connector = ShardedConnector(config, workers=2, context=multiprocessing.get_context('fork'))
+        events = []
+        received = threading.Event()
+        connector.events.add_listener(lambda e: (events.append(e), received.set()))
+        try:
+            assert_that(connector.startup(), is_({}))
+            assert_that(len(connector.controllers()), is_(3))
+            identity = tcp_identity('127.0.0.1', controllers[1].port)
+            remote = connector.controllers().get(identity)
+            assert_that(remote.shard, is_(shard_of(identity, 2)))
+            assert_that(remote.send_request('t').result(5), is_({'beer': 21.0}))
+            assert_that(received.wait(5), is_(True))
+            assert_that(events[0].identity, is_(identity))
+            assert_that(events[0].event.added, is_({'beer': 21.0}))
+            reader = BoardReader(board)
+            assert_that(reader.get(identity + '/T/beer')[0], is_(21.0))
+            reader.close()
+        finally:
+            connector.shutdown()
+            for c in controllers:
+                c.close()
+        assert_that(len(connector.controllers()), is_(0))
+
+    def test_request_without_response(self):
+        controller = FakeTcpController(20)
+        config = {'discovery': [{'type': 'tcp', 'host': '127.0.0.1', 'port': controller.port}],
+                  'handshake_timeout': 2}
+        connector = ShardedConnector(config, workers=1, context=multiprocessing.get_context('fork'))
+        try:
+            connector.startup()
+            remote = connector.controllers().get(tcp_identity('127.0.0.1', controller.port))
+            assert_that(remote.send_request('j', {'beerSet': 20}).result(5), is_(None))
+            assert_that(remote.send_request('t').result(5), is_({'beer': 20.0}))
+        finally:
+            connector.shutdown()
+            controller.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
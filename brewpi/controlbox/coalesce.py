@@ -0,0 +1,115 @@
+"""
+Merges reads of individual objects that are made in quick succession into a single batched read.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class ReadCoalescer:
+    """
+    Collects the reads requested within a short window and passes them together to a function that reads many
+    objects at once. Each read is given a future, which is completed with its value once the batch has been read.
+    Reads of the same object within the window share a single future, so the object is read only once.
+    A read waits up to the window for others to join its batch, unless flush() is called.
+    """
+
+    def __init__(self, read_many, window=0.005, max_batch=32, key=id, clock=time.monotonic):
+        """
+        :param read_many: called with a list of the objects to read, and returns a list of their values in the
+            same order. A value that is an exception fails the read of that object.
+        :param window: the seconds from the first read in a batch until the batch is read
+        :param max_batch: the number of objects that causes the batch to be read without waiting for the window
+        :param key: identifies the object being read, so that duplicate reads can be merged
+        :param clock: returns the current time in seconds
+        """
+        self.read_many = read_many
+        self.window = window
+        self.max_batch = max_batch
+        self.key = key
+        self.clock = clock
+        self._pending = dict()      # key -> (object, future)
+        self._opened = None         # the time the first pending read was requested
+        self._flushing = False
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.reads = 0
+        self.merged = 0
+        self.batches = 0
+
+    def read(self, obj) -> Future:
+        """ requests the value of the object is read as part of the next batch """
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("read coalescer has been stopped")
+            self.reads += 1
+            key = self.key(obj)
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.merged += 1
+                return pending[1]
+            future = Future()
+            if not self._pending:
+                self._opened = self.clock()
+            self._pending[key] = (obj, future)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="read coalescer", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+            return future
+
+    def flush(self):
+        """ reads the pending batch without waiting for the rest of the window, such as when a caller is about to
+        block on the result """
+        with self._condition:
+            if self._pending:
+                self._flushing = True
+                self._condition.notify_all()
+
+    def _next_batch(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending or self._stopped)
+            while len(self._pending) < self.max_batch and not self._stopped and not self._flushing:
+                remaining = self._opened + self.window - self.clock()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = list(self._pending.values())
+            self._pending.clear()
+            self._flushing = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        self.batches += 1
+        try:
+            values = self.read_many([obj for obj, future in batch])
+        except Exception as e:
+            logger.warning("batched read of %d objects failed: %s", len(batch), e)
+            for obj, future in batch:
+                future.set_exception(e)
+            return
+        for (obj, future), value in zip(batch, values):
+            if isinstance(value, Exception):
+                future.set_exception(value)
+            else:
+                future.set_result(value)
+
+    def stop(self):
+        """ reads any pending batch, and stops the background thread """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
@@ -218,6 +218,12 @@ class OneWireTempSensorConfig(BaseState):
         self.offset = offset
 
 
+class OneWireSwitchConfig(BaseState):
+    def __init__(self, address=None, pio=None):
+        self.address = address
+        self.pio = pio
+
+
 class OneWireAddressDecoder(ValueDecoder):
     def _decode(self, buf):
         return OneWireAddress(buf[0:OneWireAddress.length])
@@ -4,8 +4,13 @@ it defines the classes of objects that are found in the brewpi app.
 some of these may move down into the generic controlbox layer if they are useful and application-neutral.
 
 """
+import threading
+from concurrent.futures import Future
+
+from brewpi.controlbox.coalesce import ReadCoalescer
 from brewpi.controlbox.system_id import SystemID
 from brewpi.controlbox.time import CurrentTicks, ValueProfile
+from brewpi.stateful.mirror import ObjectMirror
 from controlbox.protocol.controlbox import decode_id, encode_id
 from controlbox.stateful.classes import ElapsedTime
 from controlbox.stateful.controlbox import StatefulControlbox
@@ -38,6 +43,171 @@ class BrewpiController(StatefulControlbox):
         # creating a new instance each time
         return ElapsedTime(self, self._sysroot, 1)
 
+    mirror = None
+
+    def enable_mirror(self, max_age) -> ObjectMirror:
+        """ caches the values read from and written to the controller, so reads are served from memory for up to
+        max_age seconds. Nothing subscribes the mirror to the controller's events, so values the controller changes
+        itself are seen once they expire, or sooner if the events are passed to object_created(), object_deleted()
+        and value_changed().
+        :param max_age: the seconds a value is served before it is read again
+        """
+        if self.mirror is None:
+            self.mirror = ObjectMirror(max_age)
+        return self.mirror
+
+    def _mirror_key(self, obj):
+        root = obj
+        while getattr(root, 'container', None) is not None:
+            root = root.container
+        return ('system' if root is self._sysroot else 'profile',) + tuple(obj.id_chain)
+
+    _coalescer = None
+
+    def enable_read_coalescing(self, window=0.005, max_batch=32) -> ReadCoalescer:
+        """ merges reads of single objects that are outstanding together, so each object is read once however many
+        threads want its value. Reads started with read_value_async() or read_system_value_async() wait up to the
+        window for others to join their batch. read_value() sends its batch at once, since the caller is waiting.
+        The controlbox protocol has no multi-object read, so the requests in a batch are sent together and their
+        responses matched as they arrive.
+        :param window: the seconds a read may wait for others to join its batch
+        :param max_batch: the largest batch. A full batch is read without waiting.
+        """
+        with self._reads_lock:
+            if self._coalescer is None:
+                self._coalescer = ReadCoalescer(self._read_batch, window, max_batch,
+                                                lambda item: self._mirror_key(item[1]))
+            return self._coalescer
+
+    read_timeout = 10   # the seconds to wait for the response to a read
+
+    def _read_async(self, system, obj) -> Future:
+        """ sends the request to read the object without waiting for the response. The future is completed with
+        the decoded value on the protocol's reader thread. """
+        protocol = self._connector.protocol
+        request = protocol.read_system_value if system else protocol.read_value
+        response = request(obj.id_chain)
+        future = Future()
+
+        def decode(f):
+            try:
+                future.set_result(obj.decode(self._handle_error(lambda: f)))
+            except Exception as e:
+                future.set_exception(e)
+        response.add_done_callback(decode)
+        return future
+
+    def _read_batch(self, items):
+        futures = [self._read_async(system, obj) for system, obj in items]
+        values = []
+        for future in futures:
+            try:
+                values.append(future.result(self.read_timeout))
+            except Exception as e:
+                values.append(e)
+        return values
+
+    def _read_later(self, system, obj) -> Future:
+        """ starts reading the value of the object, from the mirror when it is current, otherwise through the
+        coalescer when it is enabled """
+        mirror = self.mirror
+        key = self._mirror_key(obj) if mirror is not None else None
+        if mirror is not None:
+            entry = mirror.lookup(key)
+            if entry is not None:
+                future = Future()
+                future.set_result(entry.value)
+                return future
+        coalescer = self._coalescer
+        if coalescer is not None:
+            future = coalescer.read((system, obj))
+        else:
+            future = self._read_async(system, obj)
+        if mirror is not None:
+            def fetched(f):
+                if f.exception() is None:
+                    mirror.fetched(key, obj, f.result())
+            future.add_done_callback(fetched)
+        return future
+
+    def _mirrored_read(self, read, system, obj, *args, **kwargs):
+        if args or kwargs or (self.mirror is None and self._coalescer is None):
+            return read(obj, *args, **kwargs)
+        coalescer = self._coalescer
+        future = self._read_later(system, obj)
+        if coalescer is not None and not future.done():
+            coalescer.flush()
+        return future.result(self.read_timeout)
+
+    def read_value_async(self, obj) -> Future:
+        """ starts reading the value of a profile object. With read coalescing enabled, reads started together,
+        even from a single thread, share a batch. """
+        return self._read_later(False, obj)
+
+    def read_system_value_async(self, obj) -> Future:
+        """ starts reading the value of a system object, as read_value_async() """
+        return self._read_later(True, obj)
+
+    def _mirrored_write(self, write, obj, value, *args, **kwargs):
+        result = write(obj, value, *args, **kwargs)
+        if self.mirror is not None:
+            self.mirror.written(self._mirror_key(obj), obj, result)
+        return result
+
+    def read_value(self, obj, *args, **kwargs):
+        return self._mirrored_read(super().read_value, False, obj, *args, **kwargs)
+
+    def read_system_value(self, obj, *args, **kwargs):
+        return self._mirrored_read(super().read_system_value, True, obj, *args, **kwargs)
+
+    def write_value(self, obj, value, *args, **kwargs):
+        return self._mirrored_write(super().write_value, obj, value, *args, **kwargs)
+
+    def write_system_value(self, obj, value, *args, **kwargs):
+        return self._mirrored_write(super().write_system_value, obj, value, *args, **kwargs)
+
+    def activate_profile(self, profile):
+        result = super().activate_profile(profile)
+        if self.mirror is not None:
+            self.mirror.clear()
+        return result
+
+    def object_created(self, obj):
+        if self.mirror is not None:
+            self.mirror.object_created(self._mirror_key(obj), obj)
+
+    def object_deleted(self, obj):
+        if self.mirror is not None:
+            self.mirror.object_deleted(self._mirror_key(obj))
+
+    def value_changed(self, obj, value):
+        if self.mirror is not None:
+            self.mirror.value_changed(self._mirror_key(obj), value)
+
+    @property
+    def _reads_lock(self):
+        # dict.setdefault is atomic, so each controller has exactly one lock however many threads ask for it
+        return self.__dict__.setdefault('_reads_mutex', threading.Lock())
+
+    def read_values(self, objects):
+        """ reads the values of many objects. The protocol has no multi-object read, so all the requests are sent
+        before waiting for any response, and the responses are matched as they arrive on the protocol's reader
+        thread. All the values are available after about the time of a single read, rather than one round trip per
+        object, and no thread is needed per read. """
+        objects = list(objects)
+        futures = [self._read_later(False, obj) for obj in objects]
+        coalescer = self._coalescer
+        if coalescer is not None:
+            coalescer.flush()
+        return [future.result(self.read_timeout) for future in futures]
+
+    def shutdown(self):
+        """ stops coalescing reads """
+        with self._reads_lock:
+            coalescer, self._coalescer = self._coalescer, None
+        if coalescer is not None:
+            coalescer.stop()
+
 
 class PersistentValueBase:  # (EncoderDecoderDefinition, ReadWriteValue, ForwardingEncoder, ForwardingDecoder):
     """ This is split into a base class to support system and user persisted values. The default value type is
@@ -0,0 +1,91 @@
+import threading
+import unittest
+from concurrent.futures import TimeoutError
+
+from hamcrest import assert_that, calling, is_, raises
+
+from brewpi.controlbox.coalesce import ReadCoalescer
+
+
+class BatchReader:
+    """ records the batches read, and returns the objects doubled """
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, objects):
+        self.batches.append(objects)
+        return [ValueError(obj) if obj < 0 else obj * 2 for obj in objects]
+
+
+class ReadCoalescerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = BatchReader()
+        self.coalescer = ReadCoalescer(self.reader, window=0.05, max_batch=4)
+        self.addCleanup(self.coalescer.stop)
+
+    def test_reads_within_window_are_batched(self):
+        first, second = self.coalescer.read(0), self.coalescer.read(1)
+        assert_that((first.result(1), second.result(1)), is_((0, 2)))
+        assert_that(self.reader.batches, is_([[0, 1]]))
+
+    def test_duplicate_reads_share_a_future(self):
+        futures = [self.coalescer.read(3) for _ in range(3)]
+        assert_that(futures[1], is_(futures[0]))
+        assert_that(futures[2].result(1), is_(6))
+        assert_that((self.coalescer.reads, self.coalescer.merged, self.coalescer.batches), is_((3, 2, 1)))
+
+    def test_full_batch_is_read_without_waiting(self):
+        self.coalescer.window = 10
+        futures = [self.coalescer.read(x) for x in range(4)]
+        assert_that([f.result(1) for f in futures], is_([0, 2, 4, 6]))
+
+    def test_flush_reads_without_waiting(self):
+        self.coalescer.window = 10
+        first, second = self.coalescer.read(1), self.coalescer.read(2)
+        self.coalescer.flush()
+        assert_that((first.result(1), second.result(1)), is_((2, 4)))
+        assert_that(self.reader.batches, is_([[1, 2]]))
+        later = self.coalescer.read(3)
+        assert_that(calling(later.result).with_args(0.05), raises(TimeoutError))
+        self.coalescer.flush()
+        assert_that(later.result(1), is_(6))
+
+    def test_failed_reads(self):
+        ok, failed = self.coalescer.read(1), self.coalescer.read(-1)
+        assert_that(ok.result(1), is_(2))
+        assert_that(calling(failed.result).with_args(1), raises(ValueError))
+
+    def test_failed_batch_fails_every_read(self):
+        def broken(objects):
+            raise IOError("disconnected")
+        coalescer = ReadCoalescer(broken, window=0.01)
+        future = coalescer.read(1)
+        assert_that(calling(future.result).with_args(1), raises(IOError))
+        coalescer.stop()
+
+    def test_concurrent_reads(self):
+        self.coalescer.window = 0.1
+        results = []
+
+        def read(x):
+            results.append(self.coalescer.read(x).result(1))
+        threads = [threading.Thread(target=read, args=(x,)) for x in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_that(sorted(results), is_([0, 2, 4]))
+        assert_that(len(self.reader.batches), is_(1))
+
+    def test_stop_reads_pending_batch(self):
+        self.coalescer.window = 10
+        future = self.coalescer.read(2)
+        self.coalescer.stop()
+        assert_that(future.result(0), is_(4))
+        assert_that(calling(self.coalescer.read).with_args(1), raises(RuntimeError))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from hamcrest import assert_that, calling, is_, is_not, raises
+
+from brewpi.controlbox.objects import BrewpiController
+from brewpi.protocol.test.clock import FakeClock
+from controlbox.stateful.controlbox import StatefulControlbox
+
+
+class FakeContainer:
+
+    def __init__(self, container=None):
+        self.container = container
+
+
+class FakeObject:
+
+    def __init__(self, container, *id_chain):
+        self.container = container
+        self.id_chain = id_chain
+
+    def decode(self, data):
+        return data
+
+
+class Wire:
+    """ stands in for the controller's protocol, counting the reads that reach it. When held, the responses are
+    sent only when released. """
+
+    def __init__(self):
+        self.values = dict()
+        self.reads = []
+        self.held = None
+
+    def read_value(self, id_chain):
+        self.reads.append(id_chain)
+        response = Future()
+        if self.held is None:
+            response.set_result(self.values.get(id_chain))
+        else:
+            self.held.append((id_chain, response))
+        return response
+
+    read_system_value = read_value
+
+    def release(self):
+        held, self.held = self.held, None
+        for id_chain, response in held:
+            response.set_result(self.values.get(id_chain))
+
+    def write(self, obj, value):
+        self.values[obj.id_chain] = value
+        return value
+
+
+class Connector:
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+
+def make_controller(wire=None):
+    """ a controller connected to the wire. Writes and unmirrored reads are patched by each test. """
+    controller = BrewpiController.__new__(BrewpiController)
+    controller._sysroot = FakeContainer()
+    controller._connector = Connector(wire or Wire())
+    return controller
+
+
+class ReadValuesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wire = Wire()
+        self.controller = make_controller(self.wire)
+
+    def tearDown(self):
+        self.controller.shutdown()
+
+    def test_requests_sent_before_waiting(self):
+        objects = [FakeObject(None, x) for x in range(20)]
+        self.wire.values.update(((x,), x * 2) for x in range(20))
+        self.wire.held = []
+        threads = threading.active_count()
+        results = []
+        reader = threading.Thread(target=lambda: results.extend(self.controller.read_values(objects)))
+        reader.start()
+        deadline = time.monotonic() + 5
+        while len(self.wire.reads) < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert_that(len(self.wire.reads), is_(20))
+        assert_that(threading.active_count(), is_(threads + 1), "no threads besides the reader")
+        self.wire.release()
+        reader.join(5)
+        assert_that(results, is_([x * 2 for x in range(20)]))
+
+    def test_failed_read(self):
+        response = Future()
+        response.set_exception(IOError("disconnected"))
+        with mock.patch.object(self.wire, 'read_value', lambda id_chain: response):
+            assert_that(calling(self.controller.read_values).with_args([FakeObject(None, 1)]), raises(IOError))
+
+    def test_each_controller_has_its_own_lock(self):
+        other = make_controller()
+        assert_that(self.controller._reads_lock, is_(self.controller._reads_lock))
+        assert_that(self.controller._reads_lock, is_not(other._reads_lock))
+
+
+class MirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wire = Wire()
+        self.controller = make_controller(self.wire)
+        self.clock = FakeClock()
+        self.controller.enable_mirror(10).clock = self.clock
+        self.patches = [mock.patch.object(StatefulControlbox, name, self.wire.write)
+                        for name in ('write_value', 'write_system_value')]
+        for patch in self.patches:
+            patch.start()
+        self.profile = FakeContainer()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_max_age_required(self):
+        controller = make_controller()
+        assert_that(calling(controller.enable_mirror).with_args(None), raises(ValueError))
+        assert_that(calling(controller.enable_mirror).with_args(0), raises(ValueError))
+
+    def test_system_and_profile_objects_have_distinct_keys(self):
+        system = FakeObject(FakeContainer(self.controller._sysroot), 1, 2)
+        user = FakeObject(FakeContainer(self.profile), 1, 2)
+        assert_that(self.controller._mirror_key(system), is_(('system', 1, 2)))
+        assert_that(self.controller._mirror_key(user), is_(('profile', 1, 2)))
+
+    def test_reads_served_until_stale(self):
+        obj = FakeObject(self.profile, 1)
+        self.wire.values[(1,)] = 20
+        assert_that(self.controller.read_value(obj), is_(20))
+        self.wire.values[(1,)] = 21
+        assert_that(self.controller.read_value(obj), is_(20))
+        assert_that(len(self.wire.reads), is_(1))
+        self.clock.now = 11
+        assert_that(self.controller.read_value(obj), is_(21))
+        assert_that(len(self.wire.reads), is_(2))
+
+    def test_system_reads_mirrored_separately(self):
+        user = FakeObject(self.profile, 1)
+        system = FakeObject(self.controller._sysroot, 1)
+        self.controller.read_value(user)
+        self.controller.read_system_value(system)
+        assert_that(self.wire.reads, is_([(1,), (1,)]))
+
+    def test_reads_with_arguments_are_not_mirrored(self):
+        obj = FakeObject(self.profile, 1)
+        with mock.patch.object(StatefulControlbox, 'read_value', lambda c, o, size: size):
+            assert_that(self.controller.read_value(obj, 4), is_(4))
+        assert_that((('profile', 1) in self.controller.mirror), is_(False))
+
+    def test_writes_update_mirror(self):
+        obj = FakeObject(self.profile, 1)
+        self.controller.write_value(obj, 5)
+        assert_that(self.controller.read_value(obj), is_(5))
+        assert_that(self.wire.reads, is_([]))
+
+    def test_value_changed_event_updates_mirror(self):
+        obj = FakeObject(self.profile, 1)
+        self.controller.read_value(obj)
+        self.controller.value_changed(obj, 7)
+        assert_that(self.controller.read_value(obj), is_(7))
+        self.controller.object_deleted(obj)
+        self.controller.read_value(obj)
+        assert_that(len(self.wire.reads), is_(2))
+
+    def test_activating_profile_clears_mirror(self):
+        obj = FakeObject(self.profile, 1)
+        self.controller.read_value(obj)
+        self.controller.activate_profile(FakeContainer())
+        self.controller.read_value(obj)
+        assert_that(len(self.wire.reads), is_(2))
+
+
+class ReadCoalescingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wire = Wire()
+        self.controller = make_controller(self.wire)
+
+    def tearDown(self):
+        self.controller.shutdown()
+
+    def test_reads_from_one_thread_share_a_batch(self):
+        coalescer = self.controller.enable_read_coalescing(window=0.05)
+        self.wire.values.update({(0,): 'id', (1,): 'time'})
+        system = [FakeObject(self.controller._sysroot, x) for x in range(2)]
+        futures = [self.controller.read_system_value_async(obj) for obj in system + system]
+        assert_that([f.result(1) for f in futures], is_(['id', 'time', 'id', 'time']))
+        assert_that((coalescer.batches, len(self.wire.reads)), is_((1, 2)))
+
+    def test_blocking_read_does_not_wait_for_window(self):
+        coalescer = self.controller.enable_read_coalescing(window=10)
+        self.wire.values[(1,)] = 5
+        start = time.monotonic()
+        assert_that(self.controller.read_value(FakeObject(None, 1)), is_(5))
+        assert_that(time.monotonic() - start < 1, is_(True))
+        assert_that(coalescer.batches, is_(1))
+
+    def test_async_reads_are_mirrored(self):
+        self.controller.enable_mirror(10)
+        self.controller.enable_read_coalescing(window=0.01)
+        obj = FakeObject(None, 1)
+        self.wire.values[(1,)] = 5
+        assert_that(self.controller.read_value_async(obj).result(1), is_(5))
+        assert_that(self.controller.read_value_async(obj).result(0), is_(5))
+        assert_that(len(self.wire.reads), is_(1))
+
+    def test_async_read_without_coalescing(self):
+        self.wire.values[(1,)] = 5
+        assert_that(self.controller.read_value_async(FakeObject(None, 1)).result(0), is_(5))
+
+    def test_shutdown_stops_coalescing(self):
+        coalescer = self.controller.enable_read_coalescing(window=10)
+        self.controller.shutdown()
+        assert_that(calling(coalescer.read).with_args((False, FakeObject(None, 1))), raises(RuntimeError))
+        self.wire.values[(1,)] = 5
+        assert_that(self.controller.read_value_async(FakeObject(None, 1)).result(0), is_(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Measures protocol decoding throughput and latency by replaying captured controller sessions.
+
+    python -m brewpi.protocol.benchmark session.cap [--realtime]
+
+The capture is made by wrapping a live conduit in a RecordingConduit. The protocol is determined from the
+banner at the start of the capture, just as when connecting to a controller, so the benchmark applies to both
+ControllerProtocolV023 and ControlboxProtocolV1 sessions.
+
+The cost of recognising the protocol from the banner as more protocols are registered is measured with
+
+    python -m brewpi.protocol.benchmark --handshake
+"""
+import argparse
+import io
+import time
+
+from brewpi.protocol.capture import RecordingStream, direction_in, replay_conduit
+from brewpi.protocol.sniffer import SnifferDispatch, all_sniffers, brewpi_v02x_protocol_sniffer, \
+    brewpi_v03x_protocol_sniffer
+from brewpi.protocol.version import VersionParser
+from brewpi.protocol.stats import LatencyHistogram
+from controlbox.conduit.base import DefaultConduit
+from controlbox.protocol.io import determine_line_protocol
+
+
+class ReplayResult:
+    """ The outcome of decoding a replayed session """
+
+    def __init__(self, protocol, responses, errors, bytes_read, elapsed, latency: LatencyHistogram):
+        self.protocol = protocol
+        self.responses = responses
+        self.errors = errors
+        self.bytes_read = bytes_read
+        self.elapsed = elapsed
+        self.latency = latency  # in microseconds
+
+    @property
+    def responses_per_second(self):
+        return self.responses / self.elapsed if self.elapsed else 0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes_read / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        latency = self.latency.snapshot()
+        return ("%s: %d responses, %d errors, %d bytes in %.3fs (%.0f responses/s, %.0f bytes/s); "
+                "latency us p50 %s p90 %s p99 %s max %s" %
+                (self.protocol, self.responses, self.errors, self.bytes_read, self.elapsed, self.responses_per_second,
+                 self.bytes_per_second, latency['p50'], latency['p90'], latency['p99'], latency['max']))
+
+
+class ConsumedCount:
+    """ Counts the bytes read through a RecordingStream, in place of a CaptureWriter """
+
+    def __init__(self):
+        self.count = 0
+
+    def record(self, direction, data):
+        self.count += len(data)
+
+
+def replay(file, realtime=False, clock=time.perf_counter) -> ReplayResult:
+    """
+    Decodes all the responses in a capture file.
+    The latency of each response is the time from its last byte being made available to the response
+    being decoded, so in real time mode it excludes the time spent waiting for the controller.
+    The data read ahead by the buffered input does not affect the latency.
+    :param file: a binary capture file opened for reading
+    :param realtime: replay the data at the rate it was captured, rather than as fast as possible
+    """
+    replayed = replay_conduit(file, realtime)
+    raw = replayed.input.raw
+    raw.clock = clock
+    consumed = ConsumedCount()
+    conduit = DefaultConduit(RecordingStream(replayed.input, consumed, direction_in), replayed.output)
+    protocol = determine_line_protocol(conduit, all_sniffers)
+    latency = LatencyHistogram()
+    responses = errors = 0
+    start = clock()
+    while conduit.input.peek(1):
+        try:
+            response = protocol.read_response()
+        except ValueError:
+            errors += 1
+            continue
+        if response is not None:
+            responses += 1
+            latency.record((clock() - raw.arrival_of(consumed.count - 1)) * 1000000)
+    elapsed = clock() - start
+    return ReplayResult(protocol, responses, errors, raw.bytes_read, elapsed, latency)
+
+
+def other_protocol_sniffer(prefix):
+    """ a sniffer that makes the same checks as the real ones, for a protocol that is never matched """
+    def sniffer(line, conduit):
+        line = line.strip()
+        if line.startswith(prefix) and line.endswith("]"):
+            VersionParser("{" + line[len(prefix):-1] + "}")
+        return None
+    return sniffer
+
+
+handshake_banners = ('["v":"0.3.0","a":"brewpi"]', 'N:{"v":"0.2.3","n":"abc","y":0,"b":"s","l":"1"}')
+
+
+def handshake(protocol_counts=(2, 8, 32, 128), iterations=1000, clock=time.perf_counter):
+    """
+    Times recognising the banners of the brewpi protocols, when the given number of protocols are registered.
+    Each sniffer is run in turn, as with a list of sniffers, and compared with dispatching on the banner prefix.
+    :return: a list of (protocol count, list time, dispatch time) with times in microseconds per banner
+    """
+    results = []
+    conduit = DefaultConduit(io.BytesIO(), io.BytesIO())
+    for count in protocol_counts:
+        others = [other_protocol_sniffer("[%d:" % x) for x in range(count - 2)]
+        sniffers = others + [brewpi_v03x_protocol_sniffer, brewpi_v02x_protocol_sniffer]
+        dispatch = SnifferDispatch()
+        for x, sniffer in enumerate(others):
+            dispatch.register(sniffer, "[%d:" % x)
+        dispatch.register(brewpi_v03x_protocol_sniffer, '[')
+        dispatch.register(brewpi_v02x_protocol_sniffer, 'N:')
+        dispatch.register_legacy(brewpi_v02x_protocol_sniffer)
+
+        def run_list(line):
+            for sniffer in sniffers:
+                if sniffer(line, conduit):
+                    return
+
+        times = []
+        for run in (run_list, lambda line: dispatch(line, conduit)):
+            start = clock()
+            for _ in range(iterations):
+                for banner in handshake_banners:
+                    run(banner)
+            times.append((clock() - start) * 1000000 / (iterations * len(handshake_banners)))
+        results.append((count, times[0], times[1]))
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Replays captured controller sessions to benchmark decoding.")
+    parser.add_argument('captures', nargs='*', help="capture files recorded with a RecordingConduit")
+    parser.add_argument('--realtime', action='store_true', help="replay at the captured rate")
+    parser.add_argument('--handshake', action='store_true', help="benchmark recognising the protocol banner")
+    parsed = parser.parse_args(args)
+    for capture in parsed.captures:
+        with open(capture, 'rb') as file:
+            print("%s %s" % (capture, replay(file, parsed.realtime)))
+    if parsed.handshake:
+        for count, list_time, dispatch_time in handshake():
+            print("%d protocols: sniffer list %.1fus, prefix dispatch %.1fus" % (count, list_time, dispatch_time))
+
+
+if __name__ == '__main__':
+    main()
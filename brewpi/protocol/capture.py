@@ -0,0 +1,179 @@
+"""
+Records the traffic on a conduit to a capture file, and replays captures as a conduit.
+This allows real controller sessions to be replayed for benchmarking and for reproducing decoding problems.
+
+The capture file is a sequence of records, each a header of (timestamp: double, direction: byte, length: uint32)
+in little endian order followed by the data.
+"""
+import io
+import struct
+from bisect import bisect_right
+import threading
+import time
+
+from controlbox.conduit.base import DefaultConduit
+
+record_header = struct.Struct('<dBI')
+
+direction_in = 0    # received from the controller
+direction_out = 1   # sent to the controller
+
+
+class CaptureWriter:
+    """ Appends timestamped records to a capture file. Records from different threads are not interleaved. """
+
+    def __init__(self, file, clock=time.monotonic):
+        """
+        :param file: a binary file opened for writing
+        :param clock: returns the current time in seconds. Timestamps are recorded relative to the first record.
+        """
+        self.file = file
+        self.clock = clock
+        self._start = None
+        self._lock = threading.Lock()
+
+    def record(self, direction, data):
+        if not data:
+            return
+        with self._lock:
+            now = self.clock()
+            if self._start is None:
+                self._start = now
+            self.file.write(record_header.pack(now - self._start, direction, len(data)))
+            self.file.write(data)
+
+    def flush(self):
+        with self._lock:
+            self.file.flush()
+
+
+def read_capture(file):
+    """
+    Reads the records from a capture file.
+    :param file: a binary file opened for reading
+    :return: a generator of (timestamp, direction, data) tuples
+    """
+    while True:
+        header = file.read(record_header.size)
+        if len(header) < record_header.size:
+            return
+        timestamp, direction, length = record_header.unpack(header)
+        yield timestamp, direction, file.read(length)
+
+
+class RecordingStream:
+    """ Wraps a stream, recording the data read from or written to it. Other attributes are passed through. """
+
+    def __init__(self, stream, capture: CaptureWriter, direction):
+        self.stream = stream
+        self.capture = capture
+        self.direction = direction
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.capture.record(self.direction, data)
+        return data
+
+    def read1(self, *args):
+        data = self.stream.read1(*args)
+        self.capture.record(self.direction, data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.capture.record(self.direction, data)
+        return data
+
+    def write(self, data):
+        result = self.stream.write(data)
+        self.capture.record(self.direction, data)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class RecordingConduit:
+    """ Tees the traffic of a live conduit into a capture. """
+
+    def __init__(self, conduit, capture: CaptureWriter):
+        self.conduit = conduit
+        self.capture = capture
+        self.input = RecordingStream(conduit.input, capture, direction_in)
+        self.output = RecordingStream(conduit.output, capture, direction_out)
+
+    def __getattr__(self, name):
+        return getattr(self.conduit, name)
+
+
+class ReplayStream(io.RawIOBase):
+    """
+    A readable stream that provides the received data from a capture. In real time mode, each record is
+    made available at the same offset from the start as when it was captured. Otherwise the data is
+    provided as fast as it is read.
+    """
+
+    def __init__(self, records, realtime=False, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param records: an iterable of (timestamp, direction, data) tuples, as from read_capture
+        """
+        self._records = iter(records)
+        self.realtime = realtime
+        self.clock = clock
+        self.sleep = sleep
+        self._start = None
+        self._data = b''
+        self._offset = 0
+        self.exhausted = False
+        self.bytes_read = 0
+        self.last_arrival = None     # the clock time the current record became available
+        self._ends = []              # the stream offset after each record
+        self._arrivals = []          # the clock time each record became available
+
+    def readable(self):
+        return True
+
+    def _next_record(self):
+        for timestamp, direction, data in self._records:
+            if direction != direction_in:
+                continue
+            now = self.clock()
+            if self._start is None:
+                self._start = now - timestamp
+            if self.realtime:
+                delay = self._start + timestamp - now
+                if delay > 0:
+                    self.sleep(delay)
+            self.last_arrival = self.clock()
+            self._ends.append((self._ends[-1] if self._ends else 0) + len(data))
+            self._arrivals.append(self.last_arrival)
+            return data
+        self.exhausted = True
+        return b''
+
+    def arrival_of(self, offset):
+        """ the clock time the byte at the offset from the start of the stream became available,
+        or None if it has not been read """
+        index = bisect_right(self._ends, offset)
+        return self._arrivals[index] if index < len(self._arrivals) else None
+
+    def readinto(self, b):
+        if self._offset >= len(self._data):
+            self._data = self._next_record()
+            self._offset = 0
+        chunk = self._data[self._offset:self._offset + len(b)]
+        self._offset += len(chunk)
+        self.bytes_read += len(chunk)
+        b[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def replay_conduit(file, realtime=False) -> DefaultConduit:
+    """
+    Builds a conduit whose input replays the received data in a capture file. Data written to the
+    conduit is discarded.
+    :param file: a binary file opened for reading
+    :param realtime: when True, data is replayed at the rate it was captured
+    """
+    stream = ReplayStream(read_capture(file), realtime)
+    return DefaultConduit(io.BufferedReader(stream), io.BytesIO())
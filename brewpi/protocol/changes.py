@@ -0,0 +1,56 @@
+"""
+Converts the full objects returned by repeated polls into change events, so consumers only process
+the values that differ from the previous poll.
+"""
+from collections import namedtuple
+
+ValueChanges = namedtuple('ValueChanges', ['response_key', 'added', 'removed', 'changed'])
+ValueChanges.__doc__ = """ The differences between two successive responses. added and changed map keys to their
+new values, removed maps keys to their last values. """
+
+
+class ResponseDiffer:
+    """
+    Keeps the last object received for each response key, and notifies listeners of the keys that are added,
+    removed or changed by each new response. Identical responses produce no event.
+    """
+
+    def __init__(self):
+        self._last = dict()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """ adds a callable that is invoked with a ValueChanges instance for each response that changes the value """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def last(self, response_key):
+        """ the last value received for the response key, or None """
+        return self._last.get(response_key)
+
+    def reset(self):
+        """ forgets the last values, so the next response for each key is reported in full as added keys """
+        self._last.clear()
+
+    def update(self, response_key, value: dict):
+        """
+        Compares the value with the last value for the response key, and notifies listeners of any difference.
+        :return: the ValueChanges, or None if nothing changed
+        """
+        previous = self._last.get(response_key)
+        self._last[response_key] = value
+        if previous is None:
+            added, removed, changed = value, dict(), dict()
+        else:
+            added = dict((k, v) for k, v in value.items() if k not in previous)
+            removed = dict((k, v) for k, v in previous.items() if k not in value)
+            changed = dict((k, v) for k, v in value.items() if k in previous and previous[k] != v)
+        if not (added or removed or changed):
+            return None
+        changes = ValueChanges(response_key, added, removed, changed)
+        for listener in self._listeners:
+            listener(changes)
+        return changes
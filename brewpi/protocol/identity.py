@@ -0,0 +1,219 @@
+"""
+Remembers the protocol each endpoint last spoke, so a reconnecting controller can be given its protocol handler
+without waiting for the banner to be sniffed.
+
+Endpoints are identified by a string built from the serial device path and USB serial number, the TCP host and
+port, or the executable path. The cache is persisted as a JSON file.
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+from brewpi.protocol.sniffer import sniffer_dispatch
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.v02x import ControllerProtocolV023
+from brewpi.protocol.version import VersionParser
+from controlbox.protocol.controlbox import ControlboxProtocolV1, build_chunked_hexencoded_conduit
+
+logger = logging.getLogger(__name__)
+
+
+def serial_identity(device, serial_number=None):
+    """ identifies a serial endpoint. The USB serial number distinguishes devices that swap device paths. """
+    return "serial:%s:%s" % (device, serial_number or '')
+
+
+def tcp_identity(host, port):
+    return "tcp:%s:%s" % (host, port)
+
+
+def process_identity(path):
+    return "process:%s" % os.path.abspath(path)
+
+
+def banner_version(line) -> VersionParser:
+    """ parses the version details from a protocol banner """
+    line = line.strip()
+    if line.startswith('[') and line.endswith(']'):
+        return VersionParser("{" + line[1:-1] + "}")
+    if len(line) > 1 and line[1] == ':':
+        return VersionParser(line[2:])
+    return VersionParser()
+
+
+class ProtocolType:
+    """ Describes how to construct, and optionally verify, the handler for a protocol. """
+
+    def __init__(self, name, protocol_class, factory, verify=None):
+        """
+        :param name: the name stored in the cache
+        :param protocol_class: the class of the protocol handler
+        :param factory: creates the protocol handler from a conduit
+        :param verify: called with the handler to check the controller still speaks the protocol. Returns a
+            future that is completed with the VersionParser the controller reports, or None if the protocol has
+            no way to report it, and fails if the controller does not answer in the protocol.
+        """
+        self.name = name
+        self.protocol_class = protocol_class
+        self.factory = factory
+        self.verify = verify
+
+
+def verify_v02x(protocol: ControllerProtocolV023) -> Future:
+    """ requests the version """
+    result = Future()
+
+    def done(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(future.result().value)
+    protocol.send_request('n').add_done_callback(done)
+    return result
+
+
+def verify_v03x(protocol: ControlboxProtocolV1) -> Future:
+    """ the v0.3 protocol has no version request, so checks the controller answers a request in the protocol """
+    result = Future()
+
+    def done(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(None)
+    protocol.list_profiles().add_done_callback(done)
+    return result
+
+
+protocol_types = [
+    ProtocolType('v0.2', ControllerProtocolV023, ControllerProtocolV023, verify_v02x),
+    ProtocolType('v0.3', ControlboxProtocolV1, lambda conduit: ControlboxProtocolV1(
+        *build_chunked_hexencoded_conduit(conduit)), verify_v03x),
+]
+
+
+class ProtocolCache:
+    """
+    A persistent map from endpoint identity to the protocol and version details last negotiated with it.
+    """
+
+    def __init__(self, path=None, types=protocol_types, timer_wheel: TimerWheel = None, verify_timeout=10):
+        """
+        :param path: the file the cache is persisted to. When None the cache is held in memory only.
+        :param types: the ProtocolTypes that can be cached
+        :param timer_wheel: when given, a cached protocol that is not verified within verify_timeout seconds is
+            treated as stale. Without it, verification relies on the protocol's own request deadlines.
+        """
+        self.path = path
+        self.types = dict((t.name, t) for t in types)
+        self.timer_wheel = timer_wheel
+        self.verify_timeout = verify_timeout
+        self._entries = dict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                logger.warning("ignoring corrupt protocol cache %s", path)
+
+    def _type_of(self, protocol):
+        for t in self.types.values():
+            if isinstance(protocol, t.protocol_class):
+                return t
+        return None
+
+    def get(self, identity):
+        """
+        :return: a tuple of the protocol name and VersionParser cached for the endpoint, or None
+        """
+        with self._lock:
+            entry = self._entries.get(identity)
+        if entry is None or entry['protocol'] not in self.types:
+            return None
+        return entry['protocol'], VersionParser.from_dict(entry['version'])
+
+    def store(self, identity, protocol, version: VersionParser):
+        """ remembers the protocol negotiated with the endpoint, and persists the cache """
+        t = self._type_of(protocol)
+        if t is None:
+            return
+        with self._lock:
+            self._entries[identity] = {'protocol': t.name, 'version': version.as_dict()}
+        self.save()
+
+    def forget(self, identity):
+        """ removes the endpoint, so its protocol is sniffed on the next connection """
+        with self._lock:
+            removed = self._entries.pop(identity, None)
+        if removed is not None:
+            self.save()
+
+    def save(self):
+        if self.path:
+            with self._lock:
+                data = json.dumps(self._entries, indent=2, sort_keys=True)
+            with open(self.path, 'w') as f:
+                f.write(data)
+
+    def connect(self, conduit, identity, sniffer=sniffer_dispatch, mismatch=None, configure=None):
+        """
+        Determines the protocol handler for the endpoint. A cached protocol is constructed immediately, and
+        verified in the background where the protocol supports it. Otherwise the banner is read and sniffed,
+        and the result cached.
+        :param conduit: the conduit connected to the endpoint
+        :param identity: the endpoint identity
+        :param sniffer: the sniffer used when the protocol is not cached
+        :param mismatch: called with the identity when verification finds the cached protocol is stale, because
+            the controller reports a different version, or fails to answer. The entry has already been removed,
+            so the caller should reconnect.
+        :param configure: called with the protocol handler as soon as it is constructed, before any request
+            is sent to verify it
+        :return: the protocol handler, or None if the protocol is not recognized
+        """
+        cached = self.get(identity)
+        if cached is not None:
+            t = self.types[cached[0]]
+            protocol = t.factory(conduit)
+            if configure is not None:
+                configure(protocol)
+            if t.verify is not None:
+                self._verify(identity, t.verify(protocol), cached[1], mismatch)
+            return protocol
+
+        line = conduit.input.readline().decode('ascii', errors='replace')
+        protocol = sniffer(line, conduit)
+        if protocol is not None:
+            if configure is not None:
+                configure(protocol)
+            self.store(identity, protocol, banner_version(line))
+        return protocol
+
+    def _verify(self, identity, future: Future, cached: VersionParser, mismatch):
+        stale = []
+        lock = threading.Lock()
+
+        def forget(reason):
+            with lock:
+                if stale:
+                    return
+                stale.append(reason)
+            logger.info("endpoint %s %s", identity, reason)
+            self.forget(identity)
+            if mismatch is not None:
+                mismatch(identity)
+
+        def verified(f):
+            if timer is not None:
+                timer.cancel()
+            if f.exception() is not None:
+                forget("did not confirm its protocol: %s" % f.exception())
+            elif f.result() is not None and f.result().version != cached.version:
+                forget("is now running %s" % f.result().version)
+
+        timer = None
+        if self.timer_wheel is not None:
+            timer = self.timer_wheel.schedule(self.verify_timeout, lambda: forget("did not confirm its protocol"))
+        future.add_done_callback(verified)
@@ -0,0 +1,145 @@
+"""
+A scheduler that sits in front of ControllerProtocolV023 and orders requests by priority, so that
+commands which change the controller state are not held up behind a backlog of periodic polls.
+"""
+import threading
+from collections import deque
+
+from brewpi.protocol.v02x import ControllerProtocolV023, MessageRequest
+from controlbox.protocol.async import FutureResponse, tobytes
+
+
+class Priority:
+    """ The priority classes. Lower values are sent first. """
+    control = 0     # commands that change the controller state
+    query = 1       # one-off reads, such as settings and version
+    poll = 2        # periodic bulk reads that are cheap to repeat
+
+    all = (control, query, poll)
+
+
+class RequestDroppedError(Exception):
+    """ The request was discarded from the queue before it was sent to the controller. """
+
+
+class RequestScheduler:
+    """
+    Queues requests by priority and sends them to the protocol, keeping at most max_in_flight requests
+    outstanding on the conduit. Polls waiting in the queue are merged with identical queued polls, and
+    when more than max_queued_polls are waiting the oldest are dropped.
+    The protocol must give requests a deadline, so that a lost response frees its slot.
+    """
+
+    priorities = {
+        b'A': Priority.control,
+        b'a': Priority.control,
+        b'd': Priority.control,
+        b'E': Priority.control,
+        b'j': Priority.control,
+        b'U': Priority.control,
+        b'y': Priority.control,
+        b'c': Priority.query,
+        b'n': Priority.query,
+        b's': Priority.query,
+        b'l': Priority.poll,
+        b't': Priority.poll,
+        b'v': Priority.poll,
+    }
+
+    def __init__(self, protocol: ControllerProtocolV023, max_in_flight=2, max_queued_polls=16):
+        """
+        :param protocol: the protocol the requests are sent through
+        :param max_in_flight: the number of requests that may be awaiting a response at once
+        :param max_queued_polls: the number of polls held in the queue before the oldest are dropped
+        """
+        if protocol.timer_wheel is None or not protocol.timeout:
+            raise ValueError("the protocol needs a timer_wheel and timeout, otherwise lost responses "
+                             "would hold their slots for good")
+        self.protocol = protocol
+        self.max_in_flight = max_in_flight
+        self.max_queued_polls = max_queued_polls
+        self._queues = [deque() for _ in Priority.all]
+        self._in_flight = 0
+        self._dispatching = False
+        self._lock = threading.RLock()
+
+    def send_request(self, request_type, value=None, priority=None) -> FutureResponse:
+        """
+        Queues a request to be sent to the controller.
+        :param request_type: the request character
+        :param value: the data sent with the request, if any
+        :param priority: the Priority class of the request. Defaults to the priority of the request type.
+        :return: a future that is resolved with the response
+        """
+        request_type = tobytes(request_type)
+        request_defn = self.protocol.requests.get(request_type)
+        if request_defn is None:
+            raise ValueError("unknown command %s" % request_type)
+        if priority is None:
+            priority = self.priorities.get(request_type, Priority.query)
+        with self._lock:
+            queue = self._queues[priority]
+            if priority == Priority.poll and value is None:
+                for request, future in queue:
+                    if request.defn is request_defn and request.value is None:
+                        return future
+            request = MessageRequest(request_defn, value)
+            future = FutureResponse(request)
+            queue.append((request, future))
+            if priority == Priority.poll:
+                while len(queue) > self.max_queued_polls:
+                    dropped = queue.popleft()[1]
+                    dropped.set_exception(RequestDroppedError("poll dropped from backlog"))
+            self._dispatch()
+        return future
+
+    def queued_count(self, priority=None):
+        """ the number of requests waiting to be sent, at the given priority or in total """
+        with self._lock:
+            if priority is not None:
+                return len(self._queues[priority])
+            return sum(len(q) for q in self._queues)
+
+    @property
+    def in_flight_count(self):
+        return self._in_flight
+
+    def _next(self):
+        for queue in self._queues:
+            if queue:
+                return queue.popleft()
+        return None
+
+    def _dispatch(self):
+        """ sends queued requests in priority order while there is room on the conduit """
+        with self._lock:
+            if self._dispatching:
+                return      # a completion during send, the outer loop continues
+            self._dispatching = True
+            try:
+                while self._in_flight < self.max_in_flight:
+                    item = self._next()
+                    if item is None:
+                        break
+                    self._send(*item)
+            finally:
+                self._dispatching = False
+
+    def _send(self, request: MessageRequest, future: FutureResponse):
+        try:
+            sent = self.protocol.send_request(request.defn.char, request.value)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self._in_flight += 1
+        sent.add_done_callback(lambda f: self._completed(f, future))
+
+    def _completed(self, sent, future: FutureResponse):
+        with self._lock:
+            self._in_flight -= 1
+        exception = sent.exception()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(sent.result())
+        self._dispatch()
@@ -19,4 +19,63 @@ def brewpi_v03x_protocol_sniffer(line, conduit):
     return result
 
 
-all_sniffers = [brewpi_v03x_protocol_sniffer, brewpi_v02x_protocol_sniffer]
+class SnifferDispatch:
+    """
+    Chooses the sniffers to run from the first bytes of the banner line, so the cost of recognising a protocol
+    does not grow with the number of protocols registered. An instance is itself a sniffer, and accepts the
+    banner as either str or bytes. Only the leading characters are examined until a sniffer is chosen.
+    """
+    whitespace = frozenset(' \t\r\n\0')
+
+    def __init__(self):
+        self._prefixes = dict()     # prefix -> sniffers, keyed by both the str and bytes forms
+        self._lengths = []          # the distinct prefix lengths, longest first
+        self._legacy = []           # sniffers for the legacy 'x:' banner
+
+    def register(self, sniffer, prefix):
+        """ registers a sniffer for banners that start with the given prefix """
+        for key in (prefix, prefix.encode('ascii')):
+            self._prefixes.setdefault(key, []).append(sniffer)
+        if len(prefix) not in self._lengths:
+            self._lengths.append(len(prefix))
+            self._lengths.sort(reverse=True)
+
+    def register_legacy(self, sniffer):
+        """ registers a sniffer for banners with a single character before a colon """
+        self._legacy.append(sniffer)
+
+    def _char(self, line, index):
+        c = line[index:index + 1]
+        return c if isinstance(c, str) else c.decode('latin-1')
+
+    def candidates(self, line):
+        """ the sniffers that may recognise the banner, most specific first """
+        start = 0
+        while start < len(line) and self._char(line, start) in self.whitespace:
+            start += 1
+        result = []
+        for length in self._lengths:
+            for sniffer in self._prefixes.get(line[start:start + length], ()):
+                if sniffer not in result:
+                    result.append(sniffer)
+        if self._char(line, start + 1) == ':':
+            result.extend(s for s in self._legacy if s not in result)
+        return result
+
+    def __call__(self, line, conduit):
+        candidates = self.candidates(line)
+        if candidates and not isinstance(line, str):
+            line = line.decode('ascii', errors='replace')
+        for sniffer in candidates:
+            result = sniffer(line, conduit)
+            if result:
+                return result
+        return None
+
+
+sniffer_dispatch = SnifferDispatch()
+sniffer_dispatch.register(brewpi_v03x_protocol_sniffer, '[')
+sniffer_dispatch.register(brewpi_v02x_protocol_sniffer, 'N:')
+sniffer_dispatch.register_legacy(brewpi_v02x_protocol_sniffer)
+
+all_sniffers = [sniffer_dispatch]
@@ -0,0 +1,175 @@
+"""
+Instrumentation for protocol handlers: request and response counts, bytes transferred and round-trip latency,
+broken down by command.
+"""
+import threading
+import time
+from collections import defaultdict
+
+
+class LatencyHistogram:
+    """
+    A histogram of integer values with bounded relative error, in the style of HdrHistogram.
+    Each power of two range is split into 2**(sub_bucket_bits-1) linear buckets, so a recorded value is
+    reported to within 1 part in 2**(sub_bucket_bits-1), no matter how large. Buckets are allocated sparsely.
+    """
+
+    def __init__(self, sub_bucket_bits=5):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._half = 1 << (sub_bucket_bits - 1)
+        self._counts = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        exponent = value.bit_length() - self.sub_bucket_bits
+        if exponent <= 0:
+            return value
+        return exponent * self._half + (value >> exponent)
+
+    def _upper_bound(self, index):
+        """ the highest value that is counted in the bucket at index """
+        if index < 2 * self._half:
+            return index
+        exponent = index // self._half - 1
+        mantissa = index - exponent * self._half
+        return ((mantissa + 1) << exponent) - 1
+
+    def record(self, value):
+        value = max(0, int(value))
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """ the value at or below which the given percentage of recorded values fall """
+        if not self.count:
+            return None
+        target = max(1, percent * self.count / 100)
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= target:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class CommandStats:
+    """ the counters for a single command """
+
+    def __init__(self):
+        self.requests = 0
+        self.responses = 0
+        self.timeouts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = LatencyHistogram()      # in microseconds
+
+    def snapshot(self):
+        return {
+            'requests': self.requests,
+            'responses': self.responses,
+            'timeouts': self.timeouts,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'latency_us': self.latency.snapshot(),
+        }
+
+
+class ProtocolStats:
+    """
+    Collects the traffic statistics of a protocol handler. Updates and snapshots are thread safe,
+    since requests are typically sent from one thread and responses decoded on another.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        """
+        :param clock: returns the current time in seconds. Used to time round trips.
+        """
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._commands = defaultdict(CommandStats)
+            self.bytes_out = 0
+            self.bytes_in = 0
+            self.unrecognized = 0
+            self.unsolicited = 0
+
+    def request_sent(self, command, length):
+        """ records a request written to the conduit """
+        with self._lock:
+            stats = self._commands[command]
+            stats.requests += 1
+            stats.bytes_out += length
+            self.bytes_out += length
+
+    def response_received(self, command, length, sent_time=None):
+        """
+        records a response that was matched to a request
+        :param command: the command of the matched request
+        :param length: the number of bytes in the response
+        :param sent_time: the clock time the request was sent
+        """
+        now = self.clock()
+        with self._lock:
+            stats = self._commands[command]
+            stats.responses += 1
+            stats.bytes_in += length
+            self.bytes_in += length
+            if sent_time is not None:
+                stats.latency.record((now - sent_time) * 1000000)
+
+    def request_timed_out(self, command):
+        """ records a request that received no response before its deadline """
+        with self._lock:
+            self._commands[command].timeouts += 1
+
+    def unsolicited_received(self, length):
+        """ records a response that no request was waiting for """
+        with self._lock:
+            self.unsolicited += 1
+            self.bytes_in += length
+
+    def unrecognized_received(self, length):
+        """ records data that could not be decoded as a response """
+        with self._lock:
+            self.unrecognized += 1
+            self.bytes_in += length
+
+    def command(self, command):
+        """ the statistics for one command, as a dict """
+        with self._lock:
+            return self._commands[command].snapshot()
+
+    def snapshot(self):
+        """ all the statistics as a dict """
+        with self._lock:
+            return {
+                'bytes_out': self.bytes_out,
+                'bytes_in': self.bytes_in,
+                'unrecognized': self.unrecognized,
+                'unsolicited': self.unsolicited,
+                'commands': dict((c, s.snapshot()) for c, s in self._commands.items()),
+            }
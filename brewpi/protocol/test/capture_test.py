@@ -0,0 +1,85 @@
+import io
+import unittest
+
+from hamcrest import assert_that, instance_of, is_
+
+from brewpi.protocol.benchmark import handshake, replay
+from brewpi.protocol.capture import CaptureWriter, RecordingConduit, ReplayStream, direction_in, direction_out, \
+    read_capture, replay_conduit
+from brewpi.protocol.v02x import ControllerProtocolV023
+from brewpi.protocol.test.clock import FakeClock
+from controlbox.conduit.base import DefaultConduit
+
+
+def capture_of(*records):
+    file = io.BytesIO()
+    writer = CaptureWriter(file, clock=FakeClock(r[0] for r in records))
+    for timestamp, direction, data in records:
+        writer.record(direction, data)
+    file.seek(0)
+    return file
+
+
+class CaptureTest(unittest.TestCase):
+
+    def test_recording_conduit_captures_both_directions(self):
+        capture = io.BytesIO()
+        conduit = DefaultConduit(io.BytesIO(b'T{"a": 1}\nS{}\n'), io.BytesIO())
+        recording = RecordingConduit(conduit, CaptureWriter(capture, FakeClock([5, 6, 7])))
+        recording.output.write(b't\n')
+        assert_that(recording.input.readline(), is_(b'T{"a": 1}\n'))
+        assert_that(recording.input.read(1), is_(b'S'))
+        capture.seek(0)
+        assert_that(list(read_capture(capture)), is_([
+            (0, direction_out, b't\n'), (1, direction_in, b'T{"a": 1}\n'), (2, direction_in, b'S')]))
+        assert_that(recording.output.getvalue(), is_(b't\n'), "other attributes are passed through")
+
+    def test_empty_data_not_recorded(self):
+        capture = io.BytesIO()
+        CaptureWriter(capture).record(direction_in, b'')
+        assert_that(capture.getvalue(), is_(b''))
+
+    def test_replay_skips_sent_data(self):
+        conduit = replay_conduit(capture_of((0, direction_in, b'ab'), (1, direction_out, b'x'),
+                                            (2, direction_in, b'c\n')))
+        assert_that(conduit.input.readline(), is_(b'abc\n'))
+        assert_that(conduit.input.read(), is_(b''))
+        assert_that(conduit.input.raw.exhausted, is_(True))
+
+    def test_realtime_replay_waits_for_capture_offset(self):
+        sleeps = []
+        clock = FakeClock([100, 100, 100.5, 100.5])
+        stream = ReplayStream([(0, direction_in, b'a'), (1, direction_in, b'b')], realtime=True,
+                              clock=clock, sleep=sleeps.append)
+        assert_that(stream.read(1), is_(b'a'))
+        assert_that(stream.read(1), is_(b'b'))
+        assert_that(sleeps, is_([0.5]))
+
+    def test_arrival_of_each_byte(self):
+        stream = ReplayStream([(0, direction_in, b'ab'), (1, direction_out, b'x'), (2, direction_in, b'cd')],
+                              clock=FakeClock([10, 10, 11, 11]))
+        assert_that(stream.read(2), is_(b'ab'))
+        assert_that(stream.read(2), is_(b'cd'))
+        assert_that([stream.arrival_of(offset) for offset in range(5)], is_([10, 10, 11, 11, None]))
+
+    def test_benchmark_replay_v02x(self):
+        capture = capture_of((0, direction_in, b'N:0.2.3\n'), (1, direction_in, b'T{"beer": 1}\nS{'),
+                             (2, direction_in, b'}\nC{bad\nV{}\n'))
+        result = replay(capture)
+        assert_that(result.protocol, is_(instance_of(ControllerProtocolV023)))
+        assert_that(result.responses, is_(3))
+        assert_that(result.errors, is_(1))
+        assert_that(result.bytes_read, is_(35))
+        assert_that(result.latency.count, is_(3))
+        assert_that(str(result).startswith("v0.2.4: 3 responses, 1 errors"), is_(True))
+
+
+class HandshakeBenchmarkTest(unittest.TestCase):
+
+    def test_handshake_times_each_protocol_count(self):
+        results = handshake((2, 4), iterations=2)
+        assert_that([r[0] for r in results], is_([2, 4]))
+
+
+if __name__ == '__main__':
+    unittest.main()
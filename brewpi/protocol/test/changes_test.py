@@ -0,0 +1,48 @@
+import unittest
+
+from hamcrest import assert_that, is_
+
+from brewpi.protocol.changes import ResponseDiffer, ValueChanges
+
+
+class ResponseDifferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.differ = ResponseDiffer()
+        self.events = []
+        self.differ.add_listener(self.events.append)
+
+    def test_first_value_is_all_added(self):
+        changes = self.differ.update(b'S', {"a": 1})
+        assert_that(changes, is_(ValueChanges(b'S', {"a": 1}, {}, {})))
+        assert_that(self.events, is_([changes]))
+
+    def test_identical_value_produces_no_event(self):
+        self.differ.update(b'S', {"a": 1, "b": [1, 2]})
+        assert_that(self.differ.update(b'S', {"a": 1, "b": [1, 2]}), is_(None))
+        assert_that(len(self.events), is_(1))
+
+    def test_added_removed_changed(self):
+        self.differ.update(b'C', {"a": 1, "b": 2, "c": 3})
+        changes = self.differ.update(b'C', {"a": 1, "b": 5, "d": 4})
+        assert_that(changes, is_(ValueChanges(b'C', {"d": 4}, {"c": 3}, {"b": 5})))
+        assert_that(self.differ.last(b'C'), is_({"a": 1, "b": 5, "d": 4}))
+
+    def test_keys_are_independent(self):
+        self.differ.update(b'C', {"a": 1})
+        changes = self.differ.update(b'S', {"a": 1})
+        assert_that(changes.added, is_({"a": 1}))
+
+    def test_reset(self):
+        self.differ.update(b'S', {"a": 1})
+        self.differ.reset()
+        assert_that(self.differ.update(b'S', {"a": 1}).added, is_({"a": 1}))
+
+    def test_removed_listener(self):
+        self.differ.remove_listener(self.events.append)
+        self.differ.update(b'S', {"a": 1})
+        assert_that(self.events, is_([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
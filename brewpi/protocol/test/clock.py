@@ -0,0 +1,11 @@
+class FakeClock:
+    """ A clock for tests that only moves when it is told to. When given times, each reading moves it on to the
+    next of them, and it stays at the last. """
+
+    def __init__(self, times=()):
+        self.times = iter(times)
+        self.now = 0
+
+    def __call__(self):
+        self.now = next(self.times, self.now)
+        return self.now
@@ -0,0 +1,144 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import Future
+
+from hamcrest import assert_that, instance_of, is_, none
+
+from brewpi.protocol.identity import ProtocolCache, ProtocolType, banner_version, process_identity, \
+    serial_identity, tcp_identity, verify_v03x
+from brewpi.protocol.test.clock import FakeClock
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.v02x import ControllerProtocolV023
+from brewpi.protocol.version import VersionParser
+from controlbox.conduit.base import DefaultConduit
+
+
+def build_conduit(data):
+    return DefaultConduit(io.BytesIO(data), io.BytesIO())
+
+
+class VerifiedProtocol:
+    """ a protocol handler whose verification is completed by the test """
+
+    def __init__(self, conduit):
+        self.verification = Future()
+
+    def list_profiles(self):
+        return self.verification
+
+
+verified_types = [ProtocolType('v0.3', VerifiedProtocol, VerifiedProtocol, verify_v03x)]
+
+
+class IdentityTest(unittest.TestCase):
+
+    def test_identities(self):
+        assert_that(serial_identity('/dev/ttyACM0', 'A1'), is_('serial:/dev/ttyACM0:A1'))
+        assert_that(serial_identity('COM3'), is_('serial:COM3:'))
+        assert_that(tcp_identity('localhost', 8332), is_('tcp:localhost:8332'))
+        assert_that(process_identity('/opt/cbox').startswith('process:'), is_(True))
+
+    def test_banner_version(self):
+        assert_that(banner_version('["v":"0.3.1","n":"abc"]\n').version, is_("0.3.1"))
+        assert_that(banner_version('N:0.2.3').revision, is_(3))
+        assert_that(banner_version('garbage').version, is_(none()))
+
+
+class ProtocolCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'protocols.json')
+        self.cache = ProtocolCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_sniffed_protocol_is_cached_and_persisted(self):
+        protocol = self.cache.connect(build_conduit(b'N:0.2.3\n'), 'serial:a:1')
+        assert_that(protocol, is_(instance_of(ControllerProtocolV023)))
+        name, version = ProtocolCache(self.path).get('serial:a:1')
+        assert_that(name, is_('v0.2'))
+        assert_that(version.version, is_('0.2.3'))
+
+    def test_unknown_protocol_not_cached(self):
+        assert_that(self.cache.connect(build_conduit(b'hello\n'), 'x'), is_(none()))
+        assert_that(self.cache.get('x'), is_(none()))
+
+    def test_cached_protocol_constructed_without_banner(self):
+        self.cache.store('serial:a:1', ControllerProtocolV023(None), VersionParser('0.2.3'))
+        conduit = build_conduit(b'')
+        protocol = self.cache.connect(conduit, 'serial:a:1')
+        assert_that(protocol, is_(instance_of(ControllerProtocolV023)))
+        assert_that(conduit.output.getvalue(), is_(b'n\n'), "version requested to verify the cache")
+
+    def test_configured_before_verification(self):
+        self.cache.store('serial:a:1', ControllerProtocolV023(None), VersionParser('0.2.3'))
+        wheel = TimerWheel(clock=FakeClock())
+
+        def configure(protocol):
+            protocol.timer_wheel = wheel
+            protocol.timeout = 1
+        self.cache.connect(build_conduit(b''), 'serial:a:1', configure=configure)
+        assert_that(len(wheel), is_(1), "the version request has a deadline")
+
+    def test_stale_cache_entry_forgotten(self):
+        self.cache.store('serial:a:1', ControllerProtocolV023(None), VersionParser('0.2.3'))
+        stale = []
+        protocol = self.cache.connect(build_conduit(b''), 'serial:a:1', mismatch=stale.append)
+        protocol.data_received(b'N:{"v":"0.2.3"}\n')
+        assert_that(stale, is_([]))
+        protocol = self.cache.connect(build_conduit(b''), 'serial:a:1', mismatch=stale.append)
+        protocol.data_received(b'N:{"v":"0.2.4"}\n')
+        assert_that(stale, is_(['serial:a:1']))
+        assert_that(ProtocolCache(self.path).get('serial:a:1'), is_(none()))
+
+    def test_failed_verification_forgets_entry(self):
+        self.cache.store('serial:a:1', ControllerProtocolV023(None), VersionParser('0.2.3'))
+        stale = []
+        protocol = self.cache.connect(build_conduit(b''), 'serial:a:1', mismatch=stale.append)
+        protocol.data_received(b'N:{"v":"0.2.3\n')
+        assert_that(stale, is_(['serial:a:1']))
+        assert_that(self.cache.get('serial:a:1'), is_(none()))
+
+    def test_v03x_verified_by_a_request(self):
+        cache = ProtocolCache(types=verified_types)
+        cache.store('a', VerifiedProtocol(None), VersionParser('0.3.1'))
+        cache.store('b', VerifiedProtocol(None), VersionParser('0.3.1'))
+        stale = []
+        cache.connect(None, 'a', mismatch=stale.append).verification.set_result(object())
+        cache.connect(None, 'b', mismatch=stale.append).verification.set_exception(IOError())
+        assert_that(stale, is_(['b']))
+        assert_that(cache.get('a')[1].version, is_('0.3.1'))
+        assert_that(cache.get('b'), is_(none()))
+
+    def test_unanswered_verification_forgets_entry(self):
+        clock = FakeClock()
+        wheel = TimerWheel(tick=0.1, clock=clock)
+        cache = ProtocolCache(types=verified_types, timer_wheel=wheel, verify_timeout=1)
+        cache.store('a', VerifiedProtocol(None), VersionParser('0.3.1'))
+        stale = []
+        protocol = cache.connect(None, 'a', mismatch=stale.append)
+        clock.now = 2
+        wheel.advance()
+        assert_that(stale, is_(['a']))
+        protocol.verification.set_exception(IOError())
+        assert_that(stale, is_(['a']), "reported once")
+
+    def test_corrupt_cache_ignored(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        assert_that(ProtocolCache(self.path).get('a'), is_(none()))
+
+    def test_memory_only(self):
+        cache = ProtocolCache()
+        cache.store('a', ControllerProtocolV023(None), VersionParser('0.2.3'))
+        cache.forget('a')
+        assert_that(cache.get('a'), is_(none()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+from hamcrest import assert_that, calling, equal_to, instance_of, is_, is_not, raises
+
+from brewpi.protocol.scheduler import Priority, RequestDroppedError, RequestScheduler
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.v02x import ControllerProtocolV023, RequestTimeoutError
+from brewpi.protocol.test.clock import FakeClock
+from controlbox.conduit.base import DefaultConduit
+from controlbox.protocol.io import RWCacheBuffer
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.send = RWCacheBuffer()
+        self.receive = RWCacheBuffer()
+        self.conduit = DefaultConduit(self.receive.reader, self.send.writer)
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=0.1, clock=self.clock)
+        self.protocol = ControllerProtocolV023(self.conduit, timer_wheel=self.wheel, timeout=1)
+        self.scheduler = RequestScheduler(self.protocol, max_in_flight=1, max_queued_polls=2)
+
+    def sent(self):
+        self.conduit.output.flush()
+        return self.send.reader.read()
+
+    def receive_response(self, data):
+        self.receive.writer.write(data)
+        self.receive.writer.flush()
+        return self.protocol.read_response()
+
+    def test_unknown_request_raises_value_error(self):
+        assert_that(calling(self.scheduler.send_request).with_args('X'), raises(ValueError))
+
+    def test_request_sent_when_idle(self):
+        f = self.scheduler.send_request('t')
+        assert_that(self.sent(), is_(b't\n'))
+        self.receive_response(b'T{"beer": 1}\n')
+        assert_that(f.response.value, equal_to({"beer": 1}))
+
+    def test_control_request_jumps_queued_polls(self):
+        self.scheduler.send_request('t')
+        self.scheduler.send_request('v')
+        self.scheduler.send_request('j', {"a": 1})
+        assert_that(self.sent(), is_(b't\n'))
+        assert_that(self.scheduler.queued_count(), is_(2))
+        self.receive_response(b'T{"beer": 1}\n')
+        # j has no response, so completes immediately and v follows
+        assert_that(self.sent(), is_(b'j{"a": 1}\nv\n'))
+        assert_that(self.scheduler.in_flight_count, is_(1))
+
+    def test_queued_polls_are_merged(self):
+        self.scheduler.send_request('s')
+        f1 = self.scheduler.send_request('t')
+        f2 = self.scheduler.send_request('t')
+        assert_that(f2, is_(f1))
+        assert_that(self.scheduler.queued_count(Priority.poll), is_(1))
+
+    def test_requests_with_values_are_not_merged(self):
+        self.scheduler.send_request('s')
+        f1 = self.scheduler.send_request('U', {"i": 1}, Priority.poll)
+        f2 = self.scheduler.send_request('U', {"i": 1}, Priority.poll)
+        assert_that(f2, is_not(f1))
+
+    def test_oldest_poll_dropped_under_backlog(self):
+        self.scheduler.send_request('s')
+        f1 = self.scheduler.send_request('t')
+        self.scheduler.send_request('v')
+        self.scheduler.send_request('l')
+        assert_that(self.scheduler.queued_count(Priority.poll), is_(2))
+        assert_that(f1.exception(0), is_(instance_of(RequestDroppedError)))
+
+    def test_protocol_without_deadlines_refused(self):
+        protocol = ControllerProtocolV023(self.conduit)
+        assert_that(calling(RequestScheduler).with_args(protocol), raises(ValueError))
+
+    def test_lost_responses_free_their_slots(self):
+        scheduler = RequestScheduler(self.protocol, max_in_flight=2)
+        t = scheduler.send_request('t')
+        v = scheduler.send_request('v')
+        s = scheduler.send_request('s')
+        assert_that(self.sent(), is_(b't\nv\n'))
+        self.clock.now = 1.5
+        self.wheel.advance()
+        assert_that(t.exception(0), is_(instance_of(RequestTimeoutError)))
+        assert_that(v.exception(0), is_(instance_of(RequestTimeoutError)))
+        assert_that(self.sent(), is_(b's\n'))
+        self.receive_response(b'S{}\n')
+        assert_that(s.response.value, is_({}))
+        assert_that(scheduler.in_flight_count, is_(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,8 @@ import unittest
 
 from hamcrest import assert_that, calling, raises, is_, instance_of
 
-from brewpi.protocol.sniffer import all_sniffers
+from brewpi.protocol.sniffer import SnifferDispatch, all_sniffers, brewpi_v02x_protocol_sniffer, \
+    brewpi_v03x_protocol_sniffer
 from brewpi.protocol.v02x import ControllerProtocolV023
 from controlbox.conduit.base import DefaultConduit
 from controlbox.connector.base import UnknownProtocolError
@@ -40,5 +41,54 @@ class FactoryTestCase(unittest.TestCase):
         assert_that(p._conduit.input, is_(instance_of(HexToBinaryInputStream)))
 
 
+class SnifferDispatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.dispatch = SnifferDispatch()
+        self.dispatch.register(self.sniffer('bracket'), '[')
+        self.dispatch.register(self.sniffer('bracket9'), '[9')
+        self.dispatch.register(self.sniffer('N'), 'N:')
+        self.dispatch.register_legacy(self.sniffer('legacy'))
+
+    def sniffer(self, name):
+        def sniff(line, conduit):
+            self.calls.append((name, line))
+            return name if line.endswith(name) else None
+        return sniff
+
+    def names(self, line):
+        return [s.__closure__[0].cell_contents for s in self.dispatch.candidates(line)]
+
+    def test_candidates_by_prefix(self):
+        assert_that(self.names('["v":"0.3.0"]'), is_(['bracket']))
+        assert_that(self.names(b'[9abc'), is_(['bracket9', 'bracket']))
+        assert_that(self.names('N:0.2.3'), is_(['N', 'legacy']))
+        assert_that(self.names(b'x:0.2.3'), is_(['legacy']))
+        assert_that(self.names('  \r[abc'), is_(['bracket']))
+        assert_that(self.names('hello'), is_([]))
+        assert_that(self.names(''), is_([]))
+
+    def test_bytes_banner_decoded_for_sniffer(self):
+        assert_that(self.dispatch(b'x:legacy', None), is_('legacy'))
+        assert_that(self.calls, is_([('legacy', 'x:legacy')]))
+
+    def test_unmatched_banner_runs_no_sniffers(self):
+        assert_that(self.dispatch(b'garbage', None), is_(None))
+        assert_that(self.calls, is_([]))
+
+    def test_same_sniffer_not_run_twice(self):
+        dispatch = SnifferDispatch()
+        sniffer = self.sniffer('x')
+        dispatch.register(sniffer, 'N:')
+        dispatch.register_legacy(sniffer)
+        dispatch('N:0', None)
+        assert_that(len(self.calls), is_(1))
+
+    def test_real_sniffers_dispatched(self):
+        assert_that(all_sniffers[0].candidates('N:0.2.3'), is_([brewpi_v02x_protocol_sniffer]))
+        assert_that(all_sniffers[0].candidates('[]'), is_([brewpi_v03x_protocol_sniffer]))
+
+
 if __name__ == '__main__':
     unittest.main()
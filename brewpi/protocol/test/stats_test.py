@@ -0,0 +1,62 @@
+import unittest
+
+from hamcrest import assert_that, close_to, is_, less_than_or_equal_to
+
+from brewpi.protocol.stats import LatencyHistogram, ProtocolStats
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        h = LatencyHistogram()
+        assert_that(h.percentile(50), is_(None))
+        assert_that(h.snapshot()['count'], is_(0))
+        assert_that(h.mean, is_(None))
+
+    def test_small_values_are_exact(self):
+        h = LatencyHistogram()
+        for v in range(1, 11):
+            h.record(v)
+        assert_that(h.percentile(50), is_(5))
+        assert_that(h.percentile(100), is_(10))
+        assert_that(h.min, is_(1))
+        assert_that(h.mean, is_(5.5))
+
+    def test_large_values_within_relative_error(self):
+        h = LatencyHistogram(sub_bucket_bits=5)
+        for v in range(1000, 1000000, 997):
+            h.record(v)
+        for percent in (10, 50, 90, 99):
+            exact = 1000 + (1000000 - 1000) * percent / 100
+            assert_that(h.percentile(percent), is_(close_to(exact, exact / 16 + 997)))
+        assert_that(h.percentile(100), is_(less_than_or_equal_to(h.max)))
+
+    def test_upper_bound_inverts_index(self):
+        h = LatencyHistogram(sub_bucket_bits=3)
+        for v in range(0, 5000):
+            index = h._index(v)
+            assert_that(v <= h._upper_bound(index), is_(True))
+            assert_that(h._index(h._upper_bound(index)), is_(index))
+
+
+class ProtocolStatsTest(unittest.TestCase):
+
+    def test_reset(self):
+        stats = ProtocolStats(clock=lambda: 0)
+        stats.request_sent(b't', 2)
+        stats.unsolicited_received(5)
+        stats.reset()
+        assert_that(stats.snapshot(), is_(
+            {'bytes_out': 0, 'bytes_in': 0, 'unrecognized': 0, 'unsolicited': 0, 'commands': {}}))
+
+    def test_command(self):
+        stats = ProtocolStats(clock=lambda: 1.5)
+        stats.request_sent(b's', 2)
+        stats.response_received(b's', 20, 1.0)
+        s = stats.command(b's')
+        assert_that(s['bytes_in'], is_(20))
+        assert_that(s['latency_us']['p50'], is_(close_to(500000, 500000 / 16)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+from hamcrest import assert_that, is_
+
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.test.clock import FakeClock
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wheel = TimerWheel(tick=0.1, slots=8, clock=self.clock)
+        self.fired = []
+
+    def schedule(self, delay, name):
+        return self.wheel.schedule(delay, lambda: self.fired.append(name))
+
+    def advance_to(self, now):
+        self.clock.now = now
+        return self.wheel.advance()
+
+    def test_fires_after_deadline(self):
+        self.schedule(0.5, 'a')
+        assert_that(self.advance_to(0.45), is_(0))
+        assert_that(self.advance_to(0.65), is_(1))
+        assert_that(self.fired, is_(['a']))
+        assert_that(len(self.wheel), is_(0))
+
+    def test_cancelled_timer_does_not_fire(self):
+        t = self.schedule(0.2, 'a')
+        self.schedule(0.2, 'b')
+        t.cancel()
+        assert_that(t.cancelled, is_(True))
+        self.advance_to(1)
+        assert_that(self.fired, is_(['b']))
+
+    def test_timer_beyond_one_revolution(self):
+        # 8 slots of 0.1s, so a 2s timer shares a slot with nearer deadlines
+        self.schedule(2.0, 'far')
+        self.schedule(0.35, 'near')
+        self.advance_to(0.5)
+        assert_that(self.fired, is_(['near']))
+        self.advance_to(1.0)
+        self.advance_to(1.95)
+        assert_that(self.fired, is_(['near']))
+        self.advance_to(2.15)
+        assert_that(self.fired, is_(['near', 'far']))
+
+    def test_large_jump_fires_everything_due(self):
+        for x in range(20):
+            self.schedule(x * 0.3, x)
+        self.advance_to(100)
+        assert_that(sorted(self.fired), is_(list(range(20))))
+
+    def test_callback_error_does_not_stop_other_timers(self):
+        def fail():
+            raise ValueError()
+        self.wheel.schedule(0.1, fail)
+        self.schedule(0.1, 'a')
+        self.advance_to(1)
+        assert_that(self.fired, is_(['a']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
 import unittest
 from collections import OrderedDict
+from io import BytesIO
 
-from hamcrest import assert_that, equal_to, is_, not_none
+from hamcrest import assert_that, calling, equal_to, instance_of, is_, is_not, not_none, raises, same_instance
 
-from brewpi.protocol.v02x import ControllerProtocolV023
+from brewpi.protocol.v02x import CharacterLCDInfo, ControllerProtocolV023, FrameScanner, JSONFormat, \
+    LogMessage, MalformedResponseError, MessageFormat, MessageRequest, PendingResponses, RequestTimeoutError
+from brewpi.protocol.timer import TimerWheel
+from brewpi.protocol.test.clock import FakeClock
 from controlbox.conduit.base import DefaultConduit
 from controlbox.protocol.io import RWCacheBuffer
 
@@ -54,11 +58,295 @@ class BrewpiProtocolV023UnitTest(unittest.TestCase):
             {"a": 1, "b": 2}), "expected response from contents in stream")
         assert_that(args[0], is_(r), "expected callback to have been invoked")
 
+    def test_pipelined_requests_are_all_sent(self):
+        self.protocol.request_temperatures()
+        self.protocol.send_request('v')
+        self.protocol.send_request('s')
+        self.assert_request(b't\n')
+        self.assert_request(b'v\n')
+        self.assert_request(b's\n')
+        assert_that(self.protocol.pending_count(), is_(3))
+
+    def test_pipelined_requests_with_values_are_not_coalesced(self):
+        f1 = self.protocol.send_request('U', {"i": 1})
+        f2 = self.protocol.send_request('U', {"i": 1})
+        assert_that(f1, is_not(f2))
+        assert_that(self.protocol.pending_count('U'), is_(2))
+
+    def with_deadlines(self):
+        self.protocol.timer_wheel = TimerWheel(tick=0.1, clock=FakeClock())
+        self.protocol.timeout = 1
+
+    def test_identical_outstanding_requests_are_coalesced(self):
+        self.with_deadlines()
+        f1 = self.protocol.request_temperatures()
+        f2 = self.protocol.request_temperatures()
+        f3 = self.protocol.send_request('s')
+        assert_that(f2, is_(f1))
+        assert_that(f3, is_not(f1))
+        self.assert_request(b't\n')
+        self.assert_request(b's\n')
+        assert_that(self.protocol.pending_count(), is_(2))
+        self.receive_response(b'T{"beer": 1}\n')
+        assert_that(f2.response.value, equal_to({"beer": 1}))
+
+    def test_requests_without_deadline_are_not_coalesced(self):
+        f1 = self.protocol.request_temperatures()
+        self.protocol.data_received(b'\x00{"beer": 2}\n')
+        f2 = self.protocol.request_temperatures()
+        assert_that(f2, is_not(f1))
+        self.assert_request(b't\n')
+        self.assert_request(b't\n')
+
+    def test_resolved_request_is_not_coalesced(self):
+        self.with_deadlines()
+        f1 = self.protocol.request_temperatures()
+        self.receive_response(b'T{"beer": 1}\n')
+        f2 = self.protocol.request_temperatures()
+        assert_that(f2, is_not(f1))
+        assert_that(self.protocol.pending_count('T'), is_(1))
+
+    def test_failed_write_does_not_take_a_response(self):
+        def broken(request):
+            raise BrokenPipeError()
+        stream_request = self.protocol._stream_request
+        self.protocol._stream_request = broken
+        assert_that(calling(self.protocol.send_request).with_args('s'), raises(BrokenPipeError))
+        assert_that(self.protocol.pending_count(), is_(0))
+        self.protocol._stream_request = stream_request
+        s = self.protocol.send_request('s')
+        self.receive_response(b'S{"a": 1}\n')
+        assert_that(s.response.value, equal_to({"a": 1}))
+
+    def test_pipelined_responses_matched_in_order(self):
+        # requests sent directly are not coalesced
+        t = MessageRequest(ControllerProtocolV023.requests[b't'])
+        t1 = self.protocol.async_request(t)
+        v = self.protocol.send_request('v')
+        t2 = self.protocol.async_request(t)
+        self.receive_response(b'T{"beer": 1}\n')
+        self.receive_response(b'V{"a": 2}\n')
+        self.receive_response(b'T{"beer": 3}\n')
+        assert_that(t1.response.value, equal_to({"beer": 1}))
+        assert_that(v.response.value, equal_to({"a": 2}))
+        assert_that(t2.response.value, equal_to({"beer": 3}))
+        assert_that(self.protocol.pending_count(), is_(0))
+
+    def test_unsolicited_response_does_not_consume_pending(self):
+        args = list()
+        self.protocol.add_unmatched_response_handler(argument_capture_callback(args))
+        t = self.protocol.request_temperatures()
+        self.receive_response(b'C{"a": 1}\n')
+        assert_that(len(args), is_(1))
+        assert_that(self.protocol.pending_count('T'), is_(1))
+        self.receive_response(b'T{"beer": 1}\n')
+        assert_that(t.response.value, equal_to({"beer": 1}))
+
+    def test_data_received_buffers_partial_response(self):
+        t = self.protocol.request_temperatures()
+        assert_that(self.protocol.data_received(b'T{"beer"'), is_([]))
+        responses = self.protocol.data_received(b': 1}\nV{"a"')
+        assert_that(len(responses), is_(1))
+        assert_that(t.response.value, equal_to({"beer": 1}))
+        responses = self.protocol.data_received(b': 2}\r\n')
+        assert_that(responses[0].value, equal_to({"a": 2}))
+
+    def test_data_received_version(self):
+        responses = self.protocol.data_received(b'N{"v":"0.2.3","y":1}\n')
+        assert_that(responses[0].value.version, is_("0.2.3"))
+        assert_that(responses[0].value.simulator, is_(True))
+
+    def test_data_received_skips_malformed_response(self):
+        responses = self.protocol.data_received(b'C{"a":\nZ\n\nS{"b": 1}\n')
+        assert_that(len(responses), is_(1))
+        assert_that(responses[0].value, equal_to({"b": 1}))
+
+    def test_malformed_response_fails_coalesced_request(self):
+        self.with_deadlines()
+        t1 = self.protocol.request_temperatures()
+        self.assert_request(b't\n')
+        assert_that(self.protocol.data_received(b'T{"beer": 2\n'), is_([]))
+        assert_that(t1.exception(0), is_(instance_of(MalformedResponseError)))
+        t2 = self.protocol.request_temperatures()
+        assert_that(t2, is_not(t1))
+        self.assert_request(b't\n')
+        self.protocol.data_received(b'T{"beer": 3}\n')
+        assert_that(t2.response.value, equal_to({"beer": 3}))
+
+    def test_lcd_response_updates_changed_rows(self):
+        changes = list()
+        self.protocol.lcd.add_listener(lambda lcd, rows: changes.append(rows))
+        f = self.protocol.lcd_display()
+        self.assert_request(b'l\n')
+        self.receive_response(b'L["Mode   Beer Const.","Beer 20.0","",""]\n')
+        assert_that(f.response.value[0], is_("Mode   Beer Const."))
+        assert_that(changes, is_([{0: "Mode   Beer Const.  ", 1: "Beer 20.0           "}]))
+        self.receive_response(b'L["Mode   Beer Const.","Beer 20.1","",""]\n')
+        assert_that(changes[1], is_({1: "Beer 20.1           "}))
+        self.receive_response(b'L["Mode   Beer Const.","Beer 20.1","",""]\n')
+        assert_that(len(changes), is_(2), "no event when nothing changes")
+
+    def test_log_message_response(self):
+        r = self.receive_response(b'D{"logType":"E","logID":3,"V":[1,"a"]}\n')
+        assert_that(r.value, is_(LogMessage("E", 3, [1, "a"])))
+
+    def test_stats_count_round_trip(self):
+        times = iter([10.0, 10.25])
+        self.protocol.stats.clock = lambda: next(times)
+        self.protocol.request_temperatures()
+        self.receive_response(b'T{"beer": 1}\n')
+        self.receive_response(b'C{}\n')
+        self.receive_response(b'Z')
+        stats = self.protocol.stats.snapshot()
+        assert_that(stats['bytes_out'], is_(2))
+        assert_that(stats['bytes_in'], is_(18))
+        assert_that(stats['unsolicited'], is_(1))
+        assert_that(stats['unrecognized'], is_(1))
+        t = stats['commands'][b't']
+        assert_that(t['requests'], is_(1))
+        assert_that(t['responses'], is_(1))
+        assert_that(t['bytes_in'], is_(13))
+        assert_that(t['latency_us']['max'], is_(250000))
+
+    def test_request_fails_after_deadline(self):
+        clock = FakeClock()
+        wheel = TimerWheel(tick=0.1, clock=clock)
+        self.protocol.timer_wheel = wheel
+        self.protocol.timeout = 1
+        t = self.protocol.request_temperatures()
+        s = self.protocol.send_request('s', None)
+        v = self.protocol.async_request(MessageRequest(ControllerProtocolV023.requests[b'v']), timeout=5)
+        self.receive_response(b'S{}\n')
+        assert_that(len(wheel), is_(2))
+        clock.now = 1.5
+        wheel.advance()
+        assert_that(t.exception(0), is_(instance_of(RequestTimeoutError)))
+        assert_that(s.response.value, is_({}))
+        assert_that(self.protocol.pending_count(), is_(1), "timed out request frees its slot")
+        assert_that(self.protocol.request_temperatures(), is_not(t))
+        assert_that(self.protocol.stats.command(b't')['timeouts'], is_(1))
+        self.receive_response(b'V{}\n')
+        assert_that(v.response.value, is_({}))
+
+    def test_settings_changes_published(self):
+        events = list()
+        self.protocol.changes.add_listener(events.append)
+        self.receive_response(b'S{"mode": "b", "beerSet": 20.0}\n')
+        self.receive_response(b'S{"mode": "b", "beerSet": 20.0}\n')
+        self.receive_response(b'S{"mode": "f", "beerSet": 20.0}\n')
+        assert_that(len(events), is_(2))
+        assert_that(events[1].changed, is_({"mode": "f"}))
+
+    def receive_response(self, data):
+        self.receive.writer.write(data)
+        self.receive.writer.flush()
+        return self.protocol.read_response()
+
     def assert_request(self, expected):
         self.conduit.output.flush()
         line = self.send.reader.readline()
         assert_that(line, equal_to(expected))
 
 
+class CharacterLCDInfoTest(unittest.TestCase):
+
+    def test_initially_blank(self):
+        lcd = CharacterLCDInfo(4, 2)
+        assert_that(lcd.rows, is_(["    ", "    "]))
+        assert_that(lcd.dimensions, is_((4, 2)))
+
+    def test_update_truncates_and_pads(self):
+        lcd = CharacterLCDInfo(4, 2)
+        changed = lcd.update(["abcdef", "x", "ignored"])
+        assert_that(changed, is_({0: "abcd", 1: "x   "}))
+        assert_that(lcd.rows, is_(["abcd", "x   "]))
+
+    def test_removed_listener_not_notified(self):
+        changes = list()
+        lcd = CharacterLCDInfo(4, 1)
+        lcd.add_listener(changes.append)
+        lcd.remove_listener(changes.append)
+        lcd.update(["a"])
+        assert_that(changes, is_([]))
+
+
+class MessageRequestTest(unittest.TestCase):
+
+    def test_request_without_value_uses_constant_frame(self):
+        defn = ControllerProtocolV023.requests[b't']
+        frame = MessageRequest(defn).encode()
+        assert_that(frame, is_(b't\n'))
+        assert_that(MessageRequest(defn).encode(), is_(same_instance(frame)))
+
+    def test_request_with_value(self):
+        defn = ControllerProtocolV023.requests[b'j']
+        assert_that(MessageRequest(defn, {"a": 1}).encode(), is_(b'j{"a": 1}\n'))
+
+    def test_to_stream_writes_once(self):
+        writes = list()
+
+        class Writer:
+            def write(self, data):
+                writes.append(data)
+
+        defn = ControllerProtocolV023.requests[b'U']
+        MessageRequest(defn, {"i": 2}).to_stream(Writer())
+        assert_that(writes, is_([b'U{"i": 2}\n']))
+
+
+class MessageFormatTest(unittest.TestCase):
+
+    def test_scan_excludes_line_terminator(self):
+        class Recording(MessageFormat):
+            def decode(self, buffer, start, end):
+                return bytes(buffer[start:end])
+
+            def encode(self, item):
+                raise NotImplementedError
+
+        assert_that(Recording().scan(BytesIO(b'["a"]\r\nnext')), is_(b'["a"]'))
+        assert_that(JSONFormat().scan(BytesIO(b'{"a": 1}\n')), is_({"a": 1}))
+
+
+class PendingResponsesTest(unittest.TestCase):
+
+    def test_pop_empty_is_none(self):
+        assert_that(PendingResponses().pop(b'T'), is_(None))
+
+    def test_fifo_per_key(self):
+        p = PendingResponses()
+        p.add(b'T', 1)
+        p.add(b'V', 2)
+        p.add(b'T', 3)
+        assert_that(p.count(), is_(3))
+        assert_that(p.count(b'T'), is_(2))
+        assert_that(p.pop(b'T'), is_(1))
+        assert_that(p.pop(b'T'), is_(3))
+        assert_that(p.pop(b'T'), is_(None))
+        assert_that(p.pop(b'V'), is_(2))
+
+
+class FrameScannerTest(unittest.TestCase):
+
+    def frames(self, scanner, data):
+        return [bytes(scanner.buffer[start:end]) for start, end in scanner.feed(data)]
+
+    def test_partial_frame_is_buffered(self):
+        scanner = FrameScanner()
+        assert_that(self.frames(scanner, b'abc'), is_([]))
+        assert_that(self.frames(scanner, b'def\ngh'), is_([b'abcdef']))
+        assert_that(scanner.buffer, is_(bytearray(b'gh')))
+
+    def test_multiple_frames(self):
+        scanner = FrameScanner()
+        assert_that(self.frames(scanner, b'a\r\n\nb\nc\n'), is_([b'a', b'b', b'c']))
+        assert_that(len(scanner.buffer), is_(0))
+
+    def test_overlong_frame_is_discarded(self):
+        scanner = FrameScanner(max_frame_length=4)
+        assert_that(self.frames(scanner, b'abcdef'), is_([]))
+        assert_that(self.frames(scanner, b'gh\nij\n'), is_([b'gh', b'ij']))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 
-from hamcrest import assert_that, calling, raises
+from hamcrest import assert_that, calling, is_, raises
 from brewpi.protocol.version import VersionParser
 
 
@@ -75,6 +75,12 @@ class VersionTestCase(unittest.TestCase):
         self.assertEqual(v.simulator, False)
         self.assertEqual(v.shield, VersionParser.shield_revC)
 
+    def test_dict_round_trip(self):
+        v = VersionParser('{"v":"1.2.3", "b":"l", "y":1, "s":2, "n":"abc", "l":1}')
+        v2 = VersionParser.from_dict(v.as_dict())
+        assert_that(v2.as_dict(), is_(v.as_dict()))
+        self.assertVersionEqual(v2, 1, 2, 3, "1.2.3")
+
     def test_malformed_input_raises_value_error(self):
         v = VersionParser()
         assert_that(calling(v.parse).with_args('{v:}'), raises(ValueError))
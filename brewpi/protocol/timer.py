@@ -0,0 +1,115 @@
+"""
+A hashed timer wheel for managing many deadlines cheaply.
+Scheduling and cancelling are O(1), and advancing the wheel only visits the slots for the ticks that elapsed,
+so a single wheel can track the deadlines of thousands of outstanding requests.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """ A callback scheduled on a TimerWheel. """
+
+    def __init__(self, wheel, deadline, callback):
+        self.wheel = wheel
+        self.deadline = deadline    # in ticks
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        """ stops the callback from being invoked. Has no effect if the timer has already fired. """
+        self.wheel._cancel(self)
+
+
+class TimerWheel:
+    """
+    Timers are hashed into a fixed ring of slots by their deadline tick. Timers further away than one
+    revolution share slots with nearer timers, and stay in their slot until their deadline tick comes round.
+    """
+
+    def __init__(self, tick=0.1, slots=512, clock=time.monotonic):
+        """
+        :param tick: the resolution of the wheel, in seconds. Timers fire up to one tick late.
+        :param slots: the number of slots in the ring
+        :param clock: returns the current time in seconds
+        """
+        self.tick = tick
+        self.clock = clock
+        self._slots = [set() for _ in range(slots)]
+        self._current = self._ticks(clock())
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _ticks(self, now):
+        return int(now / self.tick)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(s) for s in self._slots)
+
+    def schedule(self, delay, callback) -> Timer:
+        """
+        Schedules a callback to be invoked after the given delay.
+        :param delay: the delay in seconds
+        :param callback: a callable with no arguments
+        :return: the Timer, which can be cancelled
+        """
+        deadline = self._ticks(self.clock() + delay) + 1
+        timer = Timer(self, deadline, callback)
+        with self._lock:
+            deadline = max(deadline, self._current + 1)
+            timer.deadline = deadline
+            self._slots[deadline % len(self._slots)].add(timer)
+        return timer
+
+    def _cancel(self, timer):
+        with self._lock:
+            timer.cancelled = True
+            self._slots[timer.deadline % len(self._slots)].discard(timer)
+
+    def advance(self, now=None):
+        """
+        Fires the timers whose deadline has passed. This is called periodically by the background thread,
+        or can be called directly when the wheel is driven by an external loop.
+        :param now: the current time. Defaults to the clock time.
+        :return: the number of timers fired
+        """
+        target = self._ticks(self.clock() if now is None else now)
+        due = []
+        with self._lock:
+            slot_count = len(self._slots)
+            # after a full revolution every slot has been visited, so skip ahead
+            first = max(self._current + 1, target - slot_count + 1)
+            for tick in range(first, target + 1):
+                slot = self._slots[tick % slot_count]
+                expired = [t for t in slot if t.deadline <= target]
+                slot.difference_update(expired)
+                due.extend(expired)
+            self._current = max(self._current, target)
+        for timer in due:
+            try:
+                timer.callback()
+            except Exception as e:
+                logger.exception(e)
+        return len(due)
+
+    def start(self):
+        """ starts a daemon thread that advances the wheel every tick """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="timer wheel", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            self.advance()
@@ -3,12 +3,20 @@ The original brewpi protocol (0.2.x) implemented with the class ControllerProtoc
 """
 
 import json
+import logging
+import threading
 from abc import abstractmethod
+from collections import defaultdict, deque, namedtuple
 from io import BufferedIOBase
 
+from brewpi.protocol.changes import ResponseDiffer
+from brewpi.protocol.stats import ProtocolStats
+from brewpi.protocol.timer import TimerWheel
 from brewpi.protocol.version import VersionParser
 from controlbox.protocol.async import FutureValue, Request, BaseAsyncProtocolHandler, FutureResponse, Response, tobytes
 
+logger = logging.getLogger(__name__)
+
 
 def brewpi_v02x_protocol_sniffer(line, conduit):
     result = None
@@ -23,73 +31,165 @@ def brewpi_v02x_protocol_sniffer(line, conduit):
 
 
 class CharacterLCDInfo:
-    """ describes an LCD attached to the controller
+    """ describes an LCD attached to the controller, and mirrors the text it displays.
+    Listeners are notified with only the rows that change.
     """
 
     def __init__(self, width, height):
         self.width = width
         self.height = height
+        self.rows = [' ' * width] * height
+        self._listeners = []
 
     @property
     def dimensions(self):
         return self.width, self.height
 
+    def add_listener(self, listener):
+        """ adds a callable that is invoked with this LCD and a dict of the changed rows, keyed by row index """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def update(self, rows):
+        """
+        Updates the displayed text, and notifies listeners of the rows that differ from the previous content.
+        :param rows: the text of each row. Rows are padded or truncated to the width of the display.
+        :return: a dict of the changed rows, keyed by row index
+        """
+        changed = dict()
+        width = self.width
+        for index, text in enumerate(rows[:self.height]):
+            text = text[:width].ljust(width)
+            if self.rows[index] != text:
+                self.rows[index] = text
+                changed[index] = text
+        if changed:
+            for listener in self._listeners:
+                listener(self, changed)
+        return changed
+
 
 class MessageFormat:
     """ Describes a way to convert a streamed message to and from an object representation """
 
-    @abstractmethod
     def scan(self, reader):
         """
+        Reads the remainder of a line-based message from the stream and decodes it.
         :param reader: the stream to read subsequent bytes from. Bytes can be peeked, and not consumed.
         :return: an object representing the scanned message format
         """
-        pass
+        line = reader.readline()
+        return self.decode(line, 0, len(line.rstrip(b'\r\n')))
 
     @abstractmethod
+    def decode(self, buffer, start, end):
+        """
+        Decodes a message held in a buffer without consuming it.
+        :param buffer: a bytes-like object containing the message
+        :param start: the index of the first byte of the message
+        :param end: the index after the last byte of the message, excluding the line terminator
+        :return: an object representing the decoded message
+        """
+        pass
+
     def produce(self, item, writer):
+        writer.write(self.encode(item))
+
+    @abstractmethod
+    def encode(self, item) -> bytes:
+        """ converts the item to the bytes sent on the wire """
         pass
 
 
 class JSONFormat(MessageFormat):
 
-    def produce(self, item, writer):
-        out = json.dumps(item)
-        writer.write(tobytes(out))
+    def encode(self, item):
+        return json.dumps(item).encode('ascii')
 
-    def scan(self, reader):
-        """assumes line based reader"""
-        line = reader.readline()
-        parsed = json.loads(line.decode('ascii'))
-        return parsed
+    def decode(self, buffer, start, end):
+        return json.loads(buffer[start:end])
 
 
 class VersionFormat(MessageFormat):
+    """ The version is sent in response to the 'n' request, and as the "N:" banner when the controller starts. """
 
-    def scan(self, reader):
-        line = reader.readline()
-        return VersionParser(line)
+    def decode(self, buffer, start, end):
+        line = bytes(buffer[start:end]).decode('ascii')
+        return VersionParser(line[1:] if line.startswith(':') else line)
 
-    def produce(self, item, writer):
+    def encode(self, item):
         raise NotImplementedError
 
 
 class LCDDisplayFormat(MessageFormat):
+    """ The LCD contents are sent as a JSON array holding the text of each row. """
 
-    def produce(self, item, writer):
-        pass
+    def encode(self, item):
+        raise NotImplementedError
+
+    def decode(self, buffer, start, end):
+        return json.loads(buffer[start:end])
 
-    def scan(self, reader):
-        pass
+
+LogMessage = namedtuple('LogMessage', ['log_type', 'log_id', 'values'])
 
 
 class LogMessageFormat(MessageFormat):
+    """ Log messages are a JSON object with the log type, the ID of the message and the values for the
+    message placeholders. The message text itself is not sent by the controller. """
 
-    def produce(self, item, writer):
-        pass
+    def encode(self, item):
+        raise NotImplementedError
+
+    def decode(self, buffer, start, end):
+        j = json.loads(buffer[start:end])
+        return LogMessage(j.get('logType'), j.get('logID'), j.get('V', []))
 
-    def scan(self, reader):
-        pass
+
+class FrameScanner:
+    """ Splits received data into newline-terminated frames without blocking on partial lines.
+    Data is accumulated in a single receive buffer that is reused for the lifetime of the scanner.
+    Frames are reported as offsets into the buffer so they can be decoded in place.
+    """
+
+    def __init__(self, max_frame_length=4096):
+        """
+        :param max_frame_length: the longest unterminated frame that is buffered. Longer frames are
+            discarded, so a noisy line cannot grow the buffer without bound.
+        """
+        self.buffer = bytearray()
+        self.max_frame_length = max_frame_length
+
+    def feed(self, data):
+        """
+        Appends data to the receive buffer and yields the (start, end) offsets of each complete frame
+        in the buffer. The offsets exclude the line terminator, and are only valid until the generator
+        is resumed. A trailing partial frame is kept until the rest of it is fed.
+        """
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        try:
+            while True:
+                end = buffer.find(b'\n', start)
+                if end < 0:
+                    break
+                frame_start, start = start, end + 1
+                if end > frame_start and buffer[end - 1] == 0x0D:    # strip \r
+                    end -= 1
+                if end > frame_start:
+                    yield frame_start, end
+        finally:
+            del buffer[:start]
+            if len(buffer) > self.max_frame_length:
+                del buffer[:]
+
+    def reset(self):
+        """ discards any partially received frame """
+        del self.buffer[:]
 
 
 class BaseDef(object):
@@ -101,6 +201,12 @@ class BaseDef(object):
 class RequestDef(BaseDef):
     responses = None
 
+    @property
+    def read_only(self):
+        """ A request that sends no data and expects a response only fetches state from the controller.
+        Identical read-only requests that are outstanding at the same time can share a single response. """
+        return self.format_type is None and self.responses is not None
+
 
 class ResponseDef(BaseDef):
     pass
@@ -126,25 +232,42 @@ def defs_as_dict(*defs):
 
 
 class MessageRequest(Request):
+    # the frames for requests that carry no data never change, so are encoded once
+    _constant_frames = dict()
 
     def __init__(self, defn: RequestDef, value=None):
         self.defn = defn
         self.value = value
+        self.sent_time = None
+        self._frame = None
 
     @property
     def response_keys(self):
         return self.defn.responses
 
+    def encode(self) -> bytes:
+        """
+        The complete request frame: the request character, optionally any additional data required by the
+        message format and value, and the line terminator.
+        """
+        if self._frame is None:
+            char = self.defn.char
+            mf = self.defn.format_type
+            value = self.value
+            if mf is not None and value is not None:
+                self._frame = b''.join((char, mf.encode(value), b'\n'))
+            else:
+                frame = self._constant_frames.get(char)
+                if frame is None:
+                    frame = self._constant_frames[char] = char + b'\n'
+                self._frame = frame
+        return self._frame
+
     def to_stream(self, file: BufferedIOBase):
         """
-         streams the request character, and optionally any additional data required by the message format and value
+         streams the request as a single write, so it is not split over several small writes to the device
         """
-        file.write(self.defn.char)
-        mf = self.defn.format_type
-        value = self.value
-        if mf is not None and value is not None:
-            mf.produce(value, file)
-        file.write(b'\n')
+        file.write(self.encode())
 
 
 class MessageResponse(Response):
@@ -152,11 +275,16 @@ class MessageResponse(Response):
     def __init__(self, defn):
         self.defn = defn
         self._value = None
+        self.length = 0     # the number of bytes received for this response
 
     def from_stream(self, file):
         if self.defn.format_type is not None:
             self._value = self.defn.format_type.scan(file)
 
+    def from_buffer(self, buffer, start, end):
+        if self.defn.format_type is not None:
+            self._value = self.defn.format_type.decode(buffer, start, end)
+
     @property
     def response_key(self):
         return self.defn.char
@@ -166,6 +294,56 @@ class MessageResponse(Response):
         return self._value
 
 
+class PendingResponses:
+    """ The futures waiting for a response, held as a FIFO per response key.
+    The 0.2.x protocol has no request identifiers, so the controller answers requests that share
+    a response key in the order they were sent.
+    """
+
+    def __init__(self):
+        self._queues = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def add(self, key, future):
+        """ appends the future to the queue of futures waiting on the given response key """
+        with self._lock:
+            self._queues[key].append(future)
+
+    def remove(self, key, future):
+        """ removes the future from the queue for the key.
+        :return: True if the future was waiting and has been removed """
+        with self._lock:
+            queue = self._queues.get(key)
+            try:
+                queue.remove(future)
+                return True
+            except (AttributeError, ValueError):
+                return False
+
+    def pop(self, key):
+        """ removes and returns the oldest future waiting on the given response key, or None """
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                return None
+            return queue.popleft()
+
+    def count(self, key=None):
+        """ the number of futures waiting on the given key, or on all keys when key is None """
+        with self._lock:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return sum(len(q) for q in self._queues.values())
+
+
+class RequestTimeoutError(TimeoutError):
+    """ The controller did not respond to the request before its deadline. """
+
+
+class MalformedResponseError(ValueError):
+    """ The response to the request could not be decoded. """
+
+
 class ControllerProtocolV023(BaseAsyncProtocolHandler):
     JSONFormat.instance = JSONFormat()
 
@@ -196,11 +374,29 @@ class ControllerProtocolV023(BaseAsyncProtocolHandler):
         response_def(b'V', "Values", JSONFormat.instance)
     )
 
-    def __init__(self, conduit):
+    def __init__(self, conduit, lcd: CharacterLCDInfo = None, timer_wheel: TimerWheel = None, timeout=None):
+        """
+        :param conduit: the conduit to the controller
+        :param lcd: the mirror of the controller's LCD. Defaults to a 20x4 display.
+        :param timer_wheel: the wheel that manages request deadlines. Usually shared by all the controllers
+            of a connector. Requests have no deadline when this is None.
+        :param timeout: the default time in seconds a request waits for its response
+        """
         super().__init__(conduit)
+        self.lcd = lcd or CharacterLCDInfo(20, 4)
+        self.timer_wheel = timer_wheel
+        self.timeout = timeout
+        self._timers = dict()
+        self._pending = PendingResponses()
+        self._write_lock = threading.Lock()
+        self._in_flight = dict()
+        self._in_flight_lock = threading.Lock()
+        self._scanner = FrameScanner()
+        self.stats = ProtocolStats()
+        self.changes = ResponseDiffer()
 
     def lcd_display(self) -> FutureResponse:
-        return self.send_request('L')
+        return self.send_request('l')
 
     def sound_alarm(self) -> FutureValue:
         return self.send_request('A')
@@ -219,6 +415,8 @@ class ControllerProtocolV023(BaseAsyncProtocolHandler):
         request_defn = self.requests.get(request_type)
         if request_defn is None:
             raise ValueError("unknown command %s" % request_type)
+        if value is None and request_defn.read_only and self._has_deadline():
+            return self._coalesced_request(request_defn)
         r = MessageRequest(request_defn, value)
         future = self.async_request(r)
         if request_defn.responses is None:
@@ -227,16 +425,156 @@ class ControllerProtocolV023(BaseAsyncProtocolHandler):
             self._set_future_response(future, None)
         return future
 
+    def _has_deadline(self):
+        return self.timer_wheel is not None and bool(self.timeout)
+
+    def _coalesced_request(self, request_defn: RequestDef) -> FutureResponse:
+        """ Returns the future of an identical request that is still awaiting its response,
+        or sends a new request when there is none. Requests are only coalesced when they have a deadline,
+        so a response that is lost cannot hold up every later identical request. """
+        with self._in_flight_lock:
+            future = self._in_flight.get(request_defn.char)
+            if future is None:
+                future = self.async_request(MessageRequest(request_defn))
+                self._in_flight[request_defn.char] = future
+            return future
+
+    def _forget_in_flight(self, future: FutureResponse):
+        """ stops coalescing new requests onto a future that has been resolved """
+        with self._in_flight_lock:
+            char = future.request.defn.char
+            if self._in_flight.get(char) is future:
+                del self._in_flight[char]
+
+    def async_request(self, request: MessageRequest, timeout=None) -> FutureResponse:
+        """ Sends the request without waiting for responses to earlier requests, so that
+        several requests can be in flight on the conduit at once.
+        The future is queued against the response key before the request is written, so the queue
+        order always matches the order requests appear on the wire.
+        :param timeout: the time in seconds to wait for the response, after which the future fails with
+            RequestTimeoutError. Defaults to the protocol timeout.
+        """
+        future = FutureResponse(request)
+        key = request.response_keys
+        stats = self.stats
+        with self._write_lock:
+            if key is not None:
+                self._pending.add(key, future)
+                self._schedule_deadline(key, future, timeout or self.timeout)
+            request.sent_time = stats.clock()
+            try:
+                self._stream_request(request)
+            except Exception:
+                # a request that never reached the controller must not take the response to a later one
+                if key is not None:
+                    self._pending.remove(key, future)
+                    self._cancel_deadline(future)
+                raise
+        stats.request_sent(request.defn.char, len(request.encode()))
+        return future
+
+    def _schedule_deadline(self, key, future, timeout):
+        if self.timer_wheel is not None and timeout:
+            self._timers[future] = self.timer_wheel.schedule(timeout, lambda: self._expire(key, future))
+
+    def _cancel_deadline(self, future):
+        timer = self._timers.pop(future, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _expire(self, key, future: FutureResponse):
+        """ fails a future that is still waiting for its response, and frees its place in the queue """
+        self._timers.pop(future, None)
+        if self._pending.remove(key, future):
+            self._forget_in_flight(future)
+            self.stats.request_timed_out(future.request.defn.char)
+            future.set_exception(RequestTimeoutError("no response to %s" % future.request.defn.name))
+
+    def _response_malformed(self, key, error):
+        """ fails the oldest future waiting on a response that could not be decoded. This keeps the queue in step
+        with the controller, and stops identical requests being coalesced onto a response that will never come. """
+        future = self._pending.pop(key)
+        if future is not None:
+            self._cancel_deadline(future)
+            self._forget_in_flight(future)
+            future.set_exception(MalformedResponseError("malformed response to %s: %s" %
+                                                        (future.request.defn.name, error)))
+
+    def process_response(self, response: Response):
+        """ Resolves the oldest future waiting on the response key. Responses nothing is waiting
+        for are passed to the unmatched response handlers. LCD contents also update the lcd mirror,
+        and JSON objects are compared with the previous response to publish the changes. """
+        value = response.value
+        if response.response_key == b'L' and value is not None:
+            self.lcd.update(value)
+        elif isinstance(value, dict) and isinstance(response.defn.format_type, JSONFormat):
+            self.changes.update(response.response_key, value)
+        future = self._pending.pop(response.response_key)
+        if future is None:
+            self.stats.unsolicited_received(response.length)
+            super().process_response(response)
+        else:
+            self._cancel_deadline(future)
+            request = future.request
+            self.stats.response_received(request.defn.char, response.length, request.sent_time)
+            self._forget_in_flight(future)
+            self._set_future_response(future, response)
+
+    def pending_count(self, response_key=None):
+        """ the number of requests still awaiting a response """
+        return self._pending.count(tobytes(response_key) if response_key is not None else None)
+
+    def data_received(self, data):
+        """
+        Decodes and processes the complete responses in the received data. Any partial response at the
+        end is buffered until the remainder is received, so this never blocks waiting for input,
+        and a single thread can service many conduits.
+        :param data: the bytes received from the controller
+        :return: the responses decoded
+        """
+        responses = []
+        buffer = self._scanner.buffer
+        for start, end in self._scanner.feed(data):
+            try:
+                response = self._decode_frame(buffer, start, end)
+            except ValueError as e:
+                logger.warning("discarding malformed response %s", bytes(buffer[start:end]))
+                self._response_malformed(bytes(buffer[start:start + 1]), e)
+                continue
+            if response is not None:
+                self.process_response(response)
+                responses.append(response)
+        return responses
+
+    def _decode_frame(self, buffer, start, end):
+        char = bytes(buffer[start:start + 1])
+        defn = self.responses.get(char, None)
+        if defn is None:
+            self.stats.unrecognized_received(end - start + 1)
+            return None
+        r = MessageResponse(defn)
+        r.length = end - start + 1
+        r.from_buffer(buffer, start + 1, end)
+        return r
+
     def _decode_response(self) -> Response:
         reader = self._conduit.input
         char = reader.read(1)
         defn = self.responses.get(char, None)
         if defn is None:
             # log.error("Unrecognized command", char)
+            if char:
+                self.stats.unrecognized_received(len(char))
             return None
 
+        line = reader.readline()
         r = MessageResponse(defn)
-        r.from_stream(reader)
+        r.length = len(char) + len(line)
+        try:
+            r.from_buffer(line, 0, len(line.rstrip(b'\r\n')))
+        except ValueError as e:
+            self._response_malformed(char, e)
+            raise
         return r
 
     def __str__(self):
@@ -34,6 +34,21 @@ class VersionParser:
         self.log = 0
         self.parse(s)
 
+    fields = ('major', 'minor', 'revision', 'version', 'build', 'simulator', 'board', 'shield', 'log')
+
+    def as_dict(self):
+        """ the parsed version details as a dict, suitable for serializing """
+        return dict((f, getattr(self, f)) for f in VersionParser.fields)
+
+    @classmethod
+    def from_dict(cls, d):
+        """ restores the version details returned by as_dict """
+        result = cls()
+        for f in cls.fields:
+            if f in d:
+                setattr(result, f, d[f])
+        return result
+
     def parse(self, s):
         if s is None or len(s) == 0:
             pass
@@ -3,6 +3,17 @@ API to controllers running controlbox firmware.
 
 Specific subclasses may add features for specific controller revisions.
 """
+from brewpi.controlbox.codecs.onewire import OneWireBusRead, OneWireCommand, OneWireSwitchConfig, \
+    OneWireTempSensorConfig
+
+
+def read_values(controller, objects):
+    """ reads the values of the objects, in a single exchange with the controller where it supports reading
+    many objects at once, and otherwise one at a time. """
+    batched = getattr(controller, 'read_values', None)
+    if batched is not None:
+        return batched(objects)
+    return [controller.read_value(obj) for obj in objects]
 
 
 class ImmutableCollection:
@@ -30,20 +41,111 @@ class ValueCollection:
         """ retrieves all values, keyed by ID """
 
 
-class TempSensorsCollection(MutableCollection, ValueCollection):
+def address_key(address):
+    """ the 64-bit integer form of a OneWire address, used to index objects by address. The address may be given
+    as a OneWireAddress, the 8 address bytes, or the integer itself. """
+    if isinstance(address, int):
+        return address
+    return int.from_bytes(bytes(getattr(address, 'address', address)), 'little')
+
+
+class InstalledObjectsCollection(MutableCollection, ValueCollection):
+    """
+    The objects of one type installed in a container on the controller. The objects are also indexed by a key
+    derived from their definition, so they can be found without scanning the collection.
+    The collection is kept current by the objects created and deleted through it, and by object_created()
+    and object_deleted(), which are called for the object lifetime events from the controller.
+    """
+
+    def __init__(self, controller, container, object_type, objects=()):
+        """
+        :param controller: the controller the objects are installed in
+        :param container: the container holding the installed objects
+        :param object_type: the type of object created
+        :param objects: the objects already installed
+        """
+        self.controller = controller
+        self.container = container
+        self.object_type = object_type
+        self._items = dict()
+        self._index = dict()
+        for obj in objects:
+            self.object_created(obj)
+
+    def index_key(self, obj):
+        """ the key the object is indexed by """
+        raise NotImplementedError
+
+    def find(self, id):
+        return self._items.get(id)
+
+    def all(self):
+        return dict(self._items)
+
+    def _create(self, definition):
+        obj = self.controller.create_object(self.object_type, definition, self.container)
+        self.object_created(obj)
+        return obj.id_chain
+
+    def delete(self, id):
+        obj = self._items[id]
+        self.controller.delete_object(obj)
+        self.object_deleted(id)
+
+    def accepts(self, obj):
+        """ determines if the object belongs in this collection """
+        return isinstance(obj, self.object_type)
+
+    def object_created(self, obj):
+        """ adds an object created on the controller to the collection, if it is of the collection's type """
+        self.object_deleted(obj.id_chain)
+        if not self.accepts(obj):
+            return
+        self._items[obj.id_chain] = obj
+        self._index[self.index_key(obj)] = obj
+
+    def object_deleted(self, id):
+        """ removes an object deleted on the controller from the collection """
+        obj = self._items.pop(id, None)
+        if obj is not None:
+            key = self.index_key(obj)
+            if self._index.get(key) is obj:
+                del self._index[key]
+
+    def all_values(self):
+        """ retrieves all values, keyed by ID. The objects are read together in a single exchange with the
+        controller, rather than one after the other. """
+        ids, objects = tuple(self._items.keys()), tuple(self._items.values())
+        return dict(zip(ids, read_values(self.controller, objects)))
+
+
+class TempSensorsCollection(InstalledObjectsCollection):
+    """ The installed temperature sensors, with OneWireTempSensorConfig definitions """
     family_ds18b20 = 0x28
 
+    def index_key(self, obj):
+        return address_key(obj.definition.address)
+
+    def create(self, address, offset=0):
+        return self._create(OneWireTempSensorConfig(address, offset))
+
     def all_onewire_addresses(self):
         """ fetches the onewire addresses of all temp sensors """
+        return [obj.definition.address for obj in self._items.values()]
 
     def find_by_address(self, address):
         """ finds a sensor by it's onewire address. """
+        return self._index.get(address_key(address))
 
 
-class SwitchesCollection(MutableCollection, ValueCollection):
+class SwitchesCollection(InstalledObjectsCollection):
+    """ The installed OneWire switches, with OneWireSwitchConfig definitions """
     family_ds2413 = 0x3A
     family_ds2408 = 0x29
 
+    def index_key(self, obj):
+        return address_key(obj.definition.address), obj.definition.pio
+
     def create(self, address, pio):
         """
         persistently adds a new switch to this controller
@@ -51,21 +153,94 @@ class SwitchesCollection(MutableCollection, ValueCollection):
         :param pio: The index of the GPIO to set as output
         :return:
         """
+        return self._create(OneWireSwitchConfig(address, pio))
 
     def find_by_address(self, address, pio):
         """ finds an actuator by onewire address and pio """
+        return self._index.get((address_key(address), pio))
+
+
+def object_references(obj):
+    """ the ids of the objects that the object refers to in its definition. An IndirectValue refers to the object
+    that is its definition, and a PID config to its input and output. """
+    definition = getattr(obj, 'definition', None)
+    if definition is None:
+        return ()
+    if hasattr(definition, 'id_chain'):
+        return (definition.id_chain,)
+    return tuple(ref.id_chain for ref in (getattr(definition, attr, None) for attr in ('input', 'output'))
+                 if hasattr(ref, 'id_chain'))
+
+
+class ReferenceIndex:
+    """
+    Maps each object to the objects that refer to it, so finding what uses an object does not require reading
+    every definition. Like the installed collections, the index is kept current by object_created() and
+    object_deleted() for the object lifetime events from the controller.
+    """
+
+    def __init__(self, references=object_references):
+        """
+        :param references: gives the ids of the objects an object refers to
+        """
+        self.references = references
+        self._referrers = dict()    # id -> set of the ids of the objects referring to it
+        self._targets = dict()      # id -> the ids the object refers to
+
+    def object_created(self, obj):
+        self.object_deleted(obj.id_chain)
+        targets = self.references(obj)
+        if targets:
+            self._targets[obj.id_chain] = targets
+            for target in targets:
+                self._referrers.setdefault(target, set()).add(obj.id_chain)
+
+    def object_deleted(self, id):
+        for target in self._targets.pop(id, ()):
+            referrers = self._referrers[target]
+            referrers.discard(id)
+            if not referrers:
+                del self._referrers[target]
+
+    def clear(self):
+        """ forgets all references, such as when a different profile is activated """
+        self._referrers.clear()
+        self._targets.clear()
+
+    def referrers(self, id):
+        """ the ids of the objects that refer to the object with the given id """
+        return frozenset(self._referrers.get(id, ()))
+
+    def is_referenced(self, id):
+        return id in self._referrers
 
 
 class OneWireBus:
+    """ Runs commands on a OneWire bus object. The result of the command is returned in the response to the
+    write, so each command takes a single exchange with the controller. """
+
+    def __init__(self, controller, bus):
+        """
+        :param controller: the controller the bus is on
+        :param bus: the bus object, with a OneWireBusCodec value
+        """
+        self.controller = controller
+        self.bus = bus
+
+    def _command(self, command) -> OneWireBusRead:
+        return self.controller.write_value(self.bus, command)
 
     def reset(self):
         """resets the bus """
+        return self._command(OneWireCommand.Reset()).success
 
     def search(self):
         """ enumerate all devices on the bus. """
+        return self._command(OneWireCommand.Search()).addresses or []
 
     def search_family(self, family):
         """ enumerates items with the given family """
+        return self._command(OneWireCommand.FamilySearch(family)).addresses or []
 
 
 class PinSwitchesCollection(ImmutableCollection):
@@ -0,0 +1,154 @@
+"""
+A local copy of the objects in a controller and their recently read values, so that repeated reads can be served
+from memory.
+"""
+import threading
+import time
+
+
+class MirrorEntry:
+    """ an object in the mirror, and its last known value """
+    __slots__ = ('obj', 'value', 'updated', 'children')
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.value = None
+        self.updated = None     # the clock time the value was last known, or None if it is not known
+        self.children = set()
+
+
+class ObjectMirror:
+    """
+    A cache of the object tree of a controller, from the root container or active profile down, with the last
+    value read or written for each object. Each value is served for at most max_age seconds, after which it is
+    read again, since the controller changes values without telling the mirror. Values written are stored as they
+    are returned by the controller, so the mirror is write-through.
+
+    A caller that does receive object lifetime or value events can pass them to object_created(), object_deleted()
+    and value_changed() to refresh the mirror sooner.
+
+    Objects are identified by a key, which is the id chain prefixed by a namespace that distinguishes system
+    objects from those in the active profile.
+    """
+
+    def __init__(self, max_age, clock=time.monotonic):
+        """
+        :param max_age: the number of seconds a value is served from the mirror before it is read again
+        :param clock: returns the current time in seconds
+        """
+        if max_age is None or max_age <= 0:
+            raise ValueError("the mirror needs a max_age in seconds, not %s" % max_age)
+        self.max_age = max_age
+        self.clock = clock
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _entry(self, key, obj=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = MirrorEntry(obj)
+            parent = self._entries.get(key[:-1]) if len(key) > 2 else None
+            if parent is not None:
+                parent.children.add(key)
+        elif obj is not None:
+            entry.obj = obj
+        return entry
+
+    def object_created(self, key, obj):
+        """ adds an object to the tree. Any previous object with the same key, and its value, is replaced. """
+        with self._lock:
+            self._remove(key)
+            self._entry(key, obj)
+
+    def object_deleted(self, key):
+        """ removes an object, and the objects it contains """
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        parent = self._entries.get(key[:-1])
+        if parent is not None:
+            parent.children.discard(key)
+        for child in tuple(entry.children):
+            self._remove(child)
+
+    def value_changed(self, key, value):
+        """ records a value of an object reported by an event """
+        with self._lock:
+            entry = self._entry(key)
+            entry.value = value
+            entry.updated = self.clock()
+
+    def invalidate(self, key=None):
+        """ marks the value of an object as unknown, or of all objects when key is None """
+        with self._lock:
+            entries = self._entries.values() if key is None else filter(None, (self._entries.get(key),))
+            for entry in entries:
+                entry.updated = None
+
+    def clear(self):
+        """ forgets all objects, such as when a different profile is activated """
+        with self._lock:
+            self._entries.clear()
+
+    def children(self, key):
+        """ the keys of the objects directly within the container with the given key """
+        with self._lock:
+            entry = self._entries.get(key)
+            return frozenset(entry.children) if entry is not None else frozenset()
+
+    def object(self, key):
+        entry = self._entries.get(key)
+        return entry.obj if entry is not None else None
+
+    def cached(self, key):
+        """ the last known value of the object, or None if it is not known or is stale """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.updated is None:
+                return None
+            if self.clock() - entry.updated > self.max_age:
+                return None
+            return entry
+
+    def lookup(self, key):
+        """ the current entry for the object, or None if the value must be read from the controller.
+        Counts a hit or a miss. """
+        entry = self.cached(key)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def read(self, key, obj, fetch):
+        """ retrieves the value of the object, calling fetch(obj) to read it from the controller only when the
+        mirror does not have a current value """
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry.value
+        value = fetch(obj)
+        self.fetched(key, obj, value)
+        return value
+
+    def fetched(self, key, obj, value):
+        """ records the value read from the controller for the object """
+        with self._lock:
+            entry = self._entry(key, obj)
+            entry.value = value
+            entry.updated = self.clock()
+
+    def written(self, key, obj, value):
+        """ records the value the controller returned after a write to the object """
+        self.fetched(key, obj, value)
@@ -0,0 +1,151 @@
+import unittest
+
+from hamcrest import assert_that, is_
+
+from brewpi.controlbox.codecs.onewire import OneWireAddress, OneWireBusRead, OneWireCommand, \
+    OneWireTempSensorConfig
+from brewpi.stateful.cbox import OneWireBus, ReferenceIndex, SwitchesCollection, TempSensorsCollection, \
+    address_key
+
+
+def address(family, serial):
+    return OneWireAddress(bytearray([family, serial, 0, 0, 0, 0, 0, 0]))
+
+
+class FakeObject:
+
+    def __init__(self, id_chain, definition):
+        self.id_chain = id_chain
+        self.definition = definition
+
+
+class FakeController:
+    """ records the exchanges made with the controller """
+
+    def __init__(self, bus_devices=()):
+        self.bus_devices = list(bus_devices)
+        self.exchanges = []
+        self.values = dict()
+        self.next_slot = 0
+
+    def create_object(self, obj_class, args, container):
+        self.exchanges.append('create')
+        self.next_slot += 1
+        return obj_class((container, self.next_slot), args)
+
+    def delete_object(self, obj):
+        self.exchanges.append('delete')
+
+    def read_values(self, objects):
+        self.exchanges.append('read_values')
+        return [self.values.get(obj.id_chain) for obj in objects]
+
+    def write_value(self, obj, command):
+        self.exchanges.append(command.name)
+        if isinstance(command, OneWireCommand.FamilySearch):
+            return OneWireBusRead(True, [a for a in self.bus_devices if a.address[0] == command.family])
+        return OneWireBusRead(True, list(self.bus_devices))
+
+
+class TempSensorsCollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = FakeController()
+        self.sensors = TempSensorsCollection(self.controller, 1, FakeObject)
+
+    def test_all_values_read_in_one_exchange(self):
+        ids = [self.sensors.create(address(0x28, x)) for x in range(20)]
+        for x, id in enumerate(ids):
+            self.controller.values[id] = x
+        del self.controller.exchanges[:]
+        values = self.sensors.all_values()
+        assert_that(self.controller.exchanges, is_(['read_values']))
+        assert_that(values, is_(dict((id, x) for x, id in enumerate(ids))))
+
+    def test_create_and_delete(self):
+        id = self.sensors.create(address(0x28, 1))
+        assert_that(self.sensors.find(id).definition.address, is_(address(0x28, 1)))
+        assert_that(self.sensors.all_onewire_addresses(), is_([address(0x28, 1)]))
+        self.sensors.delete(id)
+        assert_that(self.sensors.all(), is_({}))
+        assert_that(self.controller.exchanges, is_(['create', 'delete']))
+
+    def test_find_by_address(self):
+        id = self.sensors.create(address(0x28, 1))
+        self.sensors.create(address(0x28, 2))
+        found = self.sensors.find_by_address(address(0x28, 1))
+        assert_that(found.id_chain, is_(id))
+        assert_that(self.sensors.find_by_address(bytes([0x28, 1, 0, 0, 0, 0, 0, 0])), is_(found))
+        assert_that(self.sensors.find_by_address(address(0x28, 3)), is_(None))
+        self.sensors.delete(id)
+        assert_that(self.sensors.find_by_address(address(0x28, 1)), is_(None))
+
+    def test_lifetime_events_update_index(self):
+        obj = FakeObject((1, 5), OneWireTempSensorConfig(address(0x28, 7), 0))
+        self.sensors.object_created(obj)
+        assert_that(self.sensors.find_by_address(address(0x28, 7)), is_(obj))
+        # the slot is reused for a different sensor
+        replacement = FakeObject((1, 5), OneWireTempSensorConfig(address(0x28, 8), 0))
+        self.sensors.object_created(replacement)
+        assert_that(self.sensors.find_by_address(address(0x28, 7)), is_(None))
+        self.sensors.object_deleted((1, 5))
+        assert_that(self.sensors.find_by_address(address(0x28, 8)), is_(None))
+        assert_that(self.sensors.all(), is_({}))
+
+    def test_address_key(self):
+        assert_that(address_key(address(0x28, 1)), is_(0x0128))
+        assert_that(address_key(0x0128), is_(0x0128))
+
+
+class SwitchesCollectionTest(unittest.TestCase):
+
+    def test_find_by_address_and_pio(self):
+        switches = SwitchesCollection(FakeController(), 2, FakeObject)
+        a = switches.create(address(0x3A, 1), 0)
+        b = switches.create(address(0x3A, 1), 1)
+        assert_that(switches.find_by_address(address(0x3A, 1), 1).id_chain, is_(b))
+        assert_that(switches.find_by_address(address(0x3A, 1), 0).id_chain, is_(a))
+        assert_that(switches.find_by_address(address(0x3A, 1), 2), is_(None))
+
+
+class PidConfig:
+
+    def __init__(self, input, output):
+        self.input = input
+        self.output = output
+
+
+class ReferenceIndexTest(unittest.TestCase):
+
+    def test_referrers_follow_lifetime_events(self):
+        index = ReferenceIndex()
+        sensor, actuator = FakeObject((1, 1), None), FakeObject((2, 1), None)
+        index.object_created(sensor)
+        pid = FakeObject((3, 1), PidConfig(sensor, actuator))
+        indirect = FakeObject((3, 2), sensor)
+        index.object_created(pid)
+        index.object_created(indirect)
+        assert_that(index.referrers((1, 1)), is_(frozenset([(3, 1), (3, 2)])))
+        assert_that(index.referrers((2, 1)), is_(frozenset([(3, 1)])))
+        index.object_deleted((3, 1))
+        assert_that(index.is_referenced((2, 1)), is_(False))
+        # the indirect value is redefined to refer to the actuator
+        index.object_created(FakeObject((3, 2), actuator))
+        assert_that(index.is_referenced((1, 1)), is_(False))
+        assert_that(index.referrers((2, 1)), is_(frozenset([(3, 2)])))
+        index.clear()
+        assert_that(index.is_referenced((2, 1)), is_(False))
+
+
+class OneWireBusTest(unittest.TestCase):
+
+    def test_search_family(self):
+        controller = FakeController([address(0x28, 1), address(0x3A, 2)])
+        bus = OneWireBus(controller, None)
+        assert_that(bus.search_family(0x28), is_([address(0x28, 1)]))
+        assert_that(len(bus.search()), is_(2))
+        assert_that(controller.exchanges, is_(['family_search', 'search']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from hamcrest import assert_that, calling, is_, raises
+
+from brewpi.stateful.mirror import ObjectMirror
+from brewpi.protocol.test.clock import FakeClock
+
+
+class Reads:
+    """ counts the reads made from the controller """
+
+    def __init__(self, value):
+        self.value = value
+        self.count = 0
+
+    def __call__(self, obj):
+        self.count += 1
+        return self.value
+
+
+class ObjectMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.mirror = ObjectMirror(10, clock=self.clock)
+
+    def test_max_age_required(self):
+        assert_that(calling(ObjectMirror).with_args(None), raises(ValueError))
+        assert_that(calling(ObjectMirror).with_args(0), raises(ValueError))
+
+    def test_read_is_served_from_memory(self):
+        fetch = Reads(b'\x01')
+        key = ('system', 0)
+        assert_that(self.mirror.read(key, 'id', fetch), is_(b'\x01'))
+        assert_that(self.mirror.read(key, 'id', fetch), is_(b'\x01'))
+        assert_that(fetch.count, is_(1))
+        assert_that((self.mirror.hits, self.mirror.misses), is_((1, 1)))
+
+    def test_stale_values_are_read_again(self):
+        self.mirror.max_age = 1
+        fetch = Reads(5)
+        self.mirror.read(('system', 1), 'time', fetch)
+        self.clock.now = 0.5
+        self.mirror.read(('system', 1), 'time', fetch)
+        self.clock.now = 2
+        self.mirror.read(('system', 1), 'time', fetch)
+        assert_that(fetch.count, is_(2))
+
+    def test_events_and_writes_update_values(self):
+        key = ('profile', 1)
+        self.mirror.object_created(key, 'ticks')
+        assert_that(self.mirror.cached(key), is_(None))
+        self.mirror.value_changed(key, 10)
+        assert_that(self.mirror.read(key, 'ticks', Reads(0)), is_(10))
+        self.mirror.written(key, 'ticks', 20)
+        assert_that(self.mirror.read(key, 'ticks', Reads(0)), is_(20))
+        self.mirror.invalidate(key)
+        assert_that(self.mirror.read(key, 'ticks', Reads(30)), is_(30))
+
+    def test_deleting_container_removes_contents(self):
+        self.mirror.object_created(('profile', 1), 'container')
+        self.mirror.object_created(('profile', 1, 0), 'a')
+        self.mirror.object_created(('profile', 1, 1), 'container')
+        self.mirror.object_created(('profile', 1, 1, 0), 'b')
+        self.mirror.object_created(('profile', 2), 'c')
+        assert_that(self.mirror.children(('profile', 1)), is_(frozenset([('profile', 1, 0), ('profile', 1, 1)])))
+        self.mirror.object_deleted(('profile', 1))
+        assert_that(len(self.mirror), is_(1))
+        assert_that(self.mirror.object(('profile', 2)), is_('c'))
+
+    def test_recreated_object_forgets_value(self):
+        key = ('profile', 1)
+        self.mirror.object_created(key, 'a')
+        self.mirror.value_changed(key, 1)
+        self.mirror.object_created(key, 'b')
+        assert_that(self.mirror.cached(key), is_(None))
+        assert_that(self.mirror.object(key), is_('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()